@@ -0,0 +1,165 @@
+#!/usr/bin/python
+
+"""Throughput and memory benchmark for cacher.py.
+
+Every stage runs in a fresh process so its peak RSS can be measured on its
+own. The stages are:
+- read:   stream every line of every log (decompression included)
+- cacher: cacher() over the streamed lines, the pre-range-mode path
+- parse:  parse_files() for the target date, once per --jobs value, plus
+          the time taken to render the report
+- main:   the end-to-end cacher.py command line
+
+Logs are generated with loggen.py unless --logpath is given. The reports of
+every --jobs value are compared and must be identical.
+"""
+
+import json
+import optparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchDir, '..'))
+sys.path.insert(0, benchDir)
+import cacher  # noqa: E402
+import loggen  # noqa: E402
+
+
+def peak_rss():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss /= 1024
+    return rss / 1024.0
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (usage.ru_utime + usage.ru_stime + children.ru_utime +
+            children.ru_stime)
+
+
+def run_stage(opts):
+    # Runs inside the child process. Prints the measurements as JSON.
+    logFiles = cacher.get_logfiles(opts.logpath)
+    result = {}
+    start, startCpu = time.time(), cpu_time()
+    if opts.stage == 'read':
+        lines = 0
+        for line in cacher.read_logs(logFiles):
+            lines += 1
+        result['lines'] = lines
+    elif opts.stage == 'cacher':
+        report = cacher.cacher(cacher.read_logs(logFiles), opts.targetdate,
+                               True)
+        result['report'] = report
+    elif opts.stage == 'parse':
+        days = cacher.parse_files(logFiles, [opts.targetdate],
+                                  jobs=opts.jobs)
+        result['parse'] = time.time() - start
+        reportStart = time.time()
+        report = cacher.cacher_report(days[opts.targetdate], opts.targetdate,
+                                      True)
+        result['render'] = time.time() - reportStart
+        result['report'] = report
+    elif opts.stage == 'main':
+        sys.argv = ['cacher.py', '--logpath', opts.logpath, '--targetdate',
+                    opts.targetdate, '--nostdout']
+        cacher.main()
+    result['wall'] = time.time() - start
+    result['cpu'] = cpu_time() - startCpu
+    result['rss'] = peak_rss()
+    print json.dumps(result)
+
+
+def measure(opts, stage, jobs=1):
+    cmd = [sys.executable, os.path.abspath(__file__), '--stage', stage,
+           '--logpath', opts.logpath, '--targetdate', opts.targetdate,
+           '--jobs', str(jobs)]
+    output = subprocess.check_output(cmd)
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    o = optparse.OptionParser(usage='%prog [options]')
+    o.add_option('--logpath',
+                 help='Optional: Existing logs to benchmark against.')
+    o.add_option('--targetdate',
+                 help='Optional: Date to report on. Defaults to the first '
+                 'generated day.')
+    o.add_option('--lines', type='int', default=1000000,
+                 help='Lines to generate. Defaults to: 1000000')
+    o.add_option('--days', type='int', default=3,
+                 help='Days to generate. Defaults to: 3')
+    o.add_option('--files', type='int', default=4,
+                 help='Log files to generate. Defaults to: 4')
+    o.add_option('--plain', action='store_true',
+                 help='Do not compress the generated rotated logs.')
+    o.add_option('--jobs', default='1',
+                 help='Comma separated --jobs values to benchmark the parse '
+                 'stage with. Defaults to: 1')
+    o.add_option('--stages', default='read,cacher,parse,main',
+                 help='Comma separated stages to run. Defaults to: '
+                 'read,cacher,parse,main')
+    o.add_option('--stage', help=optparse.SUPPRESS_HELP)
+    opts, args = o.parse_args()
+
+    if opts.stage:
+        opts.jobs = int(opts.jobs)
+        run_stage(opts)
+        return
+
+    tmpDir = None
+    if not opts.logpath:
+        tmpDir = tempfile.mkdtemp()
+        opts.logpath = tmpDir
+        start = time.time()
+        generator = loggen.LogGenerator('2017-01-15', opts.days,
+                                        max(opts.lines // opts.days, 1))
+        loggen.write_logs(tmpDir, generator, opts.files, not opts.plain)
+        print 'Generated %s lines in %.1f seconds' % (opts.lines,
+                                                      time.time() - start)
+    if not opts.targetdate:
+        opts.targetdate = '2017-01-15'
+
+    try:
+        stages = opts.stages.split(',')
+        lines = None
+        reports = {}
+        print '%-10s %10s %10s %14s %12s' % (
+            'stage', 'wall (s)', 'cpu (s)', 'lines/sec', 'peak RSS MB')
+        for stage in stages:
+            for jobs in ([int(x) for x in opts.jobs.split(',')]
+                         if stage == 'parse' else [1]):
+                result = measure(opts, stage, jobs)
+                if 'lines' in result:
+                    lines = result['lines']
+                name = stage if stage != 'parse' else 'parse/%s' % jobs
+                rate = '%14.0f' % (lines / result['wall']) if lines else \
+                    '%14s' % '-'
+                print '%-10s %10.2f %10.2f %s %12.1f' % (
+                    name, result['wall'], result['cpu'], rate, result['rss'])
+                if 'render' in result:
+                    print '%-10s %10.2f' % (' render', result['render'])
+                if 'report' in result:
+                    # The uptime can change between runs.
+                    reports[name] = [x for x in result['report']
+                                     if not x.startswith('Uptime:')]
+        if len(set(json.dumps(x) for x in reports.values())) > 1:
+            print 'ERROR: reports differ between %s' % ', '.join(
+                sorted(reports))
+            sys.exit(1)
+    finally:
+        if tmpDir:
+            shutil.rmtree(tmpDir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+
+"""Benchmark the file type classifier.
+
+Compares cacher.get_filetype() against the regex chain it replaced (the
+extension regex, run twice, then the iCloud regex) on the URLs of synthetic
+GET requests, and the unique files per file type counted while parsing
+against classifying every unique URL again when reporting. Both must give
+the same file types, apart from the types only the table knows (Ex: .dmg).
+"""
+
+import optparse
+import os
+import re
+import sys
+import time
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchDir, '..'))
+sys.path.insert(0, benchDir)
+import cacher  # noqa: E402
+import loggen  # noqa: E402
+
+fileTypePattern = re.compile(r'.+(\.pkg|\.ipa|\.ipsw|\.zip|\.epub)')
+iCloudPattern = re.compile(r'.+icloud')
+# File types the regex chain did not recognize, and .xml files that aren't
+# asset catalogs (no file type for either).
+newURLs = [
+    ('/%s/macOSUpd10.12.3-%s.dmg', 4),
+    ('/%s/com_apple_MobileAsset_SoftwareUpdate/%s.xml', 3),
+    ('/content/catalogs/others/index-%s-%s.merged-1.sucatalog', 1),
+    ('/%s/podcasts/%s/feed.xml', 1),
+]
+
+
+def legacy_filetype(URL):
+    # The file type of a URL as it was before get_filetype().
+    fileType = None
+    if fileTypePattern.match(URL):
+        fileType = fileTypePattern.match(URL).group(1)
+    elif iCloudPattern.match(URL):
+        fileType = 'personal icloud'
+    return fileType
+
+
+def legacy_unique(urlCounts):
+    # The unique files per file type as counted when reporting.
+    fileTypeUniqueCounts = cacher.Counter()
+    for x in urlCounts:
+        fileType = legacy_filetype(x)
+        if fileType is not None:
+            fileTypeUniqueCounts[fileType] += 1
+    return fileTypeUniqueCounts
+
+
+def make_urls(count, assets, seed):
+    generator = loggen.LogGenerator('2017-01-15', 1, 1, seed, assets=assets)
+    generator.fileTypes.extend(loggen.weighted(newURLs))
+    return [generator.url() for i in xrange(count)]
+
+
+def main():
+    o = optparse.OptionParser(usage='%prog [options]')
+    o.add_option('--requests', type='int', default=500000,
+                 help='Number of GET request URLs. Defaults to: 500000')
+    o.add_option('--assets', type='int', default=20000,
+                 help='Number of distinct assets. Defaults to: 20000')
+    o.add_option('--seed', type='int', default=1,
+                 help='Random seed for the synthetic URLs. Defaults to: 1')
+    opts, args = o.parse_args()
+
+    URLs = make_urls(opts.requests, opts.assets, opts.seed)
+    for URL in set(URLs):
+        fileType = cacher.get_filetype(URL)
+        if legacy_filetype(URL) != fileType and not (
+                legacy_filetype(URL) is None and
+                fileType in ('.dmg', 'asset catalog')):
+            print 'Mismatch on URL: %s' % URL
+            sys.exit(1)
+
+    start = time.time()
+    for URL in URLs:
+        legacy_filetype(URL)
+    legacy = time.time() - start
+    start = time.time()
+    for URL in URLs:
+        cacher.get_filetype(URL)
+    current = time.time() - start
+
+    # Unique files per file type: counted while parsing now, by going over
+    # every unique URL when reporting before.
+    day = cacher.DayStats()
+    for URL in URLs:
+        day.add_request('08:41', '10.0.1.5', None, None, None, URL,
+                        cacher.get_filetype(URL))
+    start = time.time()
+    unique = day.unique_filetypes()
+    report = time.time() - start
+    start = time.time()
+    legacyUnique = legacy_unique(day.urlCounts)
+    legacyReport = time.time() - start
+    for fileType, count in legacyUnique.items():
+        if unique[fileType] != count:
+            print 'Unique %s files differ: %s, not %s' % (
+                fileType, unique[fileType], count)
+            sys.exit(1)
+
+    print 'Classified %s URLs (%s unique)' % (len(URLs), len(day.urlCounts))
+    print ' regex chain:  %10.0f URLs/sec' % (len(URLs) / legacy)
+    print ' get_filetype: %10.0f URLs/sec' % (len(URLs) / current)
+    print ' speedup:      %10.2fx' % (legacy / current)
+    print 'Unique files per file type when reporting'
+    print ' regex chain over every unique URL: %8.4f sec' % legacyReport
+    print ' counted while parsing:             %8.4f sec' % report
+
+
+if __name__ == '__main__':
+    main()
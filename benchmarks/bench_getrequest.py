@@ -0,0 +1,135 @@
+#!/usr/bin/python
+
+"""Benchmark the 'Received GET request from' tokenizer.
+
+Compares cacher.parse_getrequest() against the per-line code it replaced
+(str.split, the uncompiled OS/model regexes, the friendlyDarwin loop and the
+file type regex chain) on synthetic log messages. Both must return the same
+values for every line. parse_getrequest() is also timed without its cache of
+resolved client identities.
+"""
+
+import optparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+import cacher  # noqa: E402
+
+userAgents = [
+    'iOS/10.2 model/iPhone7,2',
+    'iOS/10.1.1 model/iPad5,3',
+    'iOS/9.3.5 model/iPod5,1',
+    'iOS/10.2 model/AppleTV5,3',
+    'iOS/10.2.1 model/iPhone9,4',
+    'Darwin/16.3.0',
+    'Darwin/15.6.0',
+    'OS X 10.12.2',
+]
+urls = [
+    '/a-09f98d6971/pre-thinned756.thinned.signed.dpkg.ipa',
+    '/031-8/com_apple_MobileAsset_CoreSuggestion/6c93.zip',
+    '[icloud:hvRq3yMBV7JO9hUBRo2p]',
+    '/content/downloads/47/50/031-94176/OSXUpd10.12.3.pkg',
+    '/iOS10.2/091-84322/iPhone_4.7_10.2_14C92_Restore.ipsw',
+    '/itunes-assets/Publication71/v4/a1/b2/book.epub',
+    '/some/other/asset.bin',
+]
+
+
+def legacy_getrequest(x):
+    # The parse loop as it was before parse_getrequest().
+    logmsg = (x.split(' ', 2) + ['', '', ''])[:3][2]
+    linesplit = str.split(logmsg)
+    ip = linesplit[5].split(":")[0]
+    URL = linesplit[-1]
+    osFamily = re.match(
+        r'.+? ((iOS|Darwin|OS X)[/ ](([0-9]+\.?){1,}))',
+        x).group(1).replace('OS X ', 'macOS/').split('/')[0]
+    osVersion = re.match(
+        r'.+? ((iOS|Darwin|OS X)[/ ](([0-9]+\.?){1,}))',
+        x).group(1).replace('OS X ', 'macOS/').split('/')[1]
+    if osFamily == 'Darwin':
+        osFamily = 'macOS'
+    for k, v in cacher.get_friendlynames('darwin').items():
+        if k == osVersion:
+            osVersion = v
+    iOSModel = None
+    if osFamily == 'iOS':
+        iOSModel = re.match(
+            r'.+? model/([^ ]+?[0-9]+,?[0-9])?', x).group(1)
+    fileType = None
+    if re.match(r'.+(\.pkg|\.ipa|\.ipsw|\.zip|\.epub)', URL):
+        fileType = re.match(
+            r'.+(\.pkg|\.ipa|\.ipsw|\.zip|\.epub)', URL).group(1)
+    elif re.match(r'.+(\icloud)', URL):
+        fileType = 'personal icloud'
+    return ip, osFamily, osVersion, iOSModel, URL, fileType
+
+
+def make_lines(count, seed):
+    rand = random.Random(seed)
+    lines = []
+    for i in range(count):
+        lines.append(
+            '2017-01-15 08:41:55.412 #%08x Received GET request from '
+            '10.%d.%d.%d:%d, user agent: com.apple.appstored/1.0 %s '
+            'build/14C92 (6; dt:133), for %s\n' % (
+                rand.getrandbits(32), rand.randint(0, 255),
+                rand.randint(0, 255), rand.randint(1, 254),
+                rand.randint(1024, 65535), rand.choice(userAgents),
+                rand.choice(urls)))
+    return lines
+
+
+class Uncached(dict):
+    # Resolves every client identity again, like a cache that never hits.
+    def __missing__(self, identity):
+        return cacher.resolve_identity(identity)
+
+
+def run(func, lines):
+    start = time.time()
+    for line in lines:
+        func(line)
+    return time.time() - start
+
+
+def main():
+    o = optparse.OptionParser(usage='%prog [options]')
+    o.add_option('--lines', type='int', default=200000,
+                 help='Number of GET lines to parse. Defaults to: 200000')
+    o.add_option('--seed', type='int', default=1,
+                 help='Random seed for the synthetic lines. Defaults to: 1')
+    opts, args = o.parse_args()
+
+    lines = make_lines(opts.lines, opts.seed)
+    for line in lines:
+        logmsg = line.split(' ', 2)[2]
+        if cacher.parse_getrequest(logmsg) != legacy_getrequest(line):
+            print 'Mismatch on line: %s' % line
+            sys.exit(1)
+
+    legacy = run(legacy_getrequest, lines)
+    current = run(lambda x: cacher.parse_getrequest(x.split(' ', 2)[2]),
+                  lines)
+    identityCache = cacher.identityCache
+    cacher.identityCache = Uncached()
+    try:
+        uncached = run(
+            lambda x: cacher.parse_getrequest(x.split(' ', 2)[2]), lines)
+    finally:
+        cacher.identityCache = identityCache
+    print 'Parsed %s GET lines' % len(lines)
+    print ' legacy:           %10.0f lines/sec' % (len(lines) / legacy)
+    print ' uncached:         %10.0f lines/sec' % (len(lines) / uncached)
+    print ' parse_getrequest: %10.0f lines/sec' % (len(lines) / current)
+    print ' speedup:          %10.2fx' % (legacy / current)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/python
+
+"""Benchmark the memory-mapped scan of uncompressed logs.
+
+Parses a whole uncompressed log twice: once line by line (read_logrange(),
+the loop every line used to go through) and once with scan_logrange(), which
+only hands parse_days() the lines holding bandwidthMarker or requestMarker.
+Both must give the same stats and line counts.
+
+The log is generated with loggen.py unless --logfile is given. Use --lines
+20000000 or more for a multi-GB log.
+"""
+
+import json
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchDir, '..'))
+sys.path.insert(0, benchDir)
+import cacher  # noqa: E402
+import loggen  # noqa: E402
+
+
+def run(lines, ruleCounts):
+    start = time.time()
+    days = cacher.parse_days(lines, None, ruleCounts=ruleCounts)
+    return time.time() - start, json.dumps(
+        dict((datestr, day.to_dict()) for datestr, day in days.items()),
+        sort_keys=True)
+
+
+def main():
+    o = optparse.OptionParser(usage='%prog [options]')
+    o.add_option('--logfile',
+                 help='Optional: Existing uncompressed log to benchmark '
+                 'against.')
+    o.add_option('--lines', type='int', default=2000000,
+                 help='Lines to generate. Defaults to: 2000000')
+    o.add_option('--chatter', type='float', default=0.8,
+                 help='Share of generated lines that are neither bandwidth '
+                 'nor GET request lines. Defaults to: 0.8')
+    opts, args = o.parse_args()
+
+    tmpDir = None
+    logFile = opts.logfile
+    if not logFile:
+        tmpDir = tempfile.mkdtemp()
+        start = time.time()
+        generator = loggen.LogGenerator('2017-01-15', 3,
+                                        max(opts.lines // 3, 1),
+                                        chatter=opts.chatter)
+        logFile = loggen.write_logs(tmpDir, generator, 1, False)[0]
+        print 'Generated %s lines in %.1f seconds' % (opts.lines,
+                                                      time.time() - start)
+    try:
+        size = os.path.getsize(logFile)
+        legacyCounts = cacher.Counter()
+        scanCounts = cacher.Counter()
+        legacy, legacyDays = run(cacher.read_logrange(logFile, 0, size),
+                                 legacyCounts)
+        scan, scanDays = run(cacher.scan_logrange(logFile, 0, size,
+                                                  scanCounts), scanCounts)
+        if legacyDays != scanDays or \
+                legacyCounts['lines'] != scanCounts['lines']:
+            print 'ERROR: scan_logrange() and the line loop differ'
+            sys.exit(1)
+        lines = legacyCounts['lines']
+        mb = size / 1024.0 / 1024.0
+        print 'Parsed %s lines (%.1f MB)' % (lines, mb)
+        print ' line loop:     %10.0f lines/sec %8.1f MB/sec' % (
+            lines / legacy, mb / legacy)
+        print ' scan_logrange: %10.0f lines/sec %8.1f MB/sec' % (
+            lines / scan, mb / scan)
+        print ' speedup:       %10.2fx' % (legacy / scan)
+    finally:
+        if tmpDir:
+            shutil.rmtree(tmpDir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+#!/usr/bin/python
+
+"""Generate synthetic Caching Server (Server 5.2+) debug logs.
+
+The logs contain everything cacher.py looks at:
+- 'Since server start' bandwidth lines (with the occasional server restart)
+- 'Received GET request from' lines with iOS, Darwin and OS X user agents,
+  model identifiers and every recognized file type, including personal
+  iCloud data
+- 'Received GET request by' lines without a client identity
+- other debug chatter cacher.py has to skip
+
+The output is split into a live Debug.log and older rotated logs, which can
+be compressed with bz2 like the Caching Server does.
+"""
+
+from datetime import datetime, timedelta
+import bz2
+import optparse
+import os
+import random
+import sys
+
+userAgents = [
+    ('iOS/10.2 model/iPhone7,2', 14),
+    ('iOS/10.2 model/iPhone8,1', 10),
+    ('iOS/10.2.1 model/iPhone9,3', 8),
+    ('iOS/10.1.1 model/iPhone9,4', 5),
+    ('iOS/10.2 model/iPad5,3', 7),
+    ('iOS/9.3.5 model/iPad2,5', 3),
+    ('iOS/10.2 model/iPad6,7', 2),
+    ('iOS/9.3.5 model/iPod5,1', 2),
+    ('iOS/10.2 model/iPod7,1', 2),
+    ('iOS/10.1 model/AppleTV5,3', 3),
+    ('iOS/10.2 model/iPhone10,3', 1),
+    ('Darwin/16.3.0', 8),
+    ('Darwin/16.4.0', 4),
+    ('Darwin/15.6.0', 3),
+    ('OS X 10.12.2', 3),
+    ('OS X 10.11.6', 2),
+]
+fileTypes = [
+    ('/%s/pre-thinned%s.thinned.signed.dpkg.ipa', 45),
+    ('/content/downloads/%s/%s/OSXUpd10.12.3.pkg', 10),
+    ('/iOS10.2/%s/iPhone_4.7_10.2_%s_Restore.ipsw', 3),
+    ('/%s/com_apple_MobileAsset_CoreSuggestion/%s.zip', 15),
+    ('/itunes-assets/Publication%s/v4/%s/book.epub', 5),
+    ('[icloud:%s%s]', 12),
+    ('/%s/%s.bin', 10),
+]
+chatter = [
+    'Served all %s bytes of item %s',
+    'Response to request %s sent (%s bytes)',
+    'Evicted %s bytes in %s assets',
+    'Registration status: 200 OK, next check in %s seconds, %s peers',
+]
+units = [('TB', 1024 ** 4), ('GB', 1024 ** 3), ('MB', 1024 ** 2),
+         ('KB', 1024)]
+
+
+def weighted(choices):
+    # Expand [(value, weight)] into a list to pick from uniformly.
+    values = []
+    for value, weight in choices:
+        values.extend([value] * weight)
+    return values
+
+
+def format_bytes(amount):
+    for unit, size in units:
+        if amount >= size:
+            return '%.2f %s' % (float(amount) / size, unit)
+    return '%d bytes' % amount
+
+
+class LogGenerator(object):
+    # Produces log lines one at a time, in chronological order.
+    def __init__(self, startDate, days, linesPerDay, seed=1, clients=5000,
+                 assets=20000, restarts=0, chatter=0.45):
+        self.random = random.Random(seed)
+        self.start = datetime.strptime(startDate, '%Y-%m-%d')
+        self.days = days
+        self.linesPerDay = linesPerDay
+        self.clients = clients
+        self.assets = assets
+        self.restarts = restarts
+        # The share of lines cacher.py has to skip.
+        self.chatter = chatter
+        self.userAgents = weighted(userAgents)
+        self.fileTypes = weighted(fileTypes)
+        # Every asset keeps the URL (and file type) it was first given.
+        self.urls = {}
+        # Bytes returned to clients, stored from Apple and from peers since
+        # the (simulated) server start.
+        self.counters = [0, 0, 0]
+
+    def client(self):
+        # A few clients are a lot busier than the rest.
+        rand = self.random
+        if rand.random() < 0.3:
+            client = int(rand.paretovariate(1.2)) % self.clients
+        else:
+            client = int(rand.random() * self.clients)
+        return '10.%d.%d.%d:%d' % (client >> 16 & 255, client >> 8 & 255,
+                                   client & 255,
+                                   49152 + rand.getrandbits(14))
+
+    def url(self):
+        # Popular assets get most of the requests.
+        rand = self.random
+        if rand.random() < 0.6:
+            asset = int(rand.paretovariate(0.8)) % self.assets
+        else:
+            asset = int(rand.random() * self.assets)
+        url = self.urls.get(asset)
+        if url is None:
+            url = self.urls[asset] = rand.choice(self.fileTypes) % (
+                '%03d-%05d' % (asset % 997, asset), asset)
+        return url
+
+    def bandwidth_line(self):
+        rand = self.random
+        self.counters[0] += rand.randint(0, 512 * 1024 ** 2)
+        self.counters[1] += rand.randint(0, 64 * 1024 ** 2)
+        if rand.random() < 0.1:
+            self.counters[2] += rand.randint(0, 32 * 1024 ** 2)
+        return ('Since server start: %s returned to clients, %s stored from '
+                'Internet, %s from peers; 0 bytes imported.' % tuple(
+                    format_bytes(x) for x in self.counters))
+
+    def message(self):
+        rand = self.random
+        r = rand.random()
+        if r < 0.02:
+            return self.bandwidth_line()
+        if r < 0.05:
+            return '#%08x Received GET request by "%s", for %s' % (
+                rand.getrandbits(32),
+                rand.choice(['unknown', 'com.apple.softwareupdated']),
+                self.url())
+        if r < 1 - self.chatter:
+            return ('#%08x Received GET request from %s, user agent: '
+                    'com.apple.appstored/1.0 %s build/14C92 (6; dt:133), '
+                    'for %s' % (rand.getrandbits(32), self.client(),
+                                rand.choice(self.userAgents), self.url()))
+        return '#%08x %s' % (rand.getrandbits(32), rand.choice(chatter) % (
+            rand.getrandbits(30), rand.getrandbits(9)))
+
+    def lines(self):
+        restartAt = set(self.random.sample(
+            xrange(self.days * self.linesPerDay),
+            min(self.restarts, self.days * self.linesPerDay)))
+        number = 0
+        for day in range(self.days):
+            dayStart = self.start + timedelta(day)
+            datestr = dayStart.strftime('%Y-%m-%d')
+            for i in xrange(self.linesPerDay):
+                if number in restartAt:
+                    self.counters = [0, 0, 0]
+                number += 1
+                ms = i * 86400000 // self.linesPerDay
+                timestr = '%02d:%02d:%02d.%03d' % (
+                    ms // 3600000, ms // 60000 % 60, ms // 1000 % 60,
+                    ms % 1000)
+                yield '%s %s %s\n' % (datestr, timestr, self.message())
+
+
+def write_logs(outDir, generator, files=1, compress=True):
+    # Split the generated lines over files logs. The last one is the live
+    # Debug.log, the older ones are rotated (and compressed) archives.
+    if not os.path.isdir(outDir):
+        os.makedirs(outDir)
+    total = generator.days * generator.linesPerDay
+    perFile = total // files + 1
+    paths = []
+    lines = generator.lines()
+    for index in range(files):
+        if index == files - 1:
+            path = os.path.join(outDir, 'Debug.log')
+        else:
+            path = os.path.join(outDir, 'Debug-%03d.log' % index)
+            if compress:
+                path += '.bz2'
+        if path.endswith('.bz2'):
+            f = bz2.BZ2File(path, 'wb')
+        else:
+            f = open(path, 'wb')
+        with f:
+            # Write in batches, bz2 is a lot slower line by line.
+            batch = []
+            for count, line in enumerate(lines):
+                batch.append(line)
+                if len(batch) >= 10000:
+                    f.write(''.join(batch))
+                    batch = []
+                if count + 1 >= perFile:
+                    break
+            f.write(''.join(batch))
+        # Rotated logs are older than the live one.
+        stamp = 1000000000 + index * 86400
+        os.utime(path, (stamp, stamp))
+        paths.append(path)
+    return paths
+
+
+def main():
+    o = optparse.OptionParser(usage='%prog [options] OUTDIR')
+    o.add_option('--lines', type='int', default=1000000,
+                 help='Total number of lines. Defaults to: 1000000')
+    o.add_option('--days', type='int', default=3,
+                 help='Number of days to spread the lines over. '
+                 'Defaults to: 3')
+    o.add_option('--startdate', default='2017-01-15',
+                 help='First day of the logs. Defaults to: 2017-01-15')
+    o.add_option('--files', type='int', default=4,
+                 help='Number of log files. Defaults to: 4')
+    o.add_option('--plain', action='store_true',
+                 help='Do not compress the rotated logs with bz2.')
+    o.add_option('--clients', type='int', default=5000,
+                 help='Number of distinct clients. Defaults to: 5000')
+    o.add_option('--assets', type='int', default=20000,
+                 help='Number of distinct assets. Defaults to: 20000')
+    o.add_option('--restarts', type='int', default=0,
+                 help='Number of server restarts. Defaults to: 0')
+    o.add_option('--chatter', type='float', default=0.45,
+                 help='Share of lines that are neither bandwidth nor GET '
+                 'request lines. Defaults to: 0.45')
+    o.add_option('--seed', type='int', default=1,
+                 help='Random seed. Defaults to: 1')
+    opts, args = o.parse_args()
+    if len(args) != 1:
+        o.error('OUTDIR is required')
+
+    generator = LogGenerator(opts.startdate, opts.days,
+                             max(opts.lines // opts.days, 1), opts.seed,
+                             opts.clients, opts.assets, opts.restarts,
+                             min(max(opts.chatter, 0.0), 0.95))
+    for path in write_logs(args[0], generator, max(opts.files, 1),
+                           not opts.plain):
+        print path
+
+
+if __name__ == '__main__':
+    sys.exit(main())
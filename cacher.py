@@ -1,19 +1,36 @@
 #!/usr/bin/python
 
-from datetime import date, timedelta
-from distutils.version import LooseVersion
+from array import array
+from collections import Counter, defaultdict, deque
+from contextlib import closing, contextmanager
+from datetime import date, datetime, timedelta
+import Queue
+import base64
+import bisect
+import bz2
 import glob
+import hashlib
+import heapq
+import io
 import json
-import logging
+import math
+import mmap
 import optparse
 import os
-import plistlib
 import re
-import shutil
+import resource
+import socket
+import struct
 import subprocess
 import sys
 import tempfile
-import urllib2
+import threading
+import time
+import zlib
+
+# The HTTP, plist, SQLite, profiling and multiprocessing modules are imported
+# by the functions that need them, so importing cacher (or parsing archived
+# logs on any platform) stays quick.
 
 """Cacher rewritten in Python.
 Inspired by Michael Lynn https://gist.github.com/pudquick/ffdbdb52ae6960ca8e55
@@ -29,126 +46,1371 @@ Author: Erik Gomez
 Last Updated: 02-19-2017
 """
 version = '3.0.3'
+# Bump whenever the layout of the aggregate cache changes.
+cacheVersion = 12
+# Bump whenever the layout of the stored sketches changes.
+sketchVersion = 1
+# Bump whenever the tables of the rollup store change.
+rollupVersion = 1
+rollupSchema = '''
+CREATE TABLE IF NOT EXISTS days (
+    date TEXT PRIMARY KEY, requests INTEGER, noidentity INTEGER,
+    restarts INTEGER, uniqueips INTEGER, uniquefiles INTEGER,
+    ipsketch TEXT, urlsketch TEXT);
+CREATE TABLE IF NOT EXISTS hours (
+    date TEXT, hour INTEGER, toclients REAL, fromapple REAL, frompeers REAL,
+    requests INTEGER, PRIMARY KEY (date, hour));
+CREATE TABLE IF NOT EXISTS models (
+    date TEXT, model TEXT, name TEXT, requests INTEGER);
+CREATE TABLE IF NOT EXISTS os (
+    date TEXT, family TEXT, version TEXT, requests INTEGER);
+CREATE TABLE IF NOT EXISTS filetypes (
+    date TEXT, filetype TEXT, requests INTEGER, uniquefiles INTEGER);
+CREATE INDEX IF NOT EXISTS models_date ON models (date);
+CREATE INDEX IF NOT EXISTS os_date ON os (date);
+CREATE INDEX IF NOT EXISTS filetypes_date ON filetypes (date);
+'''
+rollupTables = ['days', 'hours', 'models', 'os', 'filetypes']
+# Alerts. HTTP requests time out after httpTimeout seconds and are retried
+# httpRetries times, waiting httpBackoff seconds (doubling every time) in
+# between.
+httpTimeout = 10
+httpRetries = 3
+httpBackoff = 1.0
+serverCommand = '/Applications/Server.app/Contents/ServerRoot/usr/sbin/server'
+iconLookupURL = 'https://itunes.apple.com/lookup?id=883878097'
+# Used when the lookup fails.
+iconFallbackURL = ('http://is5.mzstatic.com/image/thumb/Purple122/v4/b9/e8/'
+                   'c4/b9e8c4b9-ce9c-174a-c1a8-d0ad0fc21da9/source/'
+                   '100x100bb.png')
+# Look the icon up again once the cached one is a week old.
+iconCacheAge = 7 * 24 * 60 * 60
+# The default --iconcache. /private/tmp only exists on macOS, anywhere else
+# (Ex: --fleet reports on Linux) it goes in the temporary directory.
+if sys.platform == 'darwin':
+    iconCacheFile = '/private/tmp/cacher_icon.json'
+else:
+    iconCacheFile = os.path.join(tempfile.gettempdir(), 'cacher_icon.json')
+# The busiest clients and /24 subnets (and files with --approximate) are
+# counted in at most 2 * topCapacity entries each, however many there are.
+# --top and --topfiles can show up to topCapacity of them.
+topCapacity = 1000
+# Distinct IPv4 addresses are kept per /16 network: the last two parts of
+# the addresses as a sorted array of 2 bytes each, until a bitmap of the whole
+# network (ipv4BitmapSize bytes) is smaller.
+ipv4BitmapSize = 65536 // 8
+# The number of bits set in every byte.
+bitCounts = [bin(x).count('1') for x in range(256)]
+# Every log line starts with 'datestr timestr'. Ex: 2017-01-15 08:41:55.412
+logDate = re.compile(r'\d{4}-\d{2}-\d{2}$')
+logStamp = re.compile(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}')
+logStampLength = len('2017-01-15 08:41:55')
+# Uncompressed logs are split into ranges of at least this many bytes when
+# parsing in parallel.
+minChunkSize = 32 * 1024 * 1024
+# Bytes read from the live log at a time in --follow mode.
+followReadSize = 1024 * 1024
+# Uncompressed logs are scanned for the lines parse_days() uses (bandwidth
+# and GET requests) by searching for these markers, mapping scanWindow bytes
+# of the log at a time.
+bandwidthMarker = 'start:'
+requestMarker = 'Received GET request'
+scanWindow = 16 * 1024 * 1024
+# Archives are decompressed by up to decompressThreads background threads
+# (bz2 lets other threads run while it works), decompressBlockSize bytes at a
+# time, and handed to the parser through queues of up to decompressQueueSize
+# blocks. With a single CPU there is nothing to overlap, so the parser
+# decompresses them itself.
+decompressThreads = min(4, os.sysconf('SC_NPROCESSORS_ONLN') - 1)
+decompressBlockSize = 1024 * 1024
+decompressQueueSize = 8
+# Units of the 'Since server start' bandwidth counters.
+byteUnits = {
+    'bytes': 1,
+    'KB': 1024,
+    'MB': 1024 ** 2,
+    'GB': 1024 ** 3,
+    'TB': 1024 ** 4,
+}
+logTime = re.compile(r'\d{2}:\d{2}(:\d{2})?$')
+# The parts version_key() compares: numbers, lowercase words and anything in
+# between, dots aside.
+versionPart = re.compile(r'\d+|[a-z]+|[^\da-z.]+')
+# The client identity of a 'Received GET request from' log message, the
+# part between the IP and the URL. In order: the OS family, separator and
+# version and the iOS model.
+clientIdentity = re.compile(
+    r'(?:.*? (iOS|Darwin|OS X)([/ ])([0-9]+(?:\.[0-9]+)*\.?))?'
+    r'(?:.*? model/([^ ]+?[0-9]+,?[0-9])?)?')
+iOSModelPattern = re.compile(r'.*? model/([^ ]+?[0-9]+,?[0-9])?')
+# Only a few thousand different client identities show up in the logs, so
+# the resolved ones are kept. The identityCacheSize most recently used stay.
+identityCacheSize = 10000
+# Friendly Darwin versions for macOS. This allows us to dynamically add
+# the macOS version (for the alert), while dynamically looping through the
+# logs.
+friendlyDarwin = {
+    '16.4.0': '10.12.3',
+    '16.3.0': '10.12.2',
+    '16.1.0': '10.12.1',
+    '16.0.0': '10.12.0',
+    '10.12': '10.12.0',  # match 10.12 to 10.12.0 for consistency
+    '15.6.0': '10.11.6',
+    '15.5.0': '10.11.5',
+    '15.4.0': '10.11.4',
+    '15.3.0': '10.11.3',
+    '15.2.0': '10.11.2',
+    '15.0.0': '10.11.0/1',
+    '14.5.0': '10.10.5',
+    '14.4.0': '10.10.4',
+    '14.3.0': '10.10.3',
+    '14.1.1': '10.12.2',
+    '14.1.0': '10.10.2',
+    '14.0.0': '10.10.0/1',
+}
+# Friendly Models of known models. This allows us to dynamically add the
+# names to each model (for the alert), while dynamically looping through
+# the logs.
+friendlyModels = {
+    'AppleTV3,1': '3rd Generation Apple TVs',
+    'AppleTV3,2': '4th Generation Apple TVs',
+    'AppleTV5,3': '5th Generation Apple TVs',
+    'iPhone3,1': 'iPhone 4 [GSM]',
+    'iPhone3,2': 'iPhone 4 [GSM 2012]',
+    'iPhone3,3': 'iPhone 4 [CDMA]',
+    'iPhone4,1': 'iPhone 4S',
+    'iPhone5,1': 'iPhone 5 [GSM]',
+    'iPhone5,2': 'iPhone 5 [CDMA]',
+    'iPhone5,3': 'iPhone 5C',
+    'iPhone5,4': 'iPhone 5C [Global]',
+    'iPhone6,1': 'iPhone 5S',
+    'iPhone6,2': 'iPhone 5S [China Model]',
+    'iPhone7,1': 'iPhone 6 Plus',
+    'iPhone7,2': 'iPhone 6',
+    'iPhone8,1': 'iPhone 6S',
+    'iPhone8,2': 'iPhone 6S Plus',
+    'iPhone8,4': 'iPhone SE',
+    'iPhone9,1': 'iPhone 7 [Global]',
+    'iPhone9,2': 'iPhone 7 Plus [Global]',
+    'iPhone9,3': 'iPhone 7 [GSM]',
+    'iPhone9,4': 'iPhone 7 Plus [GSM]',
+    'iPad2,1': 'iPad 2nd Generation [Wifi]',
+    'iPad2,2': 'iPad 2nd Generation [Wifi + GSM]',
+    'iPad2,3': 'iPad 2nd Generation [Wifi + CDMA]',
+    'iPad2,4': 'iPad 2nd Generation [M2012 Wifi Revision]',
+    'iPad2,5': 'iPad Mini 1st Generation [Wifi]',
+    'iPad2,6': 'iPad Mini 1st Generation [Wifi + GSM]',
+    'iPad2,7': 'iPad Mini 1st Generation [Wifi + CDMA]',
+    'iPad3,1': 'iPad 3rd Generation [Wifi]',
+    'iPad3,2': 'iPad 3rd Generation [Wifi + GSM]',
+    'iPad3,3': 'iPad 3rd Generation [Wifi + CDMA]',
+    'iPad3,4': 'iPad 4th Generation [Wifi]',
+    'iPad3,5': 'iPad 4th Generation [Wifi + GSM]',
+    'iPad3,6': 'iPad 4th Generation [Wifi + CDMA]',
+    'iPad4,1': 'iPad Air 1st Generation [Wifi]',
+    'iPad4,2': 'iPad Air 1st Generation [Wifi + Cellular]',
+    'iPad4,3': 'iPad Air 1st Generation [China Model]',
+    'iPad4,4': 'iPad Mini 2nd Generation [Wifi]',
+    'iPad4,5': 'iPad Mini 2nd Generation [Wifi + Cellular]',
+    'iPad4,6': 'iPad Mini 2nd Generation [China Model]',
+    'iPad4,7': 'iPad Mini 3rd Generation [Wifi]',
+    'iPad4,8': 'iPad Mini 3rd Generation [Wifi + Cellular]',
+    'iPad4,9': 'iPad Mini 3rd Generation [China Model]',
+    'iPad5,1': 'iPad Mini 4th Generation [Wifi]',
+    'iPad5,2': 'iPad Mini 4th Generation [Wifi + Cellular]',
+    'iPad5,3': 'iPad Air 2nd Generation [Wifi]',
+    'iPad5,4': 'iPad Air 2nd Generation [Wifi + Cellular]',
+    'iPad6,3': 'iPad Pro 9.7 Inch 1st Generation [Wifi]',
+    'iPad6,4': 'iPad Pro 9.7 Inch 1st Generation [Wifi + Cellular]',
+    'iPad6,7': 'iPad Pro 12.9 Inch 1st Generation [Wifi]',
+    'iPad6,8': 'iPad Pro 12.9 Inch 1st Generation [Wifi + Cellular]',
+    'iPod5,1': 'iPod Touch 5th Generation',
+    'iPod7,1': 'iPod Touch 6th Generation'
+}
+# More friendly versions and names, Ex: {"darwin": {"16.5.0": "10.12.4"},
+# "models": {"iPhone10,3": "iPhone X"}}. New ones can be added to this
+# optional file without changing Cacher, and it can override the ones
+# above. It is only read once a name is needed.
+friendlyNamesFile = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 'friendlynames.json')
+friendlyTables = {}
+# File types of the requested URLs, looked up by the start of the URL and
+# then by the extension of its path. Extensions in fileTypePaths are only a
+# file type if the path also holds one of the given parts. New types can be
+# added to any table. Ex:
+# 1. '/a-09f98d6971/pre-thinned756.thinned.signed.dpkg.ipa'
+# 2. '/031-8/com_apple_MobileAsset_CoreSuggestion/6c93.zip'
+# 3. '[icloud:hvRq3yMBV7JO9hUBRo2p]'
+# Example 3 is Personal iCloud data. Since it has no discernable suffix,
+# log a value of 'personal icloud'. :shrug:
+fileTypePrefixes = {
+    '[icloud:': 'personal icloud',
+}
+fileTypeSuffixes = {
+    '.dmg': '.dmg',
+    '.epub': '.epub',
+    '.ipa': '.ipa',
+    '.ipsw': '.ipsw',
+    '.pkg': '.pkg',
+    '.zip': '.zip',
+    # Software update catalogs.
+    '.sucatalog': 'asset catalog',
+}
+fileTypePaths = {
+    # Mobile asset catalogs, not any other .xml (Ex: plists, feeds). Ex:
+    # '/assets/com_apple_MobileAsset_SoftwareUpdate/com_apple_MobileAsset_
+    # SoftwareUpdate.xml'
+    '.xml': [('/com_apple_MobileAsset_', 'asset catalog')],
+}
+# Checked with a single str.startswith() call.
+fileTypeStarts = tuple(fileTypePrefixes)
+
+
+class DayStats(object):
+    # Everything collected from the logs for a single date. The counts are
+    # kept up to date while the lines are parsed, and two DayStats can be
+    # merged (Ex: one per log file). cacher_report() turns one of these into
+    # the final output.
+    # With a sketchError, unique IPs and files are estimated with
+    # HyperLogLog sketches instead of keeping every distinct IP and URL.
+    # With a sampleRate, only that share of the GET requests was counted
+    # (see parse_days()). The bandwidth is always exact.
+    # Counters are stored as [item, count] pairs in the aggregate cache.
+    counters = ['osCounts', 'modelCounts', 'fileTypeCounts', 'urlCounts',
+                'fileTypeUniqueCounts', 'requestMinutes']
+
+    def __init__(self, sketchError=None, sampleRate=None):
+        self.noClientIdentityCount = 0
+        self.AC2Count = 0
+        self.requestCount = 0
+        # The first and last 'Since server start' samples of the day as
+        # ['HH:MM', bytes to clients, bytes from Apple, bytes from peers].
+        self.firstSample = None
+        self.lastSample = None
+        # Bytes to clients, from Apple and from peers between the samples.
+        # A counter going down means the server restarted, so the samples
+        # after a restart count from zero.
+        self.bandwidth = [0.0, 0.0, 0.0]
+        self.restarts = 0
+        # The same per minute of the day. Ex: {'08:41': [1048576.0, 0.0, 0.0]}
+        self.bandwidthMinutes = {}
+        # GET requests per minute of the day. Ex: {'08:41': 12}
+        self.requestMinutes = Counter()
+        # Distinct IPv4 addresses, packed into 32-bit integers. Anything
+        # else (Ex: IPv6) is kept as a string in otherAddresses.
+        self.ipv4Addresses = IPv4Set()
+        self.otherAddresses = set()
+        # Ex: {('10.2', 'iOS'): 40, ('10.12.2', 'macOS'): 3}
+        self.osCounts = Counter()
+        # Ex: {'iPhone7,2': 25}
+        self.modelCounts = Counter()
+        # Ex: {'.ipa': 31, 'personal icloud': 2}
+        self.fileTypeCounts = Counter()
+        # Ex: {'/031-8/com_apple_MobileAsset_CoreSuggestion/6c93.zip': 4}
+        self.urlCounts = Counter()
+        # The unique files of urlCounts per file type. Ex: {'.ipa': 12}
+        self.fileTypeUniqueCounts = Counter()
+        self.sketchError = sketchError
+        self.sampleRate = sampleRate
+        self.ipSketch = None
+        self.urlSketch = None
+        # Ex: {'.ipa': HyperLogLog}
+        self.fileTypeSketches = {}
+        # GET requests of the busiest clients and /24 subnets. Subnets are
+        # kept without the last part of the address. Ex: '10.0.1'
+        self.topClients = SpaceSaving()
+        self.topSubnets = SpaceSaving()
+        # Without a sketchError, the requests of every file are in urlCounts.
+        self.topFiles = None
+        if sketchError:
+            self.ipSketch = HyperLogLog(sketchError)
+            self.urlSketch = HyperLogLog(sketchError)
+            self.topFiles = SpaceSaving()
+
+    def add_bandwidth(self, minute, sample):
+        # Count a 'Since server start' line. sample is the [to clients, from
+        # Apple, from peers] counters in bytes, logged at minute ('HH:MM').
+        if self.lastSample is None:
+            self.firstSample = [minute] + sample
+        else:
+            self.add_delta(minute, self.lastSample[1:], sample)
+        self.lastSample = [minute] + sample
+
+    def add_delta(self, minute, previous, sample):
+        if any(x < y for x, y in zip(sample, previous)):
+            self.restarts += 1
+            delta = sample
+        else:
+            delta = [x - y for x, y in zip(sample, previous)]
+        if any(delta):
+            bucket = self.bandwidthMinutes.setdefault(minute, [0.0, 0.0, 0.0])
+            for i in range(3):
+                bucket[i] += delta[i]
+                self.bandwidth[i] += delta[i]
+
+    def add_request(self, minute, ip, osFamily, osVersion, iOSModel, URL,
+                    fileType):
+        # Count a single 'Received GET request from' line.
+        self.requestCount += 1
+        self.requestMinutes[minute] += 1
+        self.topClients[ip] += 1
+        if ':' not in ip:
+            self.topSubnets[ip[:ip.rfind('.')]] += 1
+        if self.sketchError:
+            self.ipSketch.add(ip)
+            self.urlSketch.add(URL)
+            self.topFiles[URL] += 1
+            if fileType is not None:
+                if fileType not in self.fileTypeSketches:
+                    self.fileTypeSketches[fileType] = HyperLogLog(
+                        self.sketchError)
+                self.fileTypeSketches[fileType].add(URL)
+        else:
+            packed = pack_ipv4(ip)
+            if packed is None:
+                self.otherAddresses.add(ip)
+            else:
+                self.ipv4Addresses.add(packed)
+            if fileType is not None and URL not in self.urlCounts:
+                self.fileTypeUniqueCounts[fileType] += 1
+            self.urlCounts[URL] += 1
+        if osFamily is not None:
+            self.osCounts[(osVersion, osFamily)] += 1
+            # Not every iOS client logs its model. Those requests only count
+            # towards the iOS version.
+            if osFamily == 'iOS' and iOSModel is not None:
+                self.modelCounts[iOSModel] += 1
+        if fileType is not None:
+            self.fileTypeCounts[fileType] += 1
+
+    def estimate(self, count, unique=False, peak=False):
+        # A count of sampled GET requests as the estimated total and its 95%
+        # confidence interval, assuming every request was sampled on its
+        # own. Ex: '1520 (+/- 80)'. Without a sampleRate, the count itself.
+        # How many unique IPs or files there were can't be told from how
+        # many were sampled, so they are labeled as the lower bound they
+        # are. A peak (Ex: the busiest minute) is the number in the sample:
+        # the busiest of many sampled counts is picked for being high, so
+        # scaling it up overstates it.
+        if not self.sampleRate:
+            return count
+        if unique:
+            return 'at least %s (lower bound from the sample)' % count
+        if peak:
+            return '%s sampled' % count
+        rate = self.sampleRate
+        return '%.0f (+/- %.0f)' % (
+            count / rate, 1.96 * math.sqrt(count * (1 - rate)) / rate)
+
+    def unique_ips(self):
+        if self.sketchError:
+            return self.ipSketch.count()
+        return len(self.ipv4Addresses) + len(self.otherAddresses)
+
+    def unique_files(self):
+        if self.sketchError:
+            return self.urlSketch.count()
+        return len(self.urlCounts)
+
+    def unique_filetypes(self):
+        # The number of unique files per file type.
+        if self.sketchError:
+            return Counter(dict((fileType, sketch.count()) for fileType, sketch
+                                in self.fileTypeSketches.items()))
+        return Counter(self.fileTypeUniqueCounts)
+
+    def top_files(self, count):
+        # The count most requested files as (URL, requests, error).
+        if self.sketchError:
+            return self.topFiles.top(count)
+        items = heapq.nsmallest(count, self.urlCounts.iteritems(),
+                                key=lambda x: (-x[1], x[0]))
+        return [(URL, requests, 0) for URL, requests in items]
+
+    def request_histogram(self):
+        # The number of files requested once, 2-10 times, 11-100 times and
+        # so on, per file type. Ex: {'.ipa': Counter({0: 120, 1: 40})} for
+        # 120 files requested once and 40 requested 2-10 times. Needs the
+        # requests of every file, so None with a sketchError.
+        if self.sketchError:
+            return None
+        histogram = defaultdict(Counter)
+        for x, requests in self.urlCounts.iteritems():
+            fileType = get_filetype(x)
+            if fileType is None:
+                continue
+            histogram[fileType][len(str(requests - 1)) if requests > 1
+                                else 0] += 1
+        return histogram
+
+    def get_sketches(self, sketchError):
+        # The unique IP and file sketches for this day. In exact mode they are
+        # built from the distinct IPs and URLs.
+        if self.sketchError:
+            return self.ipSketch, self.urlSketch
+        ipSketch = HyperLogLog(sketchError)
+        urlSketch = HyperLogLog(sketchError)
+        for ip in self.ipv4Addresses:
+            ipSketch.add(unpack_ipv4(ip))
+        for ip in self.otherAddresses:
+            ipSketch.add(ip)
+        for URL in self.urlCounts:
+            urlSketch.add(URL)
+        return ipSketch, urlSketch
+
+    def merge(self, other):
+        # Add a later chunk of the logs (Ex: the next log file) to this one.
+        if (self.sketchError, self.sampleRate) != (other.sketchError,
+                                                   other.sampleRate):
+            raise ValueError('Cannot merge exact and approximate stats')
+        if other.firstSample is not None and self.lastSample is not None:
+            # The bandwidth between the last sample of this chunk and the
+            # first one of the next.
+            self.add_delta(other.firstSample[0], self.lastSample[1:],
+                           other.firstSample[1:])
+        return self.add_stats(other)
+
+    def combine(self, other):
+        # Add the stats of another Caching Server for the same day. Their
+        # 'Since server start' samples are separate series, so only the
+        # bandwidth between the samples of each server is added up. The first
+        # and last samples become the earliest and latest of any server.
+        if (self.sketchError, self.sampleRate) != (other.sketchError,
+                                                   other.sampleRate):
+            raise ValueError('Cannot merge exact and approximate stats')
+        samples = [x for x in (self.firstSample, self.lastSample,
+                               other.firstSample, other.lastSample)
+                   if x is not None]
+        self.add_stats(other)
+        if samples:
+            self.firstSample = min(samples)
+            self.lastSample = max(samples)
+        return self
+
+    def add_stats(self, other):
+        # The part of merge() and combine() that is the same for both.
+        self.noClientIdentityCount += other.noClientIdentityCount
+        self.AC2Count += other.AC2Count
+        self.requestCount += other.requestCount
+        if other.firstSample is not None:
+            if self.firstSample is None:
+                self.firstSample = other.firstSample
+            self.lastSample = other.lastSample
+            self.restarts += other.restarts
+            for i in range(3):
+                self.bandwidth[i] += other.bandwidth[i]
+            for minute, delta in other.bandwidthMinutes.items():
+                bucket = self.bandwidthMinutes.setdefault(minute,
+                                                          [0.0, 0.0, 0.0])
+                for i in range(3):
+                    bucket[i] += delta[i]
+        self.ipv4Addresses.update(other.ipv4Addresses)
+        self.otherAddresses.update(other.otherAddresses)
+        # Files in both are unique files of this one already.
+        for URL in self.urlCounts.viewkeys() & other.urlCounts.viewkeys():
+            fileType = get_filetype(URL)
+            if fileType is not None:
+                self.fileTypeUniqueCounts[fileType] -= 1
+        for name in self.counters:
+            getattr(self, name).update(getattr(other, name))
+        self.topClients.merge(other.topClients)
+        self.topSubnets.merge(other.topSubnets)
+        if self.sketchError:
+            self.ipSketch.merge(other.ipSketch)
+            self.urlSketch.merge(other.urlSketch)
+            self.topFiles.merge(other.topFiles)
+            for fileType, sketch in other.fileTypeSketches.items():
+                if fileType in self.fileTypeSketches:
+                    self.fileTypeSketches[fileType].merge(sketch)
+                else:
+                    self.fileTypeSketches[fileType] = HyperLogLog.from_dict(
+                        sketch.to_dict())
+        return self
+
+    def to_dict(self):
+        data = {
+            'noClientIdentityCount': self.noClientIdentityCount,
+            'AC2Count': self.AC2Count,
+            'requestCount': self.requestCount,
+            'firstSample': self.firstSample,
+            'lastSample': self.lastSample,
+            'bandwidth': self.bandwidth,
+            'restarts': self.restarts,
+            'bandwidthMinutes': self.bandwidthMinutes,
+            'ipv4Addresses': self.ipv4Addresses.to_dict(),
+            'otherAddresses': list(self.otherAddresses),
+            'topClients': self.topClients.to_dict(),
+            'topSubnets': self.topSubnets.to_dict(),
+            'sketchError': self.sketchError,
+        }
+        for name in self.counters:
+            data[name] = getattr(self, name).items()
+        if self.sketchError:
+            data['ipSketch'] = self.ipSketch.to_dict()
+            data['urlSketch'] = self.urlSketch.to_dict()
+            data['topFiles'] = self.topFiles.to_dict()
+            data['fileTypeSketches'] = dict(
+                (fileType, sketch.to_dict())
+                for fileType, sketch in self.fileTypeSketches.items())
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        day = cls()
+        day.noClientIdentityCount = data['noClientIdentityCount']
+        day.AC2Count = data['AC2Count']
+        day.requestCount = data['requestCount']
+        for name in ('firstSample', 'lastSample'):
+            if data[name] is not None:
+                setattr(day, name, [to_str(data[name][0])] + data[name][1:])
+        day.bandwidth = data['bandwidth']
+        day.restarts = data['restarts']
+        day.bandwidthMinutes = dict((to_str(k), v) for k, v in
+                                    data['bandwidthMinutes'].items())
+        day.ipv4Addresses = IPv4Set.from_dict(data['ipv4Addresses'])
+        day.otherAddresses = set(to_str(x) for x in data['otherAddresses'])
+        day.topClients = SpaceSaving.from_dict(data['topClients'])
+        day.topSubnets = SpaceSaving.from_dict(data['topSubnets'])
+        for name in cls.counters:
+            counter = getattr(day, name)
+            for item, count in data[name]:
+                # JSON turns the (osVersion, osFamily) tuples into lists.
+                if isinstance(item, list):
+                    item = tuple(to_str(x) for x in item)
+                else:
+                    item = to_str(item)
+                counter[item] = count
+        day.sketchError = data['sketchError']
+        if day.sketchError:
+            day.ipSketch = HyperLogLog.from_dict(data['ipSketch'])
+            day.urlSketch = HyperLogLog.from_dict(data['urlSketch'])
+            day.topFiles = SpaceSaving.from_dict(data['topFiles'])
+            day.fileTypeSketches = dict(
+                (to_str(fileType), HyperLogLog.from_dict(sketch))
+                for fileType, sketch in data['fileTypeSketches'].items())
+        return day
+
+
+class HyperLogLog(object):
+    # Estimates the number of distinct values added to it using a fixed
+    # 2 ** precision bytes of memory. The relative standard error is about
+    # 1.04 / sqrt(2 ** precision), so the precision is picked from the
+    # requested error. Sketches with the same precision can be merged, which
+    # gives the distinct count of everything added to either of them.
+    def __init__(self, error=0.01, precision=None):
+        if precision is None:
+            precision = int(math.ceil(math.log((1.04 / error) ** 2, 2)))
+            precision = min(max(precision, 4), 18)
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    @property
+    def error(self):
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def add(self, value):
+        # Use a stable hash (unlike hash()) so stored sketches from earlier
+        # runs can still be merged.
+        h = struct.unpack_from('<Q', hashlib.md5(value).digest())[0]
+        bits = 64 - self.precision
+        index = h >> bits
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        m = len(self.registers)
+        if m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        if estimate <= 2.5 * m:
+            # Small range correction (linear counting).
+            zeros = self.registers.count('\x00')
+            if zeros:
+                estimate = m * math.log(float(m) / zeros)
+        return int(round(estimate))
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('Cannot merge sketches with different precisions')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def to_dict(self):
+        return {
+            'precision': self.precision,
+            'registers': base64.b64encode(str(self.registers)),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(precision=data['precision'])
+        sketch.registers = bytearray(base64.b64decode(data['registers']))
+        return sketch
+
+
+class SpaceSaving(dict):
+    # Counts the most frequent items of a stream (Ex: the busiest clients)
+    # in fixed memory, with a batched version of the Space-Saving algorithm.
+    # Used like a Counter: summary[item] += 1. Up to 2 * capacity items are
+    # counted. When there are more, only the capacity most frequent ones are
+    # kept and the highest count dropped becomes the floor: a new item may
+    # have been dropped before, so it starts counting from the floor, which
+    # is also its error. Counts are never too low and at most their error too
+    # high, and everything is exact until there are more than 2 * capacity
+    # distinct items. Summaries can be merged.
+    def __init__(self, capacity=topCapacity):
+        dict.__init__(self)
+        self.capacity = capacity
+        # Only the items with an error are stored. Ex: {'10.0.1.5': 12}
+        self.errors = {}
+        self.floor = 0
+
+    def __missing__(self, item):
+        # Only called for new items, so counting the others stays as fast
+        # as with a plain dict.
+        if len(self) >= 2 * self.capacity:
+            self.compact()
+        if self.floor:
+            self.errors[item] = self.floor
+        return self.floor
+
+    def compact(self):
+        # Items tied with the first one dropped are dropped as well.
+        floor = sorted(self.itervalues())[-self.capacity - 1]
+        self.floor = max(self.floor, floor)
+        kept = [(item, count) for item, count in self.iteritems()
+                if count > floor]
+        self.clear()
+        self.update(kept)
+        self.errors = dict((item, error) for item, error
+                           in self.errors.iteritems() if item in self)
+
+    def merge(self, other):
+        # An item missing from one of the summaries was counted at most its
+        # floor times there.
+        counts = {}
+        errors = {}
+        for item in set(self) | set(other):
+            counts[item] = (self.get(item, self.floor) +
+                            other.get(item, other.floor))
+            error = (self.errors.get(item, 0 if item in self
+                                     else self.floor) +
+                     other.errors.get(item, 0 if item in other
+                                      else other.floor))
+            if error:
+                errors[item] = error
+        self.clear()
+        self.update(counts)
+        self.errors = errors
+        self.floor += other.floor
+        if len(self) > 2 * self.capacity:
+            self.compact()
+        return self
+
+    def top(self, count):
+        # The count most frequent items as (item, count, error), busiest
+        # first.
+        items = heapq.nsmallest(count, self.iteritems(),
+                                key=lambda x: (-x[1], x[0]))
+        return [(item, itemCount, self.errors.get(item, 0))
+                for item, itemCount in items]
+
+    def to_dict(self):
+        return {
+            'capacity': self.capacity,
+            'floor': self.floor,
+            'counts': self.items(),
+            'errors': self.errors.items(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        summary = cls(data['capacity'])
+        summary.floor = data['floor']
+        summary.update((to_str(item), count)
+                       for item, count in data['counts'])
+        summary.errors = dict((to_str(item), error)
+                              for item, error in data['errors'])
+        return summary
+
+
+class IPv4Set(object):
+    # Distinct IPv4 addresses, packed into 32-bit integers, in at most 2
+    # bytes each. Used like a set: addresses.add(packed), len(addresses).
+    # Addresses are grouped by network (their first two parts). The rest of
+    # the addresses of a network is kept in a sorted array('H'), or in a
+    # bitmap once the network has too many addresses for that. Sets can be
+    # merged.
+    def __init__(self):
+        # Ex: {2561: array('H', [261, 262])} for 10.1.1.5 and 10.1.1.6
+        self.networks = {}
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        # The addresses in order.
+        for network in sorted(self.networks):
+            hosts = self.networks[network]
+            network <<= 16
+            if isinstance(hosts, array):
+                for host in hosts:
+                    yield network | host
+                continue
+            for index, bits in enumerate(hosts):
+                if not bits:
+                    continue
+                for bit in range(8):
+                    if bits >> bit & 1:
+                        yield network | index << 3 | bit
+
+    def add(self, packed):
+        network = packed >> 16
+        host = packed & 0xffff
+        hosts = self.networks.get(network)
+        if hosts is None:
+            self.networks[network] = array('H', [host])
+        elif isinstance(hosts, array):
+            index = bisect.bisect_left(hosts, host)
+            if index < len(hosts) and hosts[index] == host:
+                return
+            hosts.insert(index, host)
+            if len(hosts) * 2 >= ipv4BitmapSize:
+                self.networks[network] = to_bitmap(hosts)
+        else:
+            bit = 1 << (host & 7)
+            if hosts[host >> 3] & bit:
+                return
+            hosts[host >> 3] |= bit
+        self.count += 1
+
+    def update(self, other):
+        for network, otherHosts in other.networks.iteritems():
+            hosts = self.networks.get(network)
+            if hosts is None:
+                hosts = otherHosts[:]
+            elif isinstance(hosts, array) and isinstance(otherHosts, array):
+                self.count -= len(hosts)
+                hosts = array('H', sorted(set(hosts).union(otherHosts)))
+                if len(hosts) * 2 >= ipv4BitmapSize:
+                    hosts = to_bitmap(hosts)
+            else:
+                self.count -= count_hosts(hosts)
+                hosts = bytearray(x | y for x, y in zip(
+                    to_bitmap(hosts), to_bitmap(otherHosts)))
+            self.networks[network] = hosts
+            self.count += count_hosts(hosts)
+        return self
+
+    def to_dict(self):
+        # Arrays are always smaller than bitmaps, so their size tells them
+        # apart.
+        networks = {}
+        for network, hosts in self.networks.iteritems():
+            if isinstance(hosts, array):
+                hosts = hosts[:]
+                if sys.byteorder != 'little':
+                    hosts.byteswap()
+                hosts = hosts.tostring()
+            networks[network] = base64.b64encode(hosts)
+        return {'count': self.count, 'networks': networks}
+
+    @classmethod
+    def from_dict(cls, data):
+        addresses = cls()
+        addresses.count = data['count']
+        for network, hosts in data['networks'].items():
+            hosts = base64.b64decode(hosts)
+            if len(hosts) == ipv4BitmapSize:
+                hosts = bytearray(hosts)
+            else:
+                hosts = array('H', hosts)
+                if sys.byteorder != 'little':
+                    hosts.byteswap()
+            addresses.networks[int(network)] = hosts
+        return addresses
+
+
+class IdentityCache(dict):
+    # Resolved client identities, Ex: identityCache[identity] is the
+    # (osFamily, osVersion, iOSModel) of resolve_identity(identity). Looking
+    # up a known identity costs a dict lookup. Once capacity identities are
+    # cached, they become the older generation and the cache starts over:
+    # identities used again are moved back from there, the rest are
+    # forgotten the next time. So the recently used identities are kept in
+    # at most 2 * capacity entries.
+    def __init__(self, capacity=identityCacheSize):
+        dict.__init__(self)
+        self.capacity = capacity
+        self.older = {}
+
+    def __missing__(self, identity):
+        value = self.older.get(identity)
+        if value is None:
+            value = resolve_identity(identity)
+        if len(self) >= self.capacity:
+            self.older = self.copy()
+            self.clear()
+        self[identity] = value
+        return value
+
+
+identityCache = IdentityCache()
+
+
+class Profiler(object):
+    # Wall time and CPU time of every stage of a run, the peak memory of the
+    # process by the end of it, and the number of lines every parse rule
+    # matched or skipped (--profile). ru_maxrss only ever goes up, so a stage
+    # that used little memory still shows the peak of the stages before it.
+    # With a profileFile, the run is also profiled with cProfile and the
+    # stats are written to it (worker processes of --jobs are not included).
+    def __init__(self, profileFile=None):
+        self.stages = []
+        self.totals = {}
+        self.rules = Counter()
+        self.start = time.time()
+        self.startCpu = get_cputime()
+        self.profileFile = profileFile
+        self.profile = None
+        if profileFile:
+            import cProfile
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    @contextmanager
+    def stage(self, name):
+        # Time everything run in the with block. Stages that run more than
+        # once (Ex: the report of every day) are added up.
+        start, startCpu = time.time(), get_cputime()
+        try:
+            yield
+        finally:
+            if name not in self.totals:
+                self.stages.append(name)
+                self.totals[name] = [0.0, 0.0, 0.0]
+            totals = self.totals[name]
+            totals[0] += time.time() - start
+            totals[1] += get_cputime() - startCpu
+            # The process peak so far, not the peak of this stage alone.
+            totals[2] = get_peakrss()
+
+    def finish(self):
+        # Stop cProfile and write its stats (pstats format).
+        if self.profile is None:
+            return
+        self.profile.disable()
+        try:
+            self.profile.dump_stats(self.profileFile)
+        except (IOError, OSError) as e:
+            print 'Failed to write profile file %s: %s' % (self.profileFile, e)
+        self.profile = None
+
+    def report(self):
+        output = []
+        output.append('Cacher profile:')
+        output.append('  %-28s %10s %10s %21s' % (
+            'stage', 'wall (s)', 'cpu (s)', 'peak RSS so far (MB)'))
+        for name in self.stages:
+            output.append('  %-28s %10.2f %10.2f %21.1f' % (
+                (name,) + tuple(self.totals[name])))
+        output.append('  %-28s %10.2f %10.2f %21.1f' % (
+            'total', time.time() - self.start,
+            get_cputime() - self.startCpu, get_peakrss()))
+        lines = self.rules['lines']
+        if lines:
+            output.append('')
+            parseTime = self.totals.get('parse', [0.0])[0]
+            output.append('  Parsed %s lines in %.2f seconds (%.0f lines/sec).'
+                          % (lines, parseTime, lines / max(parseTime, 1e-6)))
+            output.append('')
+            rules = self.rules
+            inRange = lines - rules['skipped']
+            output.append('  %-36s %10s %10s' % ('rule', 'matched',
+                                                 'skipped'))
+            for row in [
+                    ('requested dates and times', inRange,
+                     rules['skipped']),
+                    ('bandwidth', rules['bandwidth'], '-'),
+                    ('GET request by (no client identity)',
+                     rules['noidentity'], '-'),
+                    ('GET request from', rules['request'],
+                     rules['badrequest']),
+                    ('GET request from, not sampled', '-',
+                     rules['unsampled']),
+                    ('no matching rule', '-', inRange - rules['bandwidth'] -
+                     rules['noidentity'] - rules['request'] -
+                     rules['badrequest'] - rules['unsampled'])]:
+                output.append('  %-36s %10s %10s' % row)
+        return output
+
+
+class Progress(object):
+    # Throughput and an ETA on stderr while the logs are parsed (--progress).
+    # Work is measured in decompressed bytes. The decompressed size of the
+    # archives is estimated from the compression ratio of the archives parsed
+    # so far.
+    def __init__(self, tasks, interval=1.0):
+        # tasks is the (size on disk, compressed) of every log to parse.
+        self.interval = interval
+        self.total = [0, 0]
+        for size, compressed in tasks:
+            self.total[compressed] += size
+        self.done = [0, 0]
+        self.lines = 0
+        # bz2 shrinks the logs about tenfold.
+        self.ratio = 10.0
+        self.archiveSize = self.archiveRead = 0
+        self.task = None
+        self.taskRead = 0
+        self.taskLines = 0
+        self.width = 0
+        self.start = self.last = time.time()
+        self.tty = sys.stderr.isatty()
+
+    def begin(self, task):
+        self.task = task
+        self.taskRead = self.taskLines = 0
+
+    def advance(self, read, lines):
+        # Bytes (decompressed) and lines read from the current task.
+        self.taskRead += read
+        self.taskLines += lines
+        self.report()
+
+    def complete(self, task, lines):
+        size, compressed = task
+        if compressed and self.taskRead and self.task == task:
+            self.archiveSize += size
+            self.archiveRead += self.taskRead
+            self.ratio = float(self.archiveRead) / max(self.archiveSize, 1)
+        self.done[compressed] += size
+        self.lines += lines
+        self.task = None
+        self.taskRead = self.taskLines = 0
+        self.report()
+
+    def report(self, final=False):
+        now = time.time()
+        if not final and now - self.last < self.interval:
+            return
+        self.last = now
+        total = self.total[0] + self.total[1] * self.ratio
+        done = self.done[0] + self.done[1] * self.ratio
+        if self.task is not None:
+            size, compressed = self.task
+            done += min(self.taskRead, size * self.ratio if compressed else
+                        size)
+        lines = self.lines + self.taskLines
+        elapsed = max(now - self.start, 1e-6)
+        message = 'Parsed %s lines (%.0f lines/sec)' % (lines,
+                                                        lines / elapsed)
+        if total:
+            message += ', %.0f%%' % (100.0 * min(done, total) / total)
+            if final:
+                message += ' in %s' % timedelta(seconds=int(elapsed))
+            elif done:
+                eta = elapsed * max(total - done, 0) / done
+                message += ', ETA %s' % timedelta(seconds=int(eta))
+        self.width = max(self.width, len(message))
+        if self.tty:
+            sys.stderr.write('\r' + message.ljust(self.width) +
+                             ('\n' if final else ''))
+        else:
+            sys.stderr.write(message + '\n')
+        sys.stderr.flush()
+
+
+class LogFollower(object):
+    # Tails the live log for --follow and keeps the stats of every day in
+    # memory, so a day can be reported as soon as it ends. Only lines
+    # appended since the last poll are parsed. The live log is followed by
+    # name: once the Caching Server rotates it, the rest of the old file is
+    # read through the handle that is still open and the new log is read
+    # from its start, so no line is counted twice.
+    def __init__(self, logPath, sketchError=None, since=None, until=None):
+        self.logPath = logPath
+        self.sketchError = sketchError
+        self.since = since
+        self.until = until
+        self.startDate = str(date.today())
+        self.days = {}
+        self.liveLog = None
+        self.file = None
+        self.partial = ''
+        self.lineCount = 0
+
+    def warm_up(self, cacheFile=None, jobs=1):
+        # Collect what was logged today before Cacher started. Archives
+        # last written before midnight can't hold any of today's lines. The
+        # live log is read from its first line of today on.
+        logFiles = get_logfiles(self.logPath)
+        liveLogs = [x for x in logFiles if not x.endswith('.bz2')]
+        if not liveLogs:
+            return False
+        self.liveLog = liveLogs[-1]
+        midnight = time.mktime(datetime.strptime(
+            self.startDate, '%Y-%m-%d').timetuple())
+        archives = [x for x in logFiles if x != self.liveLog and
+                    os.path.getmtime(x) >= midnight]
+        self.days = parse_files(archives, [self.startDate], cacheFile,
+                                self.since, self.until, jobs,
+                                self.sketchError)
+        self.open(get_logrange(self.liveLog, [self.startDate])[0])
+        return True
+
+    def open(self, offset=0):
+        if self.file is not None:
+            self.file.close()
+        self.file = io.open(self.liveLog, 'rb', buffering=0)
+        self.file.seek(offset)
+
+    def read(self):
+        # Parse the complete lines appended to the open log. A partial line
+        # is kept until the rest of it is written.
+        count = 0
+        while True:
+            data = self.file.read(followReadSize)
+            if not data:
+                return count
+            lines = (self.partial + data).split('\n')
+            self.partial = lines.pop()
+            count += len(lines)
+            self.add_lines(lines)
+
+    def add_lines(self, lines):
+        for datestr, day in parse_days(lines, None, self.since, self.until,
+                                       self.sketchError).items():
+            # Days that were already reported stay reported.
+            if datestr < self.startDate:
+                continue
+            if datestr in self.days:
+                self.days[datestr].merge(day)
+            else:
+                self.days[datestr] = day
+
+    def poll(self):
+        # Returns the number of lines parsed.
+        count = self.read()
+        try:
+            info = os.stat(self.liveLog)
+        except OSError:
+            # Rotated, but the new log hasn't been created yet.
+            return count
+        current = os.fstat(self.file.fileno())
+        if (info.st_ino, info.st_dev) != (current.st_ino, current.st_dev):
+            # Rotated. Finish the old log before moving on to the new one.
+            count += self.read()
+            if self.partial:
+                self.add_lines([self.partial])
+                self.partial = ''
+                count += 1
+            self.open()
+            count += self.read()
+        elif info.st_size < self.file.tell():
+            # Truncated in place.
+            self.partial = ''
+            self.open()
+            count += self.read()
+        return count
+
+    def follow(self, interval=10, statsServer=None):
+        # Yield (date, DayStats) for every day once it has ended, oldest
+        # first. Runs until interrupted. If a StatsServer is given, it gets a
+        # new snapshot of the days in memory whenever they change.
+        changed = True
+        try:
+            while True:
+                count = self.poll()
+                self.lineCount += count
+                today = str(date.today())
+                for targetDate in sorted(self.days):
+                    if targetDate < today:
+                        changed = True
+                        yield targetDate, self.days.pop(targetDate)
+                self.startDate = max(self.startDate, today)
+                if statsServer is not None and (count or changed):
+                    statsServer.publish(self.days, self.lineCount)
+                changed = False
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            return
+
+
+class StatsServer(object):
+    # Serves the stats of the days in memory in --follow mode (--httpport):
+    # /metrics in the Prometheus text format and /stats.json as JSON. Both
+    # are rendered by publish() in the parsing thread, so a scrape only hands
+    # out the latest strings and never waits on (or slows down) the parser.
+    def __init__(self, port, address='127.0.0.1'):
+        import BaseHTTPServer
+        import SocketServer
+
+        class HTTPServer(SocketServer.ThreadingMixIn,
+                         BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+        class Handler(StatsHandler, BaseHTTPServer.BaseHTTPRequestHandler):
+            pass
+
+        self.httpd = HTTPServer((address, port), Handler)
+        self.httpd.stats = self
+        self.publish({}, 0)
+
+    def publish(self, days, lineCount):
+        snapshot = get_snapshot(days, lineCount)
+        # A single assignment, so a request sees either the old or the new
+        # snapshot.
+        self.snapshot = (render_metrics(snapshot),
+                         json.dumps(snapshot, indent=2, sort_keys=True))
+
+    def start(self):
+        thread = threading.Thread(target=self.httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+
+class StatsHandler:
+    # The request handling of StatsServer, mixed into BaseHTTPRequestHandler
+    # when the server is created. A classic class like the handler itself, so
+    # the handler's __init__ is the one used.
+    def do_GET(self):
+        metrics, stats = self.server.stats.snapshot
+        path = self.path.split('?')[0]
+        if path == '/metrics':
+            self.send_body(metrics, 'text/plain; version=0.0.4')
+        elif path == '/stats.json':
+            self.send_body(stats, 'application/json')
+        else:
+            self.send_error(404)
+
+    def send_body(self, body, contentType):
+        self.send_response(200)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes would flood the output otherwise.
+        pass
+
+
+class HTTPClient(object):
+    # A small HTTP client for the alerts. Connections are kept open and
+    # reused per host. Connection errors, timeouts and 5xx/429 responses are
+    # retried with exponential backoff. Safe to use from several threads.
+    def __init__(self, timeout=httpTimeout, retries=httpRetries,
+                 backoff=httpBackoff):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    def get_connection(self, scheme, netloc):
+        import httplib
+        with self.lock:
+            idle = self.connections.get((scheme, netloc))
+            if idle:
+                return idle.pop()
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, timeout=self.timeout)
+        return httplib.HTTPConnection(netloc, timeout=self.timeout)
+
+    def put_connection(self, scheme, netloc, connection):
+        with self.lock:
+            self.connections.setdefault((scheme, netloc), []).append(
+                connection)
+
+    def request(self, method, url, body=None, headers=None, retries=None):
+        # Returns (status, response body). Raises IOError once every attempt
+        # has failed.
+        import httplib
+        import urlparse
+        if retries is None:
+            retries = self.retries
+        parts = urlparse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        error = None
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            connection = self.get_connection(parts.scheme, parts.netloc)
+            try:
+                connection.request(method, path, body, headers or {})
+                response = connection.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, socket.error) as e:
+                connection.close()
+                error = e
+                continue
+            if response.will_close:
+                connection.close()
+            else:
+                self.put_connection(parts.scheme, parts.netloc, connection)
+            if response.status >= 500 or response.status == 429:
+                error = 'HTTP %s' % response.status
+                continue
+            return response.status, data
+        raise IOError('%s %s failed %s times: %s' % (
+            method, url, retries + 1, error))
+
+
+class Notifier(object):
+    # Sends reports to the alert sinks (server alert, Slack) from background
+    # threads, one per sink. Reports go to a sink in order, but the sinks
+    # work at the same time and never hold up the parsing. close() waits for
+    # the queued alerts for at most a given number of seconds.
+    def __init__(self):
+        self.sinks = []
+
+    def add_sink(self, name, send):
+        # send(subject, text) delivers a single report.
+        queue = Queue.Queue()
+        thread = threading.Thread(target=self.run, args=(name, send, queue))
+        thread.daemon = True
+        thread.start()
+        self.sinks.append((name, queue, thread))
+
+    def run(self, name, send, queue):
+        while True:
+            message = queue.get()
+            if message is None:
+                return
+            try:
+                send(*message)
+            except Exception as e:
+                print 'Failed to send %s for %s: %s' % (name, message[0], e)
+
+    def notify(self, subject, text):
+        for name, queue, thread in self.sinks:
+            queue.put((subject, text))
+
+    def close(self, timeout=60):
+        deadline = time.time() + timeout
+        for name, queue, thread in self.sinks:
+            queue.put(None)
+        for name, queue, thread in self.sinks:
+            thread.join(max(deadline - time.time(), 0))
+            if thread.is_alive():
+                print 'Gave up waiting for %s after %s seconds' % (name,
+                                                                   timeout)
+
+
+def get_cputime():
+    # User and system time of Cacher and its finished worker processes.
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (usage.ru_utime + usage.ru_stime + children.ru_utime +
+            children.ru_stime)
+
+
+def get_peakrss():
+    # Peak resident memory in MB of Cacher or its largest worker process.
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux.
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    if sys.platform == 'darwin':
+        return rss / 1048576.0
+    return rss / 1024.0
+
+
+def pack_ipv4(ip):
+    # '149.166.73.137' -> 2510702985, or None if ip isn't an IPv4 address.
+    if ip.count('.') != 3:
+        return None
+    try:
+        return struct.unpack('!I', socket.inet_aton(ip))[0]
+    except socket.error:
+        return None
+
+
+def unpack_ipv4(packed):
+    return socket.inet_ntoa(struct.pack('!I', packed))
+
+
+def to_bitmap(hosts):
+    # The hosts of an IPv4Set network as a bitmap.
+    if isinstance(hosts, bytearray):
+        return hosts
+    bitmap = bytearray(ipv4BitmapSize)
+    for host in hosts:
+        bitmap[host >> 3] |= 1 << (host & 7)
+    return bitmap
+
+
+def count_hosts(hosts):
+    # The number of hosts of an IPv4Set network.
+    if isinstance(hosts, array):
+        return len(hosts)
+    return sum(bitCounts[x] for x in hosts)
+
 
+def version_key(version):
+    # Sort key for version strings that orders them like distutils'
+    # LooseVersion (Ex: 9.3.5 < 10.2 < 10.2.1), without importing distutils.
+    return [int(x) if x.isdigit() else x
+            for x in versionPart.findall(version or '')]
 
-def cacher(lines, targetDate, friendlyNames):
+
+def to_str(value):
+    # json hands back unicode, but the rest of Cacher works with str.
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def parse_days(lines, targetDates, since=None, until=None, sketchError=None,
+               ruleCounts=None, sample=None):
     # Basically run through all the lines a single time and collect all the
-    # relevant data to slice, do stats with, etc.
-    noClientIdentityLog = []
-    sizeLog = []
-    AC2Log = []
-    IPLog = []
-    OSLog = []
-    osVersionLog = []
-    iOSModelLog = []
-    iOSModelOnlyLog = []
-    fileTypeLog = []
-    fileTypeUniqueLog = []
-    urlLog = []
-    urlUniqueLog = []
-    deviceNumberLog = []
-    finalOutput = []
-    FriendlyLog = []
-    macOSFamilyLog = []
-    macOSDeviceNumber = []
-    iOSFamilyLog = []
-    iOSDeviceNumber = []
-    AppleTVNumberLog = []
-    iPadNumberLog = []
-    iPhoneNumberLog = []
-    iPodNumberLog = []
-    # Friendly Darwin versions for macOS. This allows us to dynamically add
-    # the macOS version (for the alert), while dynamically looping through the
-    # logs.
-    friendlyDarwin = {
-        '16.4.0': '10.12.3',
-        '16.3.0': '10.12.2',
-        '16.1.0': '10.12.1',
-        '16.0.0': '10.12.0',
-        '10.12': '10.12.0',  # match 10.12 to 10.12.0 for consistency
-        '15.6.0': '10.11.6',
-        '15.5.0': '10.11.5',
-        '15.4.0': '10.11.4',
-        '15.3.0': '10.11.3',
-        '15.2.0': '10.11.2',
-        '15.0.0': '10.11.0/1',
-        '14.5.0': '10.10.5',
-        '14.4.0': '10.10.4',
-        '14.3.0': '10.10.3',
-        '14.1.1': '10.12.2',
-        '14.1.0': '10.10.2',
-        '14.0.0': '10.10.0/1',
-    }
-    # Friendly Models of known models. This allows us to dynamically add the
-    # names to each model (for the alert), while dynamically looping through
-    # the logs.
-    friendlyModels = {
-        'AppleTV3,1': '3rd Generation Apple TVs',
-        'AppleTV3,2': '4th Generation Apple TVs',
-        'AppleTV5,3': '5th Generation Apple TVs',
-        'iPhone3,1': 'iPhone 4 [GSM]',
-        'iPhone3,2': 'iPhone 4 [GSM 2012]',
-        'iPhone3,3': 'iPhone 4 [CDMA]',
-        'iPhone4,1': 'iPhone 4S',
-        'iPhone5,1': 'iPhone 5 [GSM]',
-        'iPhone5,2': 'iPhone 5 [CDMA]',
-        'iPhone5,3': 'iPhone 5C',
-        'iPhone5,4': 'iPhone 5C [Global]',
-        'iPhone6,1': 'iPhone 5S',
-        'iPhone6,2': 'iPhone 5S [China Model]',
-        'iPhone7,1': 'iPhone 6 Plus',
-        'iPhone7,2': 'iPhone 6',
-        'iPhone8,1': 'iPhone 6S',
-        'iPhone8,2': 'iPhone 6S Plus',
-        'iPhone8,4': 'iPhone SE',
-        'iPhone9,1': 'iPhone 7 [Global]',
-        'iPhone9,2': 'iPhone 7 Plus [Global]',
-        'iPhone9,3': 'iPhone 7 [GSM]',
-        'iPhone9,4': 'iPhone 7 Plus [GSM]',
-        'iPad2,1': 'iPad 2nd Generation [Wifi]',
-        'iPad2,2': 'iPad 2nd Generation [Wifi + GSM]',
-        'iPad2,3': 'iPad 2nd Generation [Wifi + CDMA]',
-        'iPad2,4': 'iPad 2nd Generation [M2012 Wifi Revision]',
-        'iPad2,5': 'iPad Mini 1st Generation [Wifi]',
-        'iPad2,6': 'iPad Mini 1st Generation [Wifi + GSM]',
-        'iPad2,7': 'iPad Mini 1st Generation [Wifi + CDMA]',
-        'iPad3,1': 'iPad 3rd Generation [Wifi]',
-        'iPad3,2': 'iPad 3rd Generation [Wifi + GSM]',
-        'iPad3,3': 'iPad 3rd Generation [Wifi + CDMA]',
-        'iPad3,4': 'iPad 4th Generation [Wifi]',
-        'iPad3,5': 'iPad 4th Generation [Wifi + GSM]',
-        'iPad3,6': 'iPad 4th Generation [Wifi + CDMA]',
-        'iPad4,1': 'iPad Air 1st Generation [Wifi]',
-        'iPad4,2': 'iPad Air 1st Generation [Wifi + Cellular]',
-        'iPad4,3': 'iPad Air 1st Generation [China Model]',
-        'iPad4,4': 'iPad Mini 2nd Generation [Wifi]',
-        'iPad4,5': 'iPad Mini 2nd Generation [Wifi + Cellular]',
-        'iPad4,6': 'iPad Mini 2nd Generation [China Model]',
-        'iPad4,7': 'iPad Mini 3rd Generation [Wifi]',
-        'iPad4,8': 'iPad Mini 3rd Generation [Wifi + Cellular]',
-        'iPad4,9': 'iPad Mini 3rd Generation [China Model]',
-        'iPad5,1': 'iPad Mini 4th Generation [Wifi]',
-        'iPad5,2': 'iPad Mini 4th Generation [Wifi + Cellular]',
-        'iPad5,3': 'iPad Air 2nd Generation [Wifi]',
-        'iPad5,4': 'iPad Air 2nd Generation [Wifi + Cellular]',
-        'iPad6,3': 'iPad Pro 9.7 Inch 1st Generation [Wifi]',
-        'iPad6,4': 'iPad Pro 9.7 Inch 1st Generation [Wifi + Cellular]',
-        'iPad6,7': 'iPad Pro 12.9 Inch 1st Generation [Wifi]',
-        'iPad6,8': 'iPad Pro 12.9 Inch 1st Generation [Wifi + Cellular]',
-        'iPod5,1': 'iPod Touch 5th Generation',
-        'iPod7,1': 'iPod Touch 6th Generation'
-    }
-    for x in lines:
+    # relevant data to slice, do stats with, etc. Lines are bucketed by date,
+    # so a whole range of dates only costs a single pass over the logs.
+    # If targetDates is None, every date found in the logs is collected.
+    # since/until (Ex: '08:00', '17:30') limit every day to a time window.
+    # If a ruleCounts Counter is given, the number of lines every rule
+    # matched or skipped is added to it (for --profile).
+    # With a sample of (rate, 'hash' or 'stride'), only that share of the
+    # GET requests is counted: the ones whose line (time, IP and URL) hashes
+    # below the rate, so the same ones every time, or evenly spaced ones.
+    # The others are not parsed at all. Hashing the IP and URL alone would
+    # sample every request of a client for a file or none of them, which
+    # makes the counts a lot less certain than estimate() assumes.
+    sampleRate, sampleMethod = sample or (None, None)
+    if targetDates is None:
+        days = defaultdict(lambda: DayStats(sketchError, sampleRate))
+    else:
+        days = dict((targetDate, DayStats(sketchError, sampleRate))
+                    for targetDate in targetDates)
+    lineCount = skippedCount = bandwidthCount = noIdentityCount = 0
+    requestCount = badRequestCount = unsampledCount = 0
+    sampleLimit = sampleRate and int(sampleRate * 2 ** 32)
+    sampleStride = sampleMethod == 'stride'
+    sampled = 0.0
+    for lineCount, x in enumerate(lines, 1):
         # If there aren't at least 3 pieces somehow, they'll get filled in
         # with blanks
         datestr, timestr, logmsg = (x.split(' ', 2) + ['', '', ''])[:3]
-        if datestr == targetDate:
-            # Only do work if the string is on the date we care about
+        if targetDates is None:
+            # Skip anything that isn't a date (Ex: wrapped lines).
+            day = days[datestr] if logDate.match(datestr) else None
+        else:
+            day = days.get(datestr)
+        if since and timestr < since:
+            day = None
+        if until and timestr >= until:
+            day = None
+        if day is None:
+            skippedCount += 1
+        else:
+            # Only do work if the string is on a date we care about
             # try:
-                linesplit = str.split(logmsg)
-                # split the logmsg line (by spaces) so I can hardcode some
-                # calls. Fragile (could break with a Server update) but it meh.
-
                 # Beginning of Server bandwidth section
                 #
                 #
@@ -159,115 +1421,35 @@ def cacher(lines, targetDate, friendlyNames):
                 # 12.51 MB stored from Internet, 0 bytes from peers;
                 # 0 bytes imported.
                 if 'start:' in logmsg:
-                    clientbw = linesplit[3]
-                    clientbwtype = linesplit[4]
-                    applebw = linesplit[8]
-                    applebwtype = linesplit[9]
-                    otherbw = linesplit[13]
-                    otherbwtype = linesplit[14]
-                    sizeLog.append('%s/%s/%s/%s/%s/%s' % (
-                        clientbw, clientbwtype, applebw, applebwtype, otherbw,
-                        otherbwtype))
+                    bandwidthCount += 1
+                    linesplit = str.split(logmsg)
+                    day.add_bandwidth(timestr[:5], [
+                        to_bytes(linesplit[3], linesplit[4]),
+                        to_bytes(linesplit[8], linesplit[9]),
+                        to_bytes(linesplit[13], linesplit[14])])
                 # Beginning of Server downloads section
                 #
                 #
                 if 'Received GET request by' in logmsg:
-                    noClientIdentityLog.append(logmsg)
+                    noIdentityCount += 1
+                    day.noClientIdentityCount += 1
                 elif 'Received GET request from' in logmsg:
-                    # Beginning of IP section
-                    #
-                    #
-                    # Ex: '149.166.73.137:56833'. Split 6th string at ':' and
-                    # pull only pull first value.
-                    ip = linesplit[5].split(":")[0]
-                    IPLog.append(ip)
-                    #
-                    #
-                    # End of IP section
-
-                    # Beginning of URL section
-                    #
-                    #
-                    # The URL is always at the end so take the split line and
-                    # pull its value.
-                    URL = linesplit[-1]
-                    urlLog.append(URL)
-                    #
-                    #
-                    # End of URL section
-
-                    # Beginning of OS Family, OS Version and Device section
-                    #
-                    #
-                    # Example: 'Darwin/15.0.0', 'iOS/10.0.2' or 'OS X 10.12.0'
-                    # Replace Look for iOS, Darwin or OS X. If OS X is found,
-                    # Add 'macOS/' to force the consistency and split the
-                    # string at '/'. This allows us to use 'macOS/10.12.2' for
-                    # both osFamily (Ex: macOS) and osVersion (Ex: 10.12.2).
-                    osFamily = re.match(
-                        r'.+? ((iOS|Darwin|OS X)[/ ](([0-9]+\.?){1,}))',
-                        x).group(1).replace('OS X ', 'macOS/').split('/')[0]
-                    osVersion = re.match(
-                        r'.+? ((iOS|Darwin|OS X)[/ ](([0-9]+\.?){1,}))',
-                        x).group(1).replace('OS X ', 'macOS/').split('/')[1]
-                    # If 'Darwin' in the name, replace to 'macOS' so our future
-                    # counts will be accurate.
-                    if osFamily == 'Darwin':
-                        osFamily = 'macOS'
-                    # Loop through the friendlyDarwin key/value pairs and if
-                    # osVersion is equal to the key (Ex: 16.3.0) replace it
-                    # with its value (Ex: 10.12.2). This is also a fix for the
-                    # count. Yay for coding in a bubble!
-                    for k, v in friendlyDarwin.items():
-                        if k == osVersion:
-                            osVersion = v
-
-                    # The iOS family is more fun, in that Caching Server logs
-                    # the model identifier.
-                    if osFamily == 'iOS':
-                        # Ex: 'model/iPhone7,2'.
-                        iOSModel = re.match(
-                            r'.+? model/([^ ]+?[0-9]+,?[0-9])?', x)
-                        # Since the regular expression is now two goups, only
-                        # take the date from the 2nd group.
-                        # Write the osVersion/osFamily data to iOSModelLog,
-                        # iOSModelOnlyLog and OSLog.
-                        iOSModelLog.append((osVersion, iOSModel.group(1)))
-                        iOSModelOnlyLog.append(iOSModel.group(1))
-                        OSLog.append((osVersion, osFamily))
-                    else:
-                        # Write the osVersion/osFamily data to OSLog.
-                        OSLog.append((osVersion, osFamily))
-
-                    # if 'model/AppleTV' in logmsg:
-                    # I think I still need to do this section but I can't
-                    # remember.
-                    #
-                    #
-                    # End of OS Family, OS Version and Device section
-
-                    # Beginning of File Type section
-                    #
-                    #
-                    # Regular Expression Part. Using the URL (split early),
-                    # Look for the recognized filetypes (.pkg, .ipa, .ipsw,
-                    # .zip and .epub). Ex:
-                    # 1. '/a-09f98d6971/pre-thinned756.thinned.signed.dpkg.ipa'
-                    # 2. '/031-8/com_apple_MobileAsset_CoreSuggestion/6c93.zip'
-                    # 3. '[icloud:hvRq3yMBV7JO9hUBRo2p]'
-                    if re.match(r'.+(\.pkg|\.ipa|\.ipsw|\.zip|\.epub)', URL):
-                        fileType = re.match(
-                            r'.+(\.pkg|\.ipa|\.ipsw|\.zip|\.epub)', URL)
-                        fileTypeLog.append(fileType.group(1))
-                    # Notice Example 3 posted above. Those are the odd URLs for
-                    # Personal iCloud data. Since it has no discernable suffix,
-                    # log a value of 'personal icloud'. :shrug:
-                    elif re.match(r'.+(\icloud)', URL):
-                        fileType = re.match(r'.+(\icloud)', URL)
-                        fileTypeLog.append('personal icloud')
-                    #
-                    #
-                    # End of File Type section
+                    if sampleStride:
+                        sampled += sampleRate
+                        if sampled < 1:
+                            unsampledCount += 1
+                            continue
+                        sampled -= 1
+                    elif sampleLimit and (zlib.crc32(x.rstrip()) &
+                                          0xffffffff) >= sampleLimit:
+                        unsampledCount += 1
+                        continue
+                    request = parse_getrequest(logmsg)
+                    if request is None:
+                        badRequestCount += 1
+                        continue
+                    requestCount += 1
+                    day.add_request(timestr[:5], *request)
                 #
                 #
                 # End of Server downloads section
@@ -275,142 +1457,155 @@ def cacher(lines, targetDate, friendlyNames):
             # except:
                 # print x
                 # raise Exception("Funky line - check it out")
+    if ruleCounts is not None:
+        ruleCounts.update({
+            'lines': lineCount, 'skipped': skippedCount,
+            'bandwidth': bandwidthCount, 'noidentity': noIdentityCount,
+            'request': requestCount, 'badrequest': badRequestCount,
+            'unsampled': unsampledCount})
+    return days
+
+
+def parse_getrequest(logmsg):
+    # Pull everything Cacher needs out of a 'Received GET request from' line.
+    # Returns a tuple of (ip, osFamily, osVersion, iOSModel, URL, fileType)
+    # or None if the line doesn't look like a GET request. Ex:
+    # #vO2Ru6q Received GET request from 149.166.73.137:56833, user agent
+    # iOS/10.2 model/iPhone7,2 ... for /a-09f98d6971/pre-thinned756.ipa
+    # The IP is the 6th word (up to the port) and the URL the last one. The
+    # client identity in between is only resolved the first time it is seen.
+    words = logmsg.split(None, 5)
+    if len(words) < 6:
+        return None
+    request = words[5].rsplit(None, 1)
+    if len(request) < 2:
+        return None
+    identity, URL = request
+    identity = identity.split(None, 1)
+    ip = identity[0].split(':', 1)[0]
+    osFamily, osVersion, iOSModel = identityCache[
+        identity[1] if len(identity) > 1 else '']
+    return ip, osFamily, osVersion, iOSModel, URL, get_filetype(URL)
+
+
+def get_filetype(URL):
+    # The file type of a URL from fileTypePrefixes, fileTypeSuffixes and
+    # fileTypePaths, or None. The query string, if any, is not part of the
+    # path.
+    if URL.startswith(fileTypeStarts):
+        for prefix, fileType in fileTypePrefixes.items():
+            if URL.startswith(prefix):
+                return fileType
+    path = URL
+    suffix = URL[URL.rfind('.'):]
+    fileType = fileTypeSuffixes.get(suffix)
+    if fileType is None and '?' in URL:
+        path = URL.split('?', 1)[0]
+        suffix = path[path.rfind('.'):]
+        fileType = fileTypeSuffixes.get(suffix)
+    if fileType is None and suffix in fileTypePaths:
+        for part, pathType in fileTypePaths[suffix]:
+            if part in path:
+                return pathType
+    return fileType
+
+
+def resolve_identity(identity):
+    # The (osFamily, osVersion, iOSModel) of a client identity. Ex:
+    # 'user agent: com.apple.appstored/1.0 iOS/10.2 model/iPhone7,2 ...'
+    identity = ' ' + identity
+    osFamily, osSep, osVersion, iOSModel = clientIdentity.match(
+        identity).groups()
+    if osFamily != 'iOS':
+        # Only iOS devices log their model identifier.
+        iOSModel = None
+    if osFamily is not None:
+        # Example: 'Darwin/15.0.0', 'iOS/10.0.2' or 'OS X 10.12.0'. Both
+        # Darwin and 'OS X ' are reported as macOS so our counts will be
+        # accurate.
+        if osFamily == 'Darwin' or (osFamily == 'OS X' and osSep == ' '):
+            osFamily = 'macOS'
+        # Replace the Darwin version (Ex: 16.3.0) with the macOS version
+        # (Ex: 10.12.2).
+        osVersion = get_friendlynames('darwin').get(osVersion, osVersion)
+        if osFamily == 'iOS' and iOSModel is None:
+            # The model is normally logged after the OS. Look through the
+            # whole identity in case it isn't. ' model/' may be followed by
+            # something that isn't a model identifier, which leaves it None.
+            model = iOSModelPattern.match(identity)
+            if model is not None and model.group(1) is not None:
+                iOSModel = model.group(1)
+    return osFamily, osVersion, iOSModel
+
+
+def get_friendlynames(table):
+    # The 'darwin' (friendlyDarwin) or 'models' (friendlyModels) table, with
+    # the names of friendlyNamesFile added, if there is one. Made the first
+    # time it is needed.
+    if not friendlyTables:
+        tables = {'darwin': dict(friendlyDarwin),
+                  'models': dict(friendlyModels)}
+        if os.path.exists(friendlyNamesFile):
+            try:
+                with open(friendlyNamesFile, 'rb') as f:
+                    data = json.load(f)
+                for name, names in tables.items():
+                    names.update((to_str(k), to_str(v))
+                                 for k, v in data.get(name, {}).items())
+            except (IOError, ValueError, AttributeError) as e:
+                sys.stderr.write('Cacher could not read friendly names from '
+                                 '%s, using the built-in ones: %s\n' % (
+                                     friendlyNamesFile, e))
+                tables = {'darwin': dict(friendlyDarwin),
+                          'models': dict(friendlyModels)}
+        friendlyTables.update(tables)
+    return friendlyTables[table]
+
+
+def cacher_report(day, targetDate, friendlyNames, uptime=None,
+                  seriesInterval=None, topCount=None, topFilesCount=None,
+                  serverName=None, servers=None):
+    # Render a DayStats as the text report. Nothing here touches the logs.
+    # Pass uptime to avoid running /usr/bin/uptime for every reported day.
+    # With a seriesInterval (in minutes), the bandwidth and GET requests of
+    # every interval of the day and the peak hour are added. With a
+    # topCount, the busiest clients and /24 subnets are added, with a
+    # topFilesCount the most requested files and how often files were
+    # requested again. serverName is added to the title (Ex: a server of a
+    # fleet) and servers, a [(name, DayStats)] list, to a summary per server
+    # for fleet totals. Counts of sampled GET requests are estimated (see
+    # DayStats.estimate()).
+    estimate = day.estimate
+    finalOutput = []
+    FriendlyLog = []
+    macOSFamilyLog = []
+    macOSDeviceNumber = []
+    iOSFamilyLog = []
+    iOSDeviceNumber = []
+    AppleTVNumberLog = []
+    iPadNumberLog = []
+    iPhoneNumberLog = []
+    iPodNumberLog = []
     # Beginning of the final output.
     #
     #
     # Append to a new list. This then allows us to call it whenever we need.
     # We can then put this into the Server Alert, stdout, Slack, etc.
+    if serverName:
+        targetDate = '%s on %s' % (targetDate, serverName)
     finalOutput.append(
         'Cacher has retrieved the following stats for %s:' % targetDate)
     finalOutput.append('')
-    # Bandwidth served to clients
-    # There has to be a better way to do this but for v3.0, this works.
-    # This is the worst part of the script/least dynamic. :(
-    # This also does not take into account reboots in the middle of the day.
-    # If someone can figure it out and rewrite this part, kudos.
-    bwtypes = ['Terabytes', 'Gigabytes', 'Megabytes', 'bytes']
+    # Bandwidth served to clients, from Apple and from other Caching Servers.
+    # Every 'Since server start' sample of the day was added up while the
+    # logs were parsed, so restarts in the middle of the day are included.
     # Bail here since there aren't any bandwidth stats.
-    if not sizeLog:
+    if day.firstSample is None:
         print 'Cacher did not retrieve any stats for %s' % targetDate
-        sys.exit(1)
-    else:
-        # Cheat (again) and split the sizeLog so we can do our multiplication
-        # below.
-        firstotalbw = sizeLog[0].split("/")
-        lasttotalbw = sizeLog[-1].split("/")
-    # Mulitply the type of bandwidth by the amount of bytes. This facilitates
-    # the next part to calculate the bandwidth.
-    #
-    # Since the logs are now split, we are given a list. Take this list and
-    # calculate bandwidth type. Should probably do this in a loop, but oh well.
-    # Ex. [1.09, GB, 12.51, MB, 0, bytes]
-    if firstotalbw[1] == 'TB':
-        firstotalbw[0] = "%.2f" % (float(firstotalbw[0]) * 1099511627776)
-    elif firstotalbw[1] == 'GB':
-        firstotalbw[0] = "%.2f" % (float(firstotalbw[0]) * 1073741824)
-    elif firstotalbw[1] == 'MB':
-        firstotalbw[0] = "%.2f" % (float(firstotalbw[0]) * 1048576)
-    elif firstotalbw[1] == 'bytes':
-        firstotalbw[0] = float(firstotalbw[0])
-
-    if lasttotalbw[1] == 'TB':
-        lasttotalbw[0] = "%.2f" % (float(lasttotalbw[0]) * 1099511627776)
-    elif lasttotalbw[1] == 'GB':
-        lasttotalbw[0] = "%.2f" % (float(lasttotalbw[0]) * 1073741824)
-    elif lasttotalbw[1] == 'MB':
-        lasttotalbw[0] = "%.2f" % (float(lasttotalbw[0]) * 1048576)
-    elif lasttotalbw[1] == 'bytes':
-        lasttotalbw[0] = float(lasttotalbw[0])
-
-    if firstotalbw[3] == 'TB':
-        firstotalbw[2] = "%.2f" % (float(firstotalbw[2]) * 1099511627776)
-    elif firstotalbw[3] == 'GB':
-        firstotalbw[2] = "%.2f" % (float(firstotalbw[2]) * 1073741824)
-    elif firstotalbw[3] == 'MB':
-        firstotalbw[2] = "%.2f" % (float(firstotalbw[2]) * 1048576)
-    elif firstotalbw[3] == 'bytes':
-        firstotalbw[2] = int(firstotalbw[2])
-
-    if lasttotalbw[3] == 'TB':
-        lasttotalbw[2] = "%.2f" % (float(lasttotalbw[2]) * 1099511627776)
-    elif lasttotalbw[3] == 'GB':
-        lasttotalbw[2] = "%.2f" % (float(lasttotalbw[2]) * 1073741824)
-    elif firstotalbw[3] == 'MB':
-        lasttotalbw[2] = "%.2f" % (float(lasttotalbw[2]) * 1048576)
-    elif firstotalbw[3] == 'bytes':
-        lasttotalbw[2] = float(lasttotalbw[2])
-
-    if firstotalbw[5] == 'TB':
-        firstotalbw[4] = "%.2f" % (float(firstotalbw[4]) * 1099511627776)
-    elif firstotalbw[5] == 'GB':
-        firstotalbw[4] = "%.2f" % (float(firstotalbw[4]) * 1073741824)
-    elif firstotalbw[5] == 'MB':
-        firstotalbw[4] = "%.2f" % (float(firstotalbw[4]) * 1048576)
-    elif firstotalbw[5] == 'bytes':
-        firstotalbw[4] = int(firstotalbw[4])
-
-    if lasttotalbw[5] == 'TB':
-        lasttotalbw[4] = "%.2f" % (float(lasttotalbw[4]) * 1099511627776)
-    elif lasttotalbw[5] == 'GB':
-        lasttotalbw[4] = "%.2f" % (float(lasttotalbw[4]) * 1073741824)
-    elif firstotalbw[5] == 'MB':
-        lasttotalbw[4] = float(lasttotalbw[4]) * 1048576
-    elif firstotalbw[5] == 'bytes':
-        lasttotalbw[4] = float(lasttotalbw[4])
-
-    # Now take the last bandwidth number from the first one to get our total
-    # bandwidth served. Depending on the amount of bytes, we must divide by
-    # its relevant factor.
-    # Since we know the factor we are dividing by, we can also append the
-    # bandwidth type.
-    totalclientbw = "%.2f" % (
-        (float(lasttotalbw[0]) - float(firstotalbw[0])))
-    if float(totalclientbw) >= 1099511627776:
-        totalclientbw = "%.2f" % (float(totalclientbw) / 1099511627776)
-        totalclientbwtype = bwtypes[0]
-    elif (float(totalclientbw) < 1099511627776) and (
-            float(totalclientbw) >= 1073741824):
-        totalclientbw = "%.2f" % (float(totalclientbw) / 1073741824)
-        totalclientbwtype = bwtypes[1]
-    elif (float(totalclientbw) < 1073741824) and (
-            float(totalclientbw) >= 1048576):
-        totalclientbw = "%.2f" % (float(totalclientbw) / 1048576)
-        totalclientbwtype = bwtypes[2]
-    elif float(totalclientbw) < 1048576:
-        totalclientbwtype = bwtypes[3]
-
-    totalapplebw = "%.2f" % (
-        (float(lasttotalbw[2]) - float(firstotalbw[2])))
-    if float(totalapplebw) >= 1099511627776:
-        totalapplebw = "%.2f" % (float(totalapplebw) / 1099511627776)
-        totalapplebwtype = bwtypes[0]
-    elif (float(totalapplebw) < 1099511627776) and (
-            float(totalapplebw) >= 1073741824):
-        totalapplebw = "%.2f" % (float(totalapplebw) / 1073741824)
-        totalapplebwtype = bwtypes[1]
-    elif (float(totalapplebw) < 1073741824) and (
-            float(totalapplebw) >= 1048576):
-        totalapplebw = "%.2f" % (float(totalapplebw) / 1048576)
-        totalapplebwtype = bwtypes[2]
-    elif float(totalapplebw) < 1048576:
-        totalapplebwtype = bwtypes[3]
-
-    totalcachingbw = "%.2f" % (
-        (float(lasttotalbw[4]) - float(firstotalbw[4])))
-    if float(totalcachingbw) >= 1099511627776:
-        totalcachingbw = "%.2f" % (float(totalcachingbw) / 1099511627776)
-        totalcachingbwtype = bwtypes[1]
-    elif (float(totalcachingbw) < 1099511627776) and (
-            float(totalcachingbw) >= 1073741824):
-        totalcachingbw = "%.2f" % (float(totalcachingbw) / 1073741824)
-        totalcachingbwtype = bwtypes[1]
-    elif (float(totalcachingbw) < 1073741824) and (
-            float(totalcachingbw) >= 1048576):
-        totalcachingbw = "%.2f" % (float(totalcachingbw) / 1048576)
-        totalcachingbwtype = bwtypes[2]
-    elif float(totalcachingbw) < 1048576:
-        totalcachingbwtype = bwtypes[3]
-
+        return None
+    totalclientbw, totalclientbwtype = format_bandwidth(day.bandwidth[0])
+    totalapplebw, totalapplebwtype = format_bandwidth(day.bandwidth[1])
+    totalcachingbw, totalcachingbwtype = format_bandwidth(day.bandwidth[2])
     finalOutput.append(
         '%s %s of bandwith served to client devices.' % (
             totalclientbw, totalclientbwtype))
@@ -420,19 +1615,29 @@ def cacher(lines, targetDate, friendlyNames):
     finalOutput.append(
         ' %s %s of bandwith requested from other Caching Servers' % (
             totalcachingbw, totalcachingbwtype))
+    if day.restarts:
+        finalOutput.append(
+            ' The Caching Server restarted %s time(s) on this date. The '
+            'bandwidth before and after every restart was added up.'
+            % day.restarts)
     finalOutput.append('')
+    if servers:
+        finalOutput.extend(fleet_report(servers))
 
     # Total Numbers of IP addresses
     finalOutput.append(
         '%s IP Addresses hit the Caching Server yesterday consisting'
-        ' of:' % len(IPLog))
-    finalOutput.append('  %s Unique IP Addresses.' % len(set(IPLog)))
+        ' of:' % estimate(day.requestCount))
+    finalOutput.append('  %s Unique IP Addresses.' % estimate(
+        day.unique_ips(), True))
     finalOutput.append('')
+    if topCount:
+        finalOutput.extend(top_report(day, topCount))
 
     # Total Number of iOS devices
     finalOutput.append(
         'A total of %s iOS downloads were requested from the Caching Server'
-        ' yesterday consisting of:' % len(iOSModelOnlyLog))
+        ' yesterday consisting of:' % estimate(sum(day.modelCounts.values())))
 
     # Sort the list by device type (AppleTV, iPad, iPhone, iPod). If we aren't
     # using the friendly names, we use the standard sorting, but if we use the
@@ -448,12 +1653,8 @@ def cacher(lines, targetDate, friendlyNames):
         # Example:
         # iPhone3,1 becomes iPhone 4 [GSM]/numberofDevices which is then sorted
         # and finally split.
-        for x in set(iOSModelOnlyLog):
-            numberofDevices = iOSModelOnlyLog.count(x)
-            modeltype = x
-            for k, v in friendlyModels.items():
-                if k == modeltype:
-                    modeltype = v
+        for x, numberofDevices in day.modelCounts.items():
+            modeltype = get_friendlynames('models').get(x, x)
             FriendlyLog.append('%s/%s' % (modeltype, numberofDevices))
             if 'Apple TV' in modeltype:
                 AppleTVNumberLog.append('%s' % numberofDevices)
@@ -470,23 +1671,28 @@ def cacher(lines, targetDate, friendlyNames):
         iPodNumberLog = [int(i) for i in iPodNumberLog]
         # Output
         finalOutput.append(
-            ' A total of %s Apple TV downloads' % sum(AppleTVNumberLog))
+            ' A total of %s Apple TV downloads' % estimate(
+                sum(AppleTVNumberLog)))
         finalOutput.append(
-            ' A total of %s iPad downloads' % sum(iPadNumberLog))
+            ' A total of %s iPad downloads' % estimate(
+                sum(iPadNumberLog)))
         finalOutput.append(
-            ' A total of %s iPhone downloads' % sum(iPhoneNumberLog))
+            ' A total of %s iPhone downloads' % estimate(
+                sum(iPhoneNumberLog)))
         finalOutput.append(
-            ' A total of %s iPod downloads' % sum(iPodNumberLog))
+            ' A total of %s iPod downloads' % estimate(
+                sum(iPodNumberLog)))
         for x in sorted(set(FriendlyLog)):
             numberofDevices = x.split('/')[1]
             modeltype = x.split('/')[0]
-            finalOutput.append('  %s %s' % (numberofDevices, modeltype))
+            finalOutput.append('  %s %s' % (estimate(int(numberofDevices)),
+                                            modeltype))
     else:
         # Non Friendly Name Sorting:
         # This one is easier than friendly names as it's alphabetized by
         # sorted(). Count the devices and prefix it on the output.
-        for x in sorted(set(iOSModelOnlyLog)):
-            numberofDevices = iOSModelOnlyLog.count(x)
+        for x in sorted(day.modelCounts):
+            numberofDevices = day.modelCounts[x]
             modeltype = x
             if 'AppleTV' in modeltype:
                 AppleTVNumberLog.append('%s' % numberofDevices)
@@ -503,26 +1709,31 @@ def cacher(lines, targetDate, friendlyNames):
         iPodNumberLog = [int(i) for i in iPodNumberLog]
         # Output
         finalOutput.append(
-            ' A total of %s Apple TV downloads' % sum(AppleTVNumberLog))
+            ' A total of %s Apple TV downloads' % estimate(
+                sum(AppleTVNumberLog)))
         finalOutput.append(
-            ' A total of %s iPad downloads' % sum(iPadNumberLog))
+            ' A total of %s iPad downloads' % estimate(
+                sum(iPadNumberLog)))
         finalOutput.append(
-            ' A total of %s iPhone downloads' % sum(iPhoneNumberLog))
+            ' A total of %s iPhone downloads' % estimate(
+                sum(iPhoneNumberLog)))
         finalOutput.append(
-            ' A total of %s iPod downloads' % sum(iPodNumberLog))
-        for x in sorted(set(iOSModelOnlyLog)):
-            numberofDevices = iOSModelOnlyLog.count(x)
+            ' A total of %s iPod downloads' % estimate(
+                sum(iPodNumberLog)))
+        for x in sorted(day.modelCounts):
+            numberofDevices = day.modelCounts[x]
             modeltype = x
-            finalOutput.append('  %s %s' % (numberofDevices, modeltype))
+            finalOutput.append('  %s %s' % (estimate(int(numberofDevices)),
+                                            modeltype))
 
     finalOutput.append('')
 
     # Total Number of OS Versions
     finalOutput.append(
         'A total of %s OS downloads were requested from the Caching Server'
-        ' yesterday consisting of:' % len(OSLog))
-    for x in sorted(set(OSLog)):
-        numberofVersions = OSLog.count(x)
+        ' yesterday consisting of:' % estimate(sum(day.osCounts.values())))
+    for x in sorted(day.osCounts):
+        numberofVersions = day.osCounts[x]
         osversion = x[0]
         osfamily = x[1]
         if osfamily == 'macOS':
@@ -534,20 +1745,23 @@ def cacher(lines, targetDate, friendlyNames):
                 '%s/%s' % (osfamily + ' ' + osversion, numberofVersions))
             iOSDeviceNumber.append(numberofVersions)
 
-    # Sort the iOS versions with LooseVersion. StrictVersion fails since I am
+    # Sort the iOS versions with version_key. StrictVersion fails since I am
     # cheating and adding /devicecount to the version. (Ex. iOS 10.2/2000)
-    finalOutput.append(' %s iOS downloads:' % sum(iOSDeviceNumber))
-    for x in sorted(set(iOSFamilyLog), key=LooseVersion):
+    finalOutput.append(' %s iOS downloads:' % estimate(sum(iOSDeviceNumber)))
+    for x in sorted(set(iOSFamilyLog), key=version_key):
         numberofVersions = x.split('/')[1]
         modeltype = x.split('/')[0]
-        finalOutput.append('  %s %s' % (numberofVersions, modeltype))
+        finalOutput.append('  %s %s' % (estimate(int(numberofVersions)),
+                                        modeltype))
 
     # Sort the macOS versions normally, since they all start with 10.
-    finalOutput.append(' %s macOS downloads:' % sum(macOSDeviceNumber))
+    finalOutput.append(' %s macOS downloads:' % estimate(
+        sum(macOSDeviceNumber)))
     for x in sorted(set(macOSFamilyLog)):
         numberofVersions = x.split('/')[1]
         modeltype = x.split('/')[0]
-        finalOutput.append('  %s %s' % (numberofVersions, modeltype))
+        finalOutput.append('  %s %s' % (estimate(int(numberofVersions)),
+                                        modeltype))
     finalOutput.append('')
 
     # Total Number of Apple Configurator 2 files.
@@ -555,48 +1769,65 @@ def cacher(lines, targetDate, friendlyNames):
     # Since you can't disintinguish between the version of AC2, I'm removing
     # the secondary line I had in the shell version.
     finalOutput.append('A total of %s Applications were downloaded from Apple'
-                       ' Configurator 2 devices' % len(AC2Log))
+                       ' Configurator 2 devices' % estimate(day.AC2Count))
     finalOutput.append('')
 
     # Total Number of filetypes downloaded and their respect numbers
     finalOutput.append('A total of %s files were downloaded from the Caching'
-                       ' Server yesterday consisting of:' % len(fileTypeLog))
-    for x in set(fileTypeLog):
-        numberofFiles = fileTypeLog.count(x)
-        finalOutput.append(' %s %s files' % (numberofFiles, x))
+                       ' Server yesterday consisting of:'
+                       % estimate(sum(day.fileTypeCounts.values())))
+    for x in sorted(day.fileTypeCounts):
+        numberofFiles = day.fileTypeCounts[x]
+        finalOutput.append(' %s %s files' % (estimate(numberofFiles), x))
     finalOutput.append('')
 
     # Total Number of unique filetypes downloaded and their respect numbers
-    urlUniqueLog = set(urlLog)
     finalOutput.append('A total of %s unique files were downloaded from the'
                        ' Caching Server yesterday consisting'
-                       ' of:' % len(urlUniqueLog))
-    # Same logic taken from "File Type Section" so I'm not documenting it.
-    for x in urlUniqueLog:
-        if re.match(r'.+(\.pkg|\.ipa|\.ipsw|\.zip|\.epub)', x):
-            fileType = re.match(
-                r'.+(\.pkg|\.ipa|\.ipsw|\.zip|\.epub)', x)
-            fileTypeUniqueLog.append(fileType.group(1))
-        elif re.match(r'.+(\icloud)', URL):
-            fileType = re.match(r'.+(\icloud)', x)
-            fileTypeUniqueLog.append('personal icloud')
-    for x in set(sorted(fileTypeUniqueLog)):
-        numberofFiles = fileTypeUniqueLog.count(x)
-        finalOutput.append(' %s %s files' % (numberofFiles, x))
+                       ' of:' % estimate(day.unique_files(), True))
+    fileTypeUniqueCounts = day.unique_filetypes()
+    for x in sorted(fileTypeUniqueCounts):
+        numberofFiles = fileTypeUniqueCounts[x]
+        finalOutput.append(' %s %s files' % (estimate(numberofFiles, True),
+                                             x))
     finalOutput.append('')
+    if topFilesCount:
+        finalOutput.extend(files_report(day, topFilesCount))
+    if seriesInterval:
+        finalOutput.extend(series_report(day, seriesInterval))
+        finalOutput.append('')
+    if day.sketchError:
+        finalOutput.append(
+            'Unique IP and file counts are approximate (standard error: '
+            '%.2f%%).' % (day.ipSketch.error * 100))
+        finalOutput.append('')
+    if day.sampleRate:
+        finalOutput.append(
+            'GET request counts are estimated from a %g%% sample of the '
+            'requests, with 95%% confidence intervals. Unique IP and file '
+            'counts are not estimated: they are the ones seen in the sample, '
+            'so there were at least as many. Bandwidth is exact.'
+            % (day.sampleRate * 100))
+        if seriesInterval:
+            finalOutput.append(
+                'Requests per minute at the peaks are the sampled ones, not '
+                'estimates.')
+        finalOutput.append('')
     # Add Cacher version
     finalOutput.append('Cacher version: %s' % version)
-    finalOutput.append('Uptime: %s' % get_uptime())
+    if uptime is None:
+        uptime = get_uptime()
+    finalOutput.append('Uptime: %s' % uptime)
     # Check to see if there are entries in the noClientLog. If there are,
     # print to final message to warn the user.
-    if noClientIdentityLog:
+    if day.noClientIdentityCount:
         finalOutput.append('')
         finalOutput.append(
             "WARNING: Found %s logs that did not contain "
             "the client identity. These logs have been dropped and are not "
             "counted in the statistics. More than likely LogClientIdentity "
             "was incorrectly set or not configured on this date."
-            % len(noClientIdentityLog))
+            % day.noClientIdentityCount)
     #
     #
     # End of the final output.
@@ -604,7 +1835,1136 @@ def cacher(lines, targetDate, friendlyNames):
     # print("\n".join(finalOutput))
 
 
+def top_report(day, count):
+    # The busiest clients and /24 subnets by GET requests. A range is shown
+    # when a count is approximate (Ex: 1520-1532 requests).
+    finalOutput = []
+    for name, summary, suffix in (('clients', day.topClients, ''),
+                                  ('/24 subnets', day.topSubnets, '.0/24')):
+        top = summary.top(count)
+        finalOutput.append('Top %s %s by GET requests:' % (len(top), name))
+        for item, itemCount, error in top:
+            if error:
+                itemCount = '%s-%s' % (day.estimate(itemCount - error),
+                                       day.estimate(itemCount))
+            else:
+                itemCount = day.estimate(itemCount)
+            finalOutput.append(' %s requests from %s%s' % (itemCount, item,
+                                                           suffix))
+        finalOutput.append('')
+    return finalOutput
+
+
+def files_report(day, count):
+    # The most requested files, the requests for files requested before and
+    # how many files of every type were requested once, 2-10 times, 11-100
+    # times and so on.
+    finalOutput = []
+    top = day.top_files(count)
+    finalOutput.append('Top %s files by GET requests:' % len(top))
+    for URL, requests, error in top:
+        if error:
+            requests = '%s-%s' % (day.estimate(requests - error),
+                                  day.estimate(requests))
+        else:
+            requests = day.estimate(requests)
+        finalOutput.append(' %s requests for %s' % (requests, URL))
+    finalOutput.append('')
+    if day.sampleRate:
+        finalOutput.append('Repeated requests and the number of requests per '
+                           'file are only counted without --sample.')
+        finalOutput.append('')
+        return finalOutput
+    if day.requestCount:
+        repeats = max(day.requestCount - day.unique_files(), 0)
+        finalOutput.append(
+            '%s of %s GET requests were for a file requested before '
+            '(%.1f%%).' % (repeats, day.requestCount,
+                           100.0 * repeats / day.requestCount))
+        finalOutput.append('')
+    histogram = day.request_histogram()
+    if histogram is None:
+        finalOutput.append('The number of requests per file is only counted '
+                           'without --approximate.')
+        finalOutput.append('')
+        return finalOutput
+    finalOutput.append('Files by number of GET requests:')
+    for fileType in sorted(histogram):
+        finalOutput.append(' %s files:' % fileType)
+        for bucket, files in sorted(histogram[fileType].items()):
+            if bucket == 0:
+                finalOutput.append('  %s requested once' % files)
+            else:
+                finalOutput.append('  %s requested %s-%s times' % (
+                    files, 10 ** (bucket - 1) + 1, 10 ** bucket))
+    finalOutput.append('')
+    return finalOutput
+
+
+def fleet_report(servers):
+    # The bandwidth, GET requests and unique IPs of every server of a fleet.
+    finalOutput = ['Stats per Caching Server:']
+    for name, day in servers:
+        if day.firstSample is None:
+            finalOutput.append(' %s: no stats' % name)
+            continue
+        finalOutput.append(
+            ' %s: %s %s served to client devices, %s GET requests from %s '
+            'Unique IP Addresses' % ((name,) + format_bandwidth(
+                day.bandwidth[0]) + (day.estimate(day.requestCount),
+                                     day.estimate(day.unique_ips(), True))))
+    finalOutput.append('')
+    return finalOutput
+
+
+def cacher(lines, targetDate, friendlyNames, sample=None):
+    # With a sample (see parse_days()), the GET request counts are
+    # estimated.
+    finalOutput = cacher_report(
+        parse_days(lines, [targetDate], sample=sample)[targetDate],
+        targetDate, friendlyNames)
+    if finalOutput is None:
+        sys.exit(1)
+    return finalOutput
+
+
+# Library API. Together with parse_files(), these let other tools (or any
+# platform with a copy of the logs) use Cacher without Server.app:
+#   days = cacher.parse_files(cacher.get_logfiles(path), ['2017-01-15'])
+#   print cacher.render(days['2017-01-15'], '2017-01-15')
+def parse_lines(lines, targetDates=None, since=None, until=None,
+                sketchError=None):
+    # Parse log lines into a DayStats per date. Every date found is collected
+    # if targetDates is None.
+    return dict(parse_days(lines, targetDates, since, until, sketchError))
+
+
+def aggregate(days):
+    # Merge DayStats of consecutive parts of the same logs (Ex: the days of
+    # a week), in log order, into one. They must all use the same
+    # sketchError.
+    total = None
+    for day in days:
+        if total is None:
+            total = DayStats(day.sketchError, day.sampleRate)
+        total.merge(day)
+    return total
+
+
+def combine(days):
+    # Combine the DayStats of different Caching Servers for the same date
+    # into fleet totals. Unique IPs and files are counted once across all
+    # servers. They must all use the same sketchError.
+    total = None
+    for day in days:
+        if total is None:
+            total = DayStats(day.sketchError, day.sampleRate)
+        total.combine(day)
+    return total
+
+
+def render(day, targetDate, friendlyNames=True, uptime='unknown',
+           seriesInterval=None, topCount=None, topFilesCount=None):
+    # The text report of a DayStats, or None if it holds no stats. The
+    # uptime of the local machine is only looked up if uptime is None.
+    finalOutput = cacher_report(day, targetDate, friendlyNames, uptime,
+                                seriesInterval, topCount, topFilesCount)
+    if finalOutput is None:
+        return None
+    return '\n'.join(finalOutput)
+
+
+def to_bytes(amount, unit):
+    # '1.09', 'GB' -> 1170378588.16
+    return float(amount) * byteUnits.get(unit, 1)
+
+
+def format_bandwidth(amount):
+    # 1170378588.16 -> ('1.09', 'Gigabytes')
+    for unit, name in [('TB', 'Terabytes'), ('GB', 'Gigabytes'),
+                       ('MB', 'Megabytes')]:
+        if amount >= byteUnits[unit]:
+            return '%.2f' % (amount / byteUnits[unit]), name
+    return '%.2f' % amount, 'bytes'
+
+
+def get_series(day, interval=60):
+    # Split a day into intervals of so many minutes. Returns a list of
+    # ('HH:MM', [bytes to clients, from Apple, from peers], GET requests,
+    # busiest minute's GET requests) for every interval.
+    interval = min(max(interval, 1), 1440)
+    series = []
+    for start in range(0, 1440, interval):
+        series.append(['%02d:%02d' % (start // 60, start % 60),
+                       [0.0, 0.0, 0.0], 0, 0])
+    for minute, delta in day.bandwidthMinutes.items():
+        bucket = series[minute_of_day(minute) // interval]
+        for i in range(3):
+            bucket[1][i] += delta[i]
+    for minute, count in day.requestMinutes.items():
+        bucket = series[minute_of_day(minute) // interval]
+        bucket[2] += count
+        bucket[3] = max(bucket[3], count)
+    return [tuple(x) for x in series]
+
+
+def minute_of_day(minute):
+    # '08:41' -> 521
+    return int(minute[:2]) * 60 + int(minute[3:5])
+
+
+def series_report(day, interval):
+    output = []
+    output.append('Bandwidth and GET requests per %s minutes:' % interval)
+    for start, bandwidth, requests, peakRequests in get_series(day,
+                                                               interval):
+        if not (any(bandwidth) or requests):
+            continue
+        output.append(
+            ' %s %s %s to clients, %s %s from Apple, %s %s from peers, %s '
+            'GET requests (peak %s per minute)' % (
+                (start,) + format_bandwidth(bandwidth[0]) +
+                format_bandwidth(bandwidth[1]) +
+                format_bandwidth(bandwidth[2]) + (
+                    day.estimate(requests),
+                    day.estimate(peakRequests, peak=True))))
+    hours = get_series(day, 60)
+    start, bandwidth, requests, peakRequests = max(
+        hours, key=lambda x: x[1][0])
+    if bandwidth[0]:
+        output.append('Peak hour for bandwidth: %s with %s %s served to client'
+                      ' devices' % ((start,) + format_bandwidth(bandwidth[0])))
+    start, bandwidth, requests, peakRequests = max(hours, key=lambda x: x[2])
+    if requests:
+        output.append('Peak hour for GET requests: %s with %s requests (%.1f '
+                      'per minute)' % (start, day.estimate(requests),
+                                       requests / 60.0 /
+                                       (day.sampleRate or 1)))
+        minute, count = max(day.requestMinutes.items(),
+                            key=lambda x: (x[1], x[0]))
+        output.append('Peak minute for GET requests: %s with %s requests' % (
+            minute, day.estimate(count, peak=True)))
+    return output
+
+
+def get_snapshot(days, lineCount):
+    # The stats of every day in memory as plain dicts and lists, for
+    # /stats.json and render_metrics(). server holds the counters of the last
+    # 'Since server start' sample seen.
+    snapshot = {
+        'updated': int(time.time()),
+        'linesParsed': lineCount,
+        'server': None,
+        'days': {},
+    }
+    for datestr in sorted(days):
+        day = days[datestr]
+        bandwidth = None
+        if day.firstSample is not None:
+            bandwidth = dict(zip(
+                ['returnedToClients', 'storedFromInternet', 'fromPeers'],
+                day.bandwidth))
+            snapshot['server'] = dict(zip(
+                ['returnedToClients', 'storedFromInternet', 'fromPeers'],
+                day.lastSample[1:]))
+        uniqueFileTypes = day.unique_filetypes()
+        snapshot['days'][datestr] = {
+            'requests': day.requestCount,
+            'requestsWithoutClientIdentity': day.noClientIdentityCount,
+            'uniqueClients': day.unique_ips(),
+            'uniqueFiles': day.unique_files(),
+            'approximate': bool(day.sketchError),
+            'os': [{'family': osFamily, 'version': osVersion,
+                    'requests': count}
+                   for (osVersion, osFamily), count in sorted(
+                       day.osCounts.items())],
+            'models': dict((str(model), count)
+                           for model, count in day.modelCounts.items()),
+            'fileTypes': dict(
+                (fileType, {'requests': count,
+                            'uniqueFiles': uniqueFileTypes[fileType]})
+                for fileType, count in day.fileTypeCounts.items()),
+            'bandwidth': bandwidth,
+            'restarts': day.restarts,
+            'hourly': [{'hour': start, 'returnedToClients': hour[0],
+                        'storedFromInternet': hour[1], 'fromPeers': hour[2],
+                        'requests': requests,
+                        'peakRequestsPerMinute': peakRequests}
+                       for start, hour, requests, peakRequests
+                       in get_series(day, 60)],
+        }
+    return snapshot
+
+
+def render_metrics(snapshot):
+    # A get_snapshot() in the Prometheus text exposition format.
+    metrics = []
+    days = sorted(snapshot['days'].items())
+    add_metric(metrics, 'requests', 'gauge', 'GET requests from clients.',
+               [([('date', d)], x['requests']) for d, x in days])
+    add_metric(metrics, 'requests_without_client_identity', 'gauge',
+               'GET requests without a client identity.',
+               [([('date', d)], x['requestsWithoutClientIdentity'])
+                for d, x in days])
+    add_metric(metrics, 'unique_clients', 'gauge',
+               'Unique client IP addresses.',
+               [([('date', d)], x['uniqueClients']) for d, x in days])
+    add_metric(metrics, 'unique_files', 'gauge', 'Unique files requested.',
+               [([('date', d)], x['uniqueFiles']) for d, x in days])
+    add_metric(metrics, 'os_requests', 'gauge',
+               'GET requests per OS version.',
+               [([('date', d), ('family', o['family']),
+                  ('version', o['version'])], o['requests'])
+                for d, x in days for o in x['os']])
+    add_metric(metrics, 'model_requests', 'gauge',
+               'GET requests per iOS device model.',
+               [([('date', d), ('model', model)], count)
+                for d, x in days for model, count in sorted(
+                    x['models'].items())])
+    add_metric(metrics, 'filetype_requests', 'gauge',
+               'GET requests per file type.',
+               [([('date', d), ('filetype', fileType)], y['requests'])
+                for d, x in days for fileType, y in sorted(
+                    x['fileTypes'].items())])
+    add_metric(metrics, 'filetype_unique_files', 'gauge',
+               'Unique files per file type.',
+               [([('date', d), ('filetype', fileType)], y['uniqueFiles'])
+                for d, x in days for fileType, y in sorted(
+                    x['fileTypes'].items())])
+    add_metric(metrics, 'bandwidth_bytes', 'gauge', 'Bytes transferred.',
+               [([('date', d), ('direction', direction)], value)
+                for d, x in days if x['bandwidth']
+                for direction, value in sorted(x['bandwidth'].items())])
+    if snapshot['server']:
+        add_metric(metrics, 'server_bytes', 'gauge',
+                   'Bytes transferred since the Caching Server started.',
+                   [([('direction', direction)], value)
+                    for direction, value in sorted(
+                        snapshot['server'].items())])
+    add_metric(metrics, 'lines_parsed_total', 'counter',
+               'Lines parsed from the live log since Cacher started.',
+               [([], snapshot['linesParsed'])])
+    add_metric(metrics, 'last_update_timestamp_seconds', 'gauge',
+               'When the stats were last updated.',
+               [([], snapshot['updated'])])
+    return '\n'.join(metrics) + '\n'
+
+
+def add_metric(metrics, name, metricType, help, samples):
+    # Append a metric with its (labels, value) samples to metrics. Label
+    # values are escaped as the exposition format requires.
+    metrics.append('# HELP cacher_%s %s' % (name, help))
+    metrics.append('# TYPE cacher_%s %s' % (name, metricType))
+    for labels, value in samples:
+        labels = ','.join(
+            '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace(
+                '"', '\\"').replace('\n', '\\n')) for k, v in labels)
+        if isinstance(value, float):
+            value = repr(value)
+        metrics.append('cacher_%s%s %s' % (
+            name, '{%s}' % labels if labels else '', value))
+
+
+def get_daterange(startDate, endDate):
+    # Every date from startDate to endDate (inclusive) as YYYY-MM-DD strings.
+    start = datetime.strptime(startDate, '%Y-%m-%d').date()
+    end = datetime.strptime(endDate, '%Y-%m-%d').date()
+    return [str(start + timedelta(i)) for i in range((end - start).days + 1)]
+
+
+def get_logfiles(logPath):
+    # Collect the live logs and the rotated .bz2 archives (Server 4.1+). Sort
+    # them oldest first so the bandwidth lines are read in chronological order.
+    logFiles = glob.glob(os.path.join(logPath, '*.log'))
+    logFiles.extend(glob.glob(os.path.join(logPath, '*.log.bz2')))
+    return sorted(logFiles, key=os.path.getmtime)
+
+
+def open_log(logFile):
+    # Archives are decompressed in-process while they are read instead of
+    # being expanded to disk with bunzip2.
+    if logFile.endswith('.bz2'):
+        return bz2.BZ2File(logFile, 'rb')
+    return open(logFile, 'rb')
+
+
+def read_logs(logFiles):
+    # Lazily yield every line of every log so cacher() never needs the whole
+    # (decompressed) log in memory.
+    for logFile in logFiles:
+        with open_log(logFile) as f:
+            for line in f:
+                yield line
+
+
+def get_logrange(logFile, targetDates, since=None, until=None):
+    # Lines within a log are in chronological order, so bisect on the
+    # timestamps to find the byte range that holds the requested dates (and
+    # times). Only that part of the file needs to be read.
+    startKey = '%s %s' % (min(targetDates), since or '')
+    if until:
+        endKey = '%s %s' % (max(targetDates), until)
+    else:
+        # Everything up to the start of the following day.
+        endKey = str(datetime.strptime(max(targetDates), '%Y-%m-%d').date() +
+                     timedelta(1))
+    with open(logFile, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        return (find_logoffset(f, size, startKey),
+                find_logoffset(f, size, endKey))
+
+
+def split_logrange(logFile, start, end, pieces):
+    # Split a byte range of a log into (up to) pieces ranges of at least
+    # minChunkSize bytes. Every range starts at the beginning of a line.
+    chunkSize = max(minChunkSize, (end - start) // max(pieces, 1) + 1)
+    ranges = []
+    with open(logFile, 'rb') as f:
+        while end - start > chunkSize:
+            f.seek(start + chunkSize - 1)
+            f.readline()
+            split = min(f.tell(), end)
+            ranges.append((start, split))
+            start = split
+    if end > start or not ranges:
+        ranges.append((start, end))
+    return ranges
+
+
+def read_logrange(logFile, start, end):
+    # Yield the lines between two line-aligned offsets of a log.
+    remaining = end - start
+    if remaining <= 0:
+        return
+    with open(logFile, 'rb') as f:
+        f.seek(start)
+        for line in f:
+            yield line
+            remaining -= len(line)
+            if remaining <= 0:
+                break
+
+
+def scan_logrange(logFile, start, end, ruleCounts=None):
+    # Yield the lines between two line-aligned offsets of an uncompressed log
+    # that hold the bandwidthMarker or requestMarker, which are all
+    # parse_days() looks at, so the other lines are never split or parsed.
+    # The log is memory mapped a window at a time. When few lines match, the
+    # window is searched for the markers and only the matching lines are
+    # copied out. When most do, it is quicker to split the window into lines
+    # and filter them. (Searching the mmap itself is a lot slower than
+    # searching a copy of the window.) If a ruleCounts Counter is given, the
+    # lines that were passed over are added to its line count.
+    if end <= start:
+        return
+    passed = 0
+    with open(logFile, 'rb') as f:
+        pos = start
+        while pos < end:
+            mapStart = pos - pos % mmap.ALLOCATIONGRANULARITY
+            mapEnd = min(end, pos + scanWindow)
+            mm = mmap.mmap(f.fileno(), mapEnd - mapStart,
+                           access=mmap.ACCESS_READ, offset=mapStart)
+            try:
+                window = mm[pos - mapStart:]
+            finally:
+                mm.close()
+            if mapEnd < end:
+                # End the window on a whole line.
+                window = window[:window.rfind('\n') + 1 or len(window)]
+            pos += len(window)
+            lines = window.count('\n')
+            if window[-1] != '\n':
+                # An unfinished last line.
+                lines += 1
+            hits = (window.count(requestMarker) +
+                    window.count(bandwidthMarker))
+            if hits * 4 > lines:
+                matched = [line for line in window.split('\n')
+                           if requestMarker in line or bandwidthMarker in line]
+                passed += lines - len(matched)
+                for line in matched:
+                    yield line
+                continue
+            find = window.find
+            nextBandwidth = find(bandwidthMarker)
+            nextRequest = find(requestMarker)
+            lineEnd = 0
+            while nextRequest >= 0 or nextBandwidth >= 0:
+                if nextBandwidth < 0 or 0 <= nextRequest < nextBandwidth:
+                    hit = nextRequest
+                else:
+                    hit = nextBandwidth
+                lineStart = window.rfind('\n', lineEnd, hit) + 1 or lineEnd
+                lineEnd = find('\n', hit) + 1 or len(window)
+                yield window[lineStart:lineEnd]
+                lines -= 1
+                if 0 <= nextRequest < lineEnd:
+                    nextRequest = find(requestMarker, lineEnd)
+                if 0 <= nextBandwidth < lineEnd:
+                    nextBandwidth = find(bandwidthMarker, lineEnd)
+            passed += lines
+    if ruleCounts is not None:
+        ruleCounts['lines'] += passed
+
+
+def find_logoffset(f, size, key):
+    # Return the offset of the first line with a timestamp at or after key
+    # (or the end of the file). Lines without a timestamp are skipped.
+    lo, hi = 0, size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        offset, stamp = get_logstamp(f, mid)
+        if stamp is None or stamp >= key:
+            hi = mid
+        else:
+            lo = mid + 1
+    return get_logstamp(f, lo)[0]
+
+
+def get_logstamp(f, offset):
+    # Resync to the first line starting at or after offset and return where
+    # the first timestamped line from there starts, along with its
+    # 'date time' stamp.
+    if offset == 0:
+        f.seek(0)
+    else:
+        # Reading the rest of the line from offset - 1 lands on the start of
+        # the next line (or stays put if offset already starts a line).
+        f.seek(offset - 1)
+        f.readline()
+    while True:
+        lineStart = f.tell()
+        line = f.readline()
+        if not line:
+            return lineStart, None
+        if logStamp.match(line):
+            return lineStart, line[:logStampLength]
+
+
+def parse_files(logFiles, targetDates, cacheFile=None, since=None,
+                until=None, jobs=1, sketchError=None, profile=None,
+                progress=False, threads=decompressThreads, sample=None):
+    # Parse the log files and merge the results per day, in log order. See
+    # parse_fleet().
+    return parse_fleet([(None, logFiles)], targetDates, cacheFile, since,
+                       until, jobs, sketchError, profile, progress,
+                       threads, sample)[None]
+
+
+def parse_fleet(servers, targetDates, cacheFile=None, since=None,
+                until=None, jobs=1, sketchError=None, profile=None,
+                progress=False, threads=decompressThreads, sample=None):
+    # Parse the log files of every server, given as [(name, logFiles)], and
+    # merge the results per server and day, in log order. Returns
+    # {name: {date: DayStats}}. The logs of all servers share one pool, so
+    # a fleet is parsed as fast as a single server with as many logs. With
+    # more than one job the files (and large ranges of uncompressed logs) are
+    # parsed in a pool of processes. The merged result is the same either
+    # way. Archives are decompressed by up to threads background threads
+    # while the parser works (one per archive), so a single process keeps
+    # the next archives decompressing while it parses the current one.
+    # If a cache file is given, the per-day results of every rotated .bz2
+    # archive are stored in it, keyed by the archive's path, inode, size and
+    # mtime. Archives never change once rotated, so later runs only parse the
+    # live log and any new archives. The cache holds whole days, so it is not
+    # used when a time window or a sample (see parse_days()) is requested.
+    # The rule counts of the parsed lines are added to profile (a Profiler),
+    # if given. With progress, throughput and an ETA are shown on stderr.
+    if since or until or sample:
+        cacheFile = None
+    # Evenly spaced samples are counted from the start of every log, so a
+    # log is not split into ranges that would each start counting again.
+    # That way any number of jobs samples the same requests.
+    pieces = 1 if sample and sample[1] == 'stride' else jobs
+    cache = {}
+    namesIdentity = None
+    if cacheFile:
+        cache = read_cache(cacheFile)
+        # Cached archives hold the macOS versions of the friendly names file
+        # they were parsed with.
+        if os.path.exists(friendlyNamesFile):
+            namesIdentity = get_fileidentity(friendlyNamesFile)
+    newCache = {}
+    # Every log contributes a list of parts to merge, in order. A part is
+    # either the results of a cached archive or the index of a task.
+    tasks = []
+    taskSizes = []
+    logParts = []
+    identities = {}
+    for name, logFile in [(name, logFile) for name, logFiles in servers
+                          for logFile in logFiles]:
+        parts = []
+        if not logFile.endswith('.bz2'):
+            # Uncompressed logs can be seeked, so only the requested dates
+            # are read.
+            start, end = get_logrange(logFile, targetDates, since, until)
+            for chunk in split_logrange(logFile, start, end, pieces):
+                parts.append(len(tasks))
+                tasks.append((logFile, chunk, targetDates, since, until,
+                              sketchError, threads, sample))
+                taskSizes.append((chunk[1] - chunk[0], False))
+        elif not cacheFile:
+            parts.append(len(tasks))
+            tasks.append((logFile, None, targetDates, since, until,
+                          sketchError, threads, sample))
+            taskSizes.append((os.path.getsize(logFile), True))
+        else:
+            identity = identities[logFile] = get_fileidentity(logFile)
+            entry = cache.get(logFile)
+            if (entry and entry['identity'] == identity and
+                    entry['sketchError'] == sketchError and
+                    entry['friendlyNames'] == namesIdentity):
+                parts.append(dict(
+                    (targetDate, DayStats.from_dict(entry['days'][targetDate]))
+                    for targetDate in targetDates
+                    if targetDate in entry['days']))
+                newCache[logFile] = entry
+            else:
+                # Collect every date, not just the ones asked for, so the
+                # archive never has to be parsed again.
+                parts.append(len(tasks))
+                tasks.append((logFile, None, None, None, None, sketchError,
+                              threads, None))
+                taskSizes.append((identity[1], True))
+        logParts.append((name, logFile, parts))
+
+    if progress:
+        progress = Progress(taskSizes)
+    else:
+        progress = None
+    results = []
+    if jobs > 1 and len(tasks) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        try:
+            for result in pool.imap(parse_logtask, tasks, 1):
+                if progress is not None:
+                    progress.complete(taskSizes[len(results)],
+                                      result[1]['lines'])
+                results.append(result)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        archives = deque(index for index, task in enumerate(tasks)
+                         if task[1] is None)
+        blocks = {}
+        for index, (task, taskSize) in enumerate(zip(tasks, taskSizes)):
+            # Keep the next archives decompressing, in order.
+            while archives and len(blocks) < threads:
+                archive = archives.popleft()
+                blocks[archive] = start_decompress(tasks[archive][0])
+            if progress is not None:
+                progress.begin(taskSize)
+            results.append(parse_logtask(task, progress,
+                                         blocks.pop(index, None)))
+            if progress is not None:
+                progress.complete(taskSize, results[-1][1]['lines'])
+    if progress is not None:
+        progress.report(True)
+    if profile is not None:
+        for fileDays, ruleCounts in results:
+            profile.rules.update(ruleCounts)
+
+    sampleRate = sample and sample[0]
+    fleetDays = dict((name, dict((targetDate,
+                                  DayStats(sketchError, sampleRate))
+                                 for targetDate in targetDates))
+                     for name, logFiles in servers)
+    for name, logFile, parts in logParts:
+        days = fleetDays[name]
+        for part in parts:
+            if isinstance(part, int):
+                fileDays = results[part][0]
+                if cacheFile and logFile.endswith('.bz2'):
+                    newCache[logFile] = {
+                        'identity': identities[logFile],
+                        'sketchError': sketchError,
+                        'friendlyNames': namesIdentity,
+                        'days': dict((datestr, day.to_dict())
+                                     for datestr, day in fileDays.items()),
+                    }
+            else:
+                fileDays = part
+            for targetDate in targetDates:
+                if targetDate in fileDays:
+                    days[targetDate].merge(fileDays[targetDate])
+    if cacheFile:
+        # Other runs (Ex: --follow, another --fleet) may share the cache
+        # file with a different set of logs, so their entries are kept as
+        # long as the archive is still on disk, unchanged. Entries for
+        # archives that no longer exist are dropped.
+        for logFile, entry in cache.items():
+            if logFile not in newCache and os.path.exists(logFile) and \
+                    get_fileidentity(logFile) == entry['identity']:
+                newCache[logFile] = entry
+        write_cache(cacheFile, newCache)
+    return fleetDays
+
+
+def parse_logtask(task, progress=None, blocks=None):
+    # Parse a whole log, or a (start, end) byte range of an uncompressed one.
+    # Runs in the worker processes when parsing in parallel. Returns the
+    # per-day results and the rule counts of the parsed lines. blocks is the
+    # queue of an archive already being decompressed by start_decompress().
+    (logFile, chunk, targetDates, since, until, sketchError, threads,
+     sample) = task
+    ruleCounts = Counter()
+    if chunk is None and logFile.endswith('.bz2') and (
+            blocks is not None or threads > 0):
+        if blocks is None:
+            blocks = start_decompress(logFile)
+        lines = read_blocks(blocks)
+    elif chunk is None:
+        lines = read_logs([logFile])
+    else:
+        lines = scan_logrange(logFile, chunk[0], chunk[1], ruleCounts)
+    if progress is not None:
+        lines = track_progress(lines, progress)
+    days = parse_days(lines, targetDates, since, until, sketchError,
+                      ruleCounts, sample)
+    return dict(days), ruleCounts
+
+
+def start_decompress(logFile):
+    # Decompress an archive in a background thread. Returns the queue its
+    # blocks are put in, for read_blocks(). The queue is bounded, so the
+    # thread waits when it gets too far ahead of the parser.
+    blocks = Queue.Queue(decompressQueueSize)
+    thread = threading.Thread(target=decompress_log, args=(logFile, blocks))
+    thread.daemon = True
+    thread.start()
+    return blocks
+
+
+def decompress_log(logFile, blocks):
+    # An empty block marks the end of the archive. Errors are handed to the
+    # parser to raise.
+    try:
+        with bz2.BZ2File(logFile, 'rb') as f:
+            while True:
+                block = f.read(decompressBlockSize)
+                blocks.put(block)
+                if not block:
+                    return
+    except Exception as e:
+        blocks.put(e)
+
+
+def read_blocks(blocks):
+    # Yield the lines of the blocks start_decompress() puts in the queue.
+    # Lines are yielded without their newline, which parse_days() ignores.
+    rest = ''
+    while True:
+        block = blocks.get()
+        if isinstance(block, Exception):
+            raise block
+        if not block:
+            break
+        lines = (rest + block).split('\n')
+        rest = lines.pop()
+        for line in lines:
+            yield line
+    if rest:
+        yield rest
+
+
+def track_progress(lines, progress):
+    # Pass the lines through, telling progress about them every so often.
+    # Looking at the clock for every line would slow parsing down.
+    read = count = 0
+    for line in lines:
+        read += len(line)
+        count += 1
+        if count == 10000:
+            progress.advance(read, count)
+            read = count = 0
+        yield line
+    progress.advance(read, count)
+
+
+def write_sketches(sketchDir, targetDate, day, sketchError):
+    # Store the unique IP and file sketches of a day, so unique counts over
+    # several days can later be answered without the logs.
+    ipSketch, urlSketch = day.get_sketches(sketchError)
+    sketchFile = os.path.join(sketchDir, '%s.json' % targetDate)
+    try:
+        if not os.path.isdir(sketchDir):
+            os.makedirs(sketchDir)
+        with open(sketchFile + '.tmp', 'wb') as f:
+            json.dump({'version': sketchVersion, 'ip': ipSketch.to_dict(),
+                       'url': urlSketch.to_dict()}, f)
+        os.rename(sketchFile + '.tmp', sketchFile)
+    except (IOError, OSError) as e:
+        print 'Failed to write sketch file %s: %s' % (sketchFile, e)
+
+
+def read_sketches(sketchDir, targetDate):
+    # Returns the (ipSketch, urlSketch) stored for a day, or None.
+    sketchFile = os.path.join(sketchDir, '%s.json' % targetDate)
+    try:
+        with open(sketchFile, 'rb') as f:
+            data = json.load(f)
+        if data.get('version') != sketchVersion:
+            return None
+        return (HyperLogLog.from_dict(data['ip']),
+                HyperLogLog.from_dict(data['url']))
+    except (IOError, ValueError, KeyError, AttributeError, TypeError):
+        return None
+
+
+def sketch_report(sketchDir, targetDates):
+    # Unique IPs and files over a range of days, merged from the stored
+    # sketches.
+    targetDates = sorted(set(targetDates))
+    ipSketch = urlSketch = None
+    found = []
+    for targetDate in targetDates:
+        sketches = read_sketches(sketchDir, targetDate)
+        if sketches is None:
+            continue
+        found.append(targetDate)
+        if ipSketch is None:
+            ipSketch, urlSketch = sketches
+        else:
+            ipSketch.merge(sketches[0])
+            urlSketch.merge(sketches[1])
+    if ipSketch is None:
+        print 'Cacher did not find any sketches for %s to %s in %s' % (
+            targetDates[0], targetDates[-1], sketchDir)
+        return None
+    finalOutput = []
+    finalOutput.append(
+        'Cacher has retrieved the following unique counts for %s to %s:' % (
+            targetDates[0], targetDates[-1]))
+    finalOutput.append('')
+    finalOutput.append('  %s Unique IP Addresses.' % ipSketch.count())
+    finalOutput.append('  %s unique files.' % urlSketch.count())
+    finalOutput.append('')
+    finalOutput.append('Counts are approximate (standard error: %.2f%%).' % (
+        ipSketch.error * 100))
+    missing = [x for x in targetDates if x not in found]
+    if missing:
+        finalOutput.append('')
+        finalOutput.append('WARNING: No sketches were found for %s of %s '
+                           'days: %s' % (len(missing), len(targetDates),
+                                         ', '.join(missing)))
+    return finalOutput
+
+
+def open_rollups(rollupFile):
+    # Open (or create) the rollup store. Raises ValueError if it was made by
+    # an incompatible version of Cacher.
+    import sqlite3
+    db = sqlite3.connect(rollupFile)
+    db.text_factory = str
+    storeVersion = db.execute('PRAGMA user_version').fetchone()[0]
+    if storeVersion == 0:
+        db.executescript(rollupSchema)
+        db.execute('PRAGMA user_version = %d' % rollupVersion)
+    elif storeVersion != rollupVersion:
+        db.close()
+        raise ValueError('Rollup store %s has version %s, expected %s' % (
+            rollupFile, storeVersion, rollupVersion))
+    return db
+
+
+def store_rollup(rollupFile, targetDate, day, sketchError):
+    # Save the aggregates of a day in the rollup store, replacing what was
+    # stored for it before: the day's totals and unique IP and file sketches,
+    # the bandwidth and GET requests per hour and the model (with its
+    # friendly name), OS and file type counts.
+    import sqlite3
+    ipSketch, urlSketch = day.get_sketches(sketchError)
+    uniqueFileTypes = day.unique_filetypes()
+    friendlyModels = get_friendlynames('models')
+    try:
+        # Commit (or roll back) and close the connection, even if storing
+        # fails. Failures are only reported, so --follow keeps running.
+        with closing(open_rollups(rollupFile)) as db, db:
+            for table in rollupTables:
+                db.execute('DELETE FROM %s WHERE date = ?' % table,
+                           (targetDate,))
+            db.execute('INSERT INTO days VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (
+                targetDate, day.requestCount, day.noClientIdentityCount,
+                day.restarts, day.unique_ips(), day.unique_files(),
+                json.dumps(ipSketch.to_dict()),
+                json.dumps(urlSketch.to_dict())))
+            db.executemany('INSERT INTO hours VALUES (?, ?, ?, ?, ?, ?)', [
+                (targetDate, int(start[:2])) + tuple(bandwidth) + (requests,)
+                for start, bandwidth, requests, peakRequests
+                in get_series(day, 60) if any(bandwidth) or requests])
+            db.executemany('INSERT INTO models VALUES (?, ?, ?, ?)', [
+                (targetDate, model, friendlyModels.get(model, model), count)
+                for model, count in day.modelCounts.items()])
+            db.executemany('INSERT INTO os VALUES (?, ?, ?, ?)', [
+                (targetDate, osFamily, osVersion, count)
+                for (osVersion, osFamily), count in day.osCounts.items()])
+            db.executemany('INSERT INTO filetypes VALUES (?, ?, ?, ?)', [
+                (targetDate, fileType, count, uniqueFileTypes[fileType])
+                for fileType, count in day.fileTypeCounts.items()])
+    except (sqlite3.Error, ValueError) as e:
+        print 'Failed to store rollup for %s in %s: %s' % (
+            targetDate, rollupFile, e)
+
+
+def get_reportrange(report, startDate, endDate, anchorDate=None):
+    # The (start, end) dates of a --report period and of the period before
+    # it. week is Monday to Sunday and month a calendar month. Without an
+    # anchorDate, the last full week or month is used.
+    today = date.today()
+    if report == 'range':
+        start = datetime.strptime(startDate, '%Y-%m-%d').date()
+        end = datetime.strptime(endDate, '%Y-%m-%d').date()
+        previousEnd = start - timedelta(1)
+        previousStart = previousEnd - (end - start)
+    elif report == 'week':
+        if anchorDate:
+            anchor = datetime.strptime(anchorDate, '%Y-%m-%d').date()
+        else:
+            anchor = today - timedelta(today.weekday() + 1)
+        start = anchor - timedelta(anchor.weekday())
+        end = start + timedelta(6)
+        previousStart = start - timedelta(7)
+        previousEnd = start - timedelta(1)
+    else:
+        if anchorDate:
+            anchor = datetime.strptime(anchorDate, '%Y-%m-%d').date()
+        else:
+            anchor = today.replace(day=1) - timedelta(1)
+        start = anchor.replace(day=1)
+        end = (start + timedelta(32)).replace(day=1) - timedelta(1)
+        previousEnd = start - timedelta(1)
+        previousStart = previousEnd.replace(day=1)
+    return [str(x) for x in (start, end, previousStart, previousEnd)]
+
+
+def get_rollup(db, startDate, endDate):
+    # Add up the stored days from startDate to endDate.
+    rollup = {}
+    (rollup['days'], rollup['requests'], rollup['noidentity'],
+     rollup['restarts']) = db.execute(
+        'SELECT COUNT(*), TOTAL(requests), TOTAL(noidentity), '
+        'TOTAL(restarts) FROM days WHERE date BETWEEN ? AND ?',
+        (startDate, endDate)).fetchone()
+    rollup['dates'] = [x[0] for x in db.execute(
+        'SELECT date FROM days WHERE date BETWEEN ? AND ?',
+        (startDate, endDate))]
+    rollup['bandwidth'] = db.execute(
+        'SELECT TOTAL(toclients), TOTAL(fromapple), TOTAL(frompeers) '
+        'FROM hours WHERE date BETWEEN ? AND ?',
+        (startDate, endDate)).fetchone()
+    # Unique counts can't be added up, so merge the sketches of the days.
+    ipSketch = urlSketch = None
+    try:
+        for ipData, urlData in db.execute(
+                'SELECT ipsketch, urlsketch FROM days WHERE date BETWEEN ? '
+                'AND ?', (startDate, endDate)):
+            sketches = (HyperLogLog.from_dict(json.loads(ipData)),
+                        HyperLogLog.from_dict(json.loads(urlData)))
+            if ipSketch is None:
+                ipSketch, urlSketch = sketches
+            else:
+                ipSketch.merge(sketches[0])
+                urlSketch.merge(sketches[1])
+    except ValueError:
+        # Stored with different --sketcherror values.
+        ipSketch = urlSketch = None
+    rollup['ipSketch'] = ipSketch
+    rollup['ips'] = rollup['files'] = 0
+    if ipSketch is not None:
+        rollup['ips'] = ipSketch.count()
+        rollup['files'] = urlSketch.count()
+    return rollup
+
+
+def rollup_report(rollupFile, report, startDate, endDate, previousStart,
+                  previousEnd, friendlyNames):
+    # Week, month or range report straight from the rollup store, compared
+    # with the period before it. No logs are read.
+    import sqlite3
+    try:
+        db = open_rollups(rollupFile)
+    except (sqlite3.Error, ValueError) as e:
+        print 'Cacher could not open the rollup store %s: %s' % (rollupFile,
+                                                                 e)
+        return None
+    current = get_rollup(db, startDate, endDate)
+    if not current['days']:
+        print 'Cacher did not find any rollups for %s to %s in %s' % (
+            startDate, endDate, rollupFile)
+        db.close()
+        return None
+    previous = get_rollup(db, previousStart, previousEnd)
+    days = len(get_daterange(startDate, endDate))
+    if report == 'range' and days > 1:
+        previousName = 'previous %s days' % days
+    elif report == 'range':
+        previousName = 'previous day'
+    else:
+        previousName = 'previous %s' % report
+    if not previous['days']:
+        # Nothing to compare with.
+        previousName = None
+
+    finalOutput = []
+    finalOutput.append(
+        'Cacher has retrieved the following stats for %s to %s:' % (
+            startDate, endDate))
+    finalOutput.append('')
+    currentbw = [format_bandwidth(x) for x in current['bandwidth']]
+    previousbw = [format_bandwidth(x) for x in previous['bandwidth']]
+    finalOutput.append('%s %s of bandwith served to client devices%s.' % (
+        currentbw[0] + (format_change(
+            current['bandwidth'][0], previous['bandwidth'][0],
+            '%s %s' % previousbw[0], previousName),)))
+    finalOutput.append(' %s %s of bandwith requested from Apple%s' % (
+        currentbw[1] + (format_change(
+            current['bandwidth'][1], previous['bandwidth'][1],
+            '%s %s' % previousbw[1], previousName),)))
+    finalOutput.append(
+        ' %s %s of bandwith requested from other Caching Servers%s' % (
+            currentbw[2] + (format_change(
+                current['bandwidth'][2], previous['bandwidth'][2],
+                '%s %s' % previousbw[2], previousName),)))
+    if current['restarts']:
+        finalOutput.append(' The Caching Server restarted %d time(s).' %
+                           current['restarts'])
+    finalOutput.append('')
+    finalOutput.append('%d IP Addresses hit the Caching Server%s' % (
+        current['requests'], format_change(
+            current['requests'], previous['requests'],
+            '%d' % previous['requests'], previousName)))
+    if current['ipSketch'] is not None:
+        finalOutput.append('  %s Unique IP Addresses%s.' % (
+            current['ips'], format_change(current['ips'], previous['ips'],
+                                          previous['ips'], previousName)))
+        finalOutput.append('  %s unique files%s.' % (
+            current['files'], format_change(
+                current['files'], previous['files'], previous['files'],
+                previousName)))
+    finalOutput.append('')
+
+    busiestDay = db.execute(
+        'SELECT date, TOTAL(toclients) AS bw FROM hours WHERE date BETWEEN ? '
+        'AND ? GROUP BY date ORDER BY bw DESC LIMIT 1',
+        (startDate, endDate)).fetchone()
+    busiestHour = db.execute(
+        'SELECT date, hour, toclients FROM hours WHERE date BETWEEN ? AND ? '
+        'ORDER BY toclients DESC LIMIT 1', (startDate, endDate)).fetchone()
+    if busiestDay and busiestDay[1]:
+        finalOutput.append('Busiest day: %s with %s %s served to client '
+                           'devices' % ((busiestDay[0],) +
+                                        format_bandwidth(busiestDay[1])))
+        finalOutput.append('Busiest hour: %s %02d:00 with %s %s served to '
+                           'client devices' % (
+                               (busiestHour[0], busiestHour[1]) +
+                               format_bandwidth(busiestHour[2])))
+        finalOutput.append('')
+
+    models = db.execute(
+        'SELECT %s, SUM(requests) FROM models WHERE date BETWEEN ? AND ? '
+        'AND model IS NOT NULL GROUP BY 1 ORDER BY 1' % (
+            'name' if friendlyNames else 'model'),
+        (startDate, endDate)).fetchall()
+    finalOutput.append(
+        'A total of %s iOS downloads were requested from the Caching Server'
+        ' consisting of:' % sum(x[1] for x in models))
+    for model, count in models:
+        finalOutput.append('  %s %s' % (count, model))
+    finalOutput.append('')
+
+    osCounts = db.execute(
+        'SELECT family, version, SUM(requests) FROM os WHERE date BETWEEN ? '
+        'AND ? GROUP BY family, version', (startDate, endDate)).fetchall()
+    finalOutput.append(
+        'A total of %s OS downloads were requested from the Caching Server'
+        ' consisting of:' % sum(x[2] for x in osCounts))
+    for family in ('iOS', 'macOS'):
+        versions = sorted([(osVersion, count) for osFamily, osVersion, count
+                           in osCounts if osFamily == family],
+                          key=lambda x: version_key(x[0]))
+        finalOutput.append(' %s %s downloads:' % (
+            sum(x[1] for x in versions), family))
+        for osVersion, count in versions:
+            finalOutput.append('  %s %s %s' % (count, family, osVersion))
+    finalOutput.append('')
+
+    fileTypes = db.execute(
+        'SELECT filetype, SUM(requests) FROM filetypes WHERE date BETWEEN ? '
+        'AND ? GROUP BY filetype ORDER BY filetype',
+        (startDate, endDate)).fetchall()
+    finalOutput.append('A total of %s files were downloaded from the Caching'
+                       ' Server consisting of:' % sum(x[1] for x in fileTypes))
+    for fileType, count in fileTypes:
+        finalOutput.append(' %s %s files' % (count, fileType))
+    finalOutput.append('')
+    db.close()
+
+    if current['ipSketch'] is not None:
+        finalOutput.append('Unique counts are approximate (standard error: '
+                           '%.2f%%).' % (current['ipSketch'].error * 100))
+    else:
+        finalOutput.append('Unique counts are not available: the days were '
+                           'stored with different --sketcherror values.')
+    missing = [x for x in get_daterange(startDate, endDate)
+               if x not in current['dates']]
+    if missing:
+        finalOutput.append('')
+        finalOutput.append('WARNING: No rollups were found for %s of %s days: '
+                           '%s' % (len(missing),
+                                   len(missing) + len(current['dates']),
+                                   ', '.join(missing)))
+    finalOutput.append('')
+    finalOutput.append('Cacher version: %s' % version)
+    return finalOutput
+
+
+def format_change(value, previousValue, previousText, previousName):
+    # Ex: ' (previous week: 120.00 Gigabytes, +23.7%)', or '' without a
+    # previous period.
+    if previousName is None:
+        return ''
+    if previousValue:
+        change = '%+.1f%%' % ((value - previousValue) * 100.0 / previousValue)
+    else:
+        change = 'n/a'
+    return ' (%s: %s, %s)' % (previousName, previousText, change)
+
+
+def get_fileidentity(logFile):
+    info = os.stat(logFile)
+    return [info.st_ino, info.st_size, info.st_mtime]
+
+
+def read_cache(cacheFile):
+    try:
+        with open(cacheFile, 'rb') as f:
+            data = json.load(f)
+        if data.get('version') != cacheVersion:
+            return {}
+        return dict((to_str(k), v) for k, v in data['files'].items())
+    except (IOError, ValueError, KeyError, AttributeError):
+        # A missing or broken cache only means everything gets parsed.
+        return {}
+
+
+def write_cache(cacheFile, cache):
+    # Write to a temporary file first so an interrupted run can't leave a
+    # truncated cache behind.
+    tmpFile = cacheFile + '.tmp'
+    try:
+        with open(tmpFile, 'wb') as f:
+            json.dump({'version': cacheVersion, 'files': cache}, f)
+        os.rename(tmpFile, cacheFile)
+    except (IOError, OSError) as e:
+        print 'Failed to write cache file %s: %s' % (cacheFile, e)
+
+
 def check_serverconfig():
+    import plistlib
     try:
         config = '/Library/Server/Caching/Config/Config.plist'
         plist = plistlib.readPlist(config)
@@ -614,6 +2974,7 @@ def check_serverconfig():
 
 
 def get_serverversion():
+    import plistlib
     try:
         serverversion = '/Applications/Server.app/Contents/version.plist'
         plist = plistlib.readPlist(serverversion)
@@ -636,18 +2997,25 @@ def get_uptime():
         return None
 
 
-def send_serveralert(targetDate, cacherdata):
+def send_serveralert(targetDate, cacherdata, timeout=60):
+    # Post the report as a Server.app alert. The subject and message are
+    # passed as arguments (no shell, so the report needs no quoting) and the
+    # command is killed if it hangs for timeout seconds.
+    cmd = [serverCommand, 'postAlert', 'CustomAlert', 'Common', 'subject',
+           'Caching Server Data: ' + targetDate, 'message', cacherdata]
+    # Run from a directory every user can read to avoid a shell error.
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            cwd='/private/tmp')
+    timer = threading.Timer(timeout, proc.kill)
+    timer.start()
     try:
-        # Change to a directory to remove shell error
-        os.chdir('/private/tmp')
-        # Mehhhhhhhhhhhhhh
-        cmd = ['/Applications/Server.app/Contents/ServerRoot/usr/sbin/server '
-               'postAlert CustomAlert Common subject ' + '"'
-               'Caching Server Data: ' + targetDate + '"' + ' message '
-               '"' + cacherdata + '"<<<""']
-        subprocess.check_call(cmd, shell=True)
-    except Exception:
-        return None
+        output, err = proc.communicate('')
+    finally:
+        timer.cancel()
+    if proc.returncode != 0:
+        print 'Failed to send server alert: %s' % (err.strip() or
+                                                   proc.returncode)
 
 
 def configureserver():
@@ -676,18 +3044,40 @@ def serveradmin(action, service):
         return None
 
 
-def post_to_slack(targetDate, cacherdata, slackchannel, slackusername,
-                  slackwebhook):
-    # Server App Icon DL
-    url = 'https://itunes.apple.com/lookup?id=883878097'
+def get_iconurl(client, iconCache=None):
+    # The Server App icon for Slack. The URL is looked up on the iTunes API
+    # and kept in the iconCache file for a week.
+    if iconCache:
+        try:
+            with open(iconCache, 'rb') as f:
+                cached = json.load(f)
+            if time.time() - cached['fetched'] < iconCacheAge:
+                return to_str(cached['iconurl'])
+        except (IOError, ValueError, KeyError, TypeError):
+            pass
     try:
-        request = urllib2.urlopen(url)
-        jsondata = json.loads(request.read())
-        iconurl = jsondata['results'][0]['artworkUrl100']
-    except (urllib2.URLError, ValueError, KeyError) as e:
+        # Not worth holding up the message for, so no retries.
+        status, data = client.request('GET', iconLookupURL, retries=0)
+        iconurl = to_str(json.loads(data)['results'][0]['artworkUrl100'])
+    except (IOError, ValueError, KeyError, IndexError, TypeError):
         # hardcode icon url in case it fails.
-        iconurl = 'http://is5.mzstatic.com/image/thumb/Purple122/v4/b9/e8/c4' \
-            '/b9e8c4b9-ce9c-174a-c1a8-d0ad0fc21da9/source/100x100bb.png'
+        return iconFallbackURL
+    if iconCache:
+        try:
+            with open(iconCache + '.tmp', 'wb') as f:
+                json.dump({'iconurl': iconurl, 'fetched': time.time()}, f)
+            os.rename(iconCache + '.tmp', iconCache)
+        except (IOError, OSError):
+            pass
+    return iconurl
+
+
+def post_to_slack(targetDate, cacherdata, slackchannel, slackusername,
+                  slackwebhook, client=None, iconCache=None):
+    import urllib
+    if client is None:
+        client = HTTPClient()
+    iconurl = get_iconurl(client, iconCache)
     # Slack payload
     payload = {
         "channel": slackchannel,
@@ -701,31 +3091,159 @@ def post_to_slack(targetDate, cacherdata, slackchannel, slackusername,
         ]
     }
     try:
-        cmd = ['/usr/bin/curl', '-X', 'POST', '--data-urlencode',
-               'payload=' + json.dumps(payload), slackwebhook]
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE)
-        output, err = proc.communicate()
-    except Exception:
-        print 'Failed to send message to Slack'
+        status, data = client.request(
+            'POST', slackwebhook, urllib.urlencode(
+                {'payload': json.dumps(payload)}),
+            {'Content-Type': 'application/x-www-form-urlencoded'})
+    except (IOError, ValueError) as e:
+        print 'Failed to send message to Slack: %s' % e
+        return
+    if status != 200:
+        print 'Failed to send message to Slack: HTTP %s %s' % (
+            status, data.strip())
+
+
+def finish_profile(profiler, printReport):
+    # Write the cProfile stats (--profilefile) and print the stage and rule
+    # profile (--profile) to stderr, so it never mixes with the report.
+    profiler.finish()
+    if printReport:
+        sys.stderr.write('\n'.join(profiler.report()) + '\n')
+
+
+def check_server():
+    # Check for macOS Server 5.2 or higher. Use version_key just in case.
+    if version_key(get_serverversion()) >= version_key('5.2'):
+        pass
+    else:
+        print "Server version is %s and not compatible" % get_serverversion()
+        sys.exit(1)
 
 
-def main():
-    # Check for macOS Server 5.2 or higher. Use LooseVersion just in case.
-    if LooseVersion(get_serverversion()) >= LooseVersion('5.2'):
+def check_logidentity():
+    # Check if LogClientIdentity is configured correctly. If it isn't - bail.
+    serverconfig = check_serverconfig()
+    if serverconfig is True:
         pass
+    elif type(serverconfig) is str or type(serverconfig) is int:
+        print "LogClientIdentity is incorrectly set to: %s - Type: %s" \
+            % (str(serverconfig), type(serverconfig).__name__)
+        print "Please run sudo Cacher --configureserver and delete your " \
+            "log files."
+        sys.exit(1)
+    elif not serverconfig:
+        print "LogClientIdentity is not set"
+        print "Please run sudo Cacher --configureserver and delete your " \
+            "log files."
+        sys.exit(1)
     else:
-        print "Server version is %s and not compatible" % get_serverversion()
+        print "LogClientIdentity is set to: %s" % str(serverconfig)
+        print "Please run sudo Cacher --configureserver and delete your " \
+            "log files."
         sys.exit(1)
 
+
+def main():
     # Options
     usage = '%prog [options]'
     o = optparse.OptionParser(usage=usage)
-    o.add_option('--targetdate',
-                 help=('Optional: Date to parse. Example: 2017-01-15.'))
+    o.add_option('--targetdate', action='append',
+                 help=('Optional: Date to parse. Example: 2017-01-15. Can be '
+                       'used multiple times.'))
+    o.add_option('--startdate',
+                 help=('Optional: First date of a range to parse. Example: '
+                       '2017-01-01. Requires End Date Option.'))
+    o.add_option('--enddate',
+                 help=('Optional: Last date of a range to parse. Example: '
+                       '2017-01-31. Requires Start Date Option.'))
     o.add_option('--logpath',
                  help=('Optional: Caching Log Path. Defaults to: '
                        '/Library/Server/Caching/Logs'))
+    o.add_option('--fleet', action='append', metavar='NAME=PATH',
+                 help=('Optional: Logs of a Caching Server copied to PATH, '
+                       'reported as NAME. Ex: lab=/Volumes/Logs/lab. Can be '
+                       'used multiple times. Every server is reported on its '
+                       'own and all of them together.'))
+    o.add_option('--since',
+                 help=('Optional: Only parse logs from this time of day on. '
+                       'Example: 08:00.'))
+    o.add_option('--until',
+                 help=('Optional: Only parse logs before this time of day. '
+                       'Example: 17:30.'))
+    o.add_option('--jobs', type='int', default=1,
+                 help=('Optional: Number of processes used to parse the logs. '
+                       'Defaults to: 1'))
+    o.add_option('--cachefile',
+                 help=('Optional: File used to cache the parsed results of '
+                       'rotated logs between runs.'))
+    o.add_option('--sample', type='float',
+                 help=('Optional: Only count this share of the GET requests '
+                       'for a quick preview. Counts are estimated, with '
+                       'confidence intervals. Ex: 0.05'))
+    o.add_option('--samplemethod', type='choice', choices=['hash', 'stride'],
+                 default='hash',
+                 help=('Optional: Sample the GET requests by a hash of their '
+                       'log line (the same ones every run) or evenly spaced '
+                       'in every log file. Logs sampled by stride are not '
+                       'split up between --jobs, only whole files are. '
+                       'Requires Sample Option. Defaults to: hash'))
+    o.add_option('--approximate', action='store_true',
+                 help=('Optional: Estimate unique IPs and files with '
+                       'HyperLogLog sketches to bound memory use.'))
+    o.add_option('--sketcherror', type='float', default=0.01,
+                 help=('Optional: Standard error of the sketches. Defaults '
+                       'to: 0.01'))
+    o.add_option('--sketchdir',
+                 help=('Optional: Directory to store per-day unique IP and '
+                       'file sketches in.'))
+    o.add_option('--sketchreport', action='store_true',
+                 help=('Optional: Report unique IPs and files over the '
+                       'requested dates from the stored sketches, without '
+                       'reading any logs. Requires Sketch Dir Option.'))
+    o.add_option('--rollupdb',
+                 help=('Optional: SQLite file to store the hourly aggregates '
+                       'of every reported day in.'))
+    o.add_option('--report', type='choice', choices=['week', 'month', 'range'],
+                 help=('Optional: Report a week, month or range of days from '
+                       'the rollup store, without reading any logs, compared '
+                       'with the period before. week and month use the one '
+                       'holding --targetdate (or the last full one), range '
+                       'uses --startdate and --enddate. Requires Rollup DB '
+                       'Option.'))
+    o.add_option('--timeseries', action='store_true',
+                 help=('Optional: Add the bandwidth and GET requests of every '
+                       'hour (or --seriesinterval) and the peak hour to the '
+                       'report.'))
+    o.add_option('--seriesinterval', type='int', default=60,
+                 help=('Optional: Minutes per interval of the time series. '
+                       'Requires Time Series Option. Defaults to: 60'))
+    o.add_option('--top', type='int',
+                 help=('Optional: Add the N busiest clients and /24 subnets '
+                       '(by GET requests) to the report. Ex: 10'))
+    o.add_option('--topfiles', type='int',
+                 help=('Optional: Add the N most requested files and the '
+                       'number of files requested once, 2-10 times, 11-100 '
+                       'times, etc. by file type to the report. Ex: 10'))
+    o.add_option('--profile', action='store_true',
+                 help=('Optional: Print the time and memory used by every '
+                       'stage and the lines matched by every rule to '
+                       'standard error.'))
+    o.add_option('--profilefile',
+                 help=('Optional: Write cProfile stats of the run to this '
+                       'file.'))
+    o.add_option('--progress', action='store_true',
+                 help=('Optional: Show the parsing throughput and an ETA on '
+                       'standard error.'))
+    o.add_option('--follow', action='store_true',
+                 help=('Optional: Keep running, follow the live log and '
+                       'report every day as soon as it ends.'))
+    o.add_option('--interval', type='float', default=10,
+                 help=('Optional: Seconds between checks of the live log. '
+                       'Requires Follow Option. Defaults to: 10'))
+    o.add_option('--httpport', type='int',
+                 help=('Optional: Serve the stats of the current day on this '
+                       'port of 127.0.0.1, in Prometheus (/metrics) and JSON '
+                       '(/stats.json) format. Requires Follow Option.'))
     o.add_option('--deviceids',
                  help='Optional: Use Device IDs (Ex: iPhone7,2). Defaults'
                  ' to: False',
@@ -749,8 +3267,15 @@ def main():
     o.add_option("--slackchannel", default=None,
                  help=("Optional: Slack channel. Can be username or channel "
                        "Ex. #channel or @username. Requires Slack Option."))
+    o.add_option("--iconcache", default=iconCacheFile,
+                 help=("Optional: File to cache the Slack icon URL in. "
+                       "Defaults to: %s" % iconCacheFile))
+    o.add_option("--alerttimeout", type="float", default=60,
+                 help=("Optional: Seconds to wait for the Server and Slack "
+                       "alerts to be sent before giving up. Defaults to: 60"))
 
     opts, args = o.parse_args()
+    profiler = Profiler(opts.profilefile)
 
     # Configure Server
     if opts.configureserver:
@@ -758,6 +3283,7 @@ def main():
     else:
         configureServer = False
     if configureServer:
+        check_server()
         if os.getuid() != 0:
             print 'Did not configure Caching Server - requires root'
             sys.exit(1)
@@ -768,36 +3294,56 @@ def main():
             print '\n' + serveradmin('start', 'caching')
             sys.exit(1)
 
-    # Check if LogClientIdentity is configured correctly. If it isn't - bail.
-    serverconfig = check_serverconfig()
-    if serverconfig is True:
-        pass
-    elif type(serverconfig) is str or type(serverconfig) is int:
-        print "LogClientIdentity is incorrectly set to: %s - Type: %s" \
-            % (str(serverconfig), type(serverconfig).__name__)
-        print "Please run sudo Cacher --configureserver and delete your " \
-            "log files."
-        sys.exit(1)
-    elif not serverconfig:
-        print "LogClientIdentity is not set"
-        print "Please run sudo Cacher --configureserver and delete your " \
-            "log files."
-        sys.exit(1)
-    else:
-        print "LogClientIdentity is set to: %s" % str(serverconfig)
-        print "Please run sudo Cacher --configureserver and delete your " \
-            "log files."
-        sys.exit(1)
-
     # Grab other options
-    if opts.targetdate:
-        targetDate = opts.targetdate
+    if opts.startdate or opts.enddate:
+        if not (opts.startdate and opts.enddate):
+            print 'Both --startdate and --enddate are required for a range'
+            sys.exit(1)
+        try:
+            targetDates = get_daterange(opts.startdate, opts.enddate)
+        except ValueError:
+            print 'Dates must be in the format YYYY-MM-DD'
+            sys.exit(1)
+        if not targetDates:
+            print '--startdate must not be after --enddate'
+            sys.exit(1)
+    elif opts.targetdate:
+        targetDates = opts.targetdate
+        for targetDate in targetDates:
+            if not logDate.match(targetDate):
+                print 'Dates must be in the format YYYY-MM-DD'
+                sys.exit(1)
     else:
-        targetDate = str(date.today() - timedelta(1))
+        targetDates = [str(date.today() - timedelta(1))]
+    if opts.follow and (opts.startdate or opts.targetdate or
+                        opts.sketchreport or opts.report):
+        print '--follow reports every day as it ends and can not be used ' \
+            'with --targetdate, --startdate, --sketchreport or --report'
+        sys.exit(1)
+    if opts.httpport and not opts.follow:
+        print '--httpport requires --follow'
+        sys.exit(1)
+    for timeOfDay in (opts.since, opts.until):
+        if timeOfDay and not logTime.match(timeOfDay):
+            print 'Times must be in the format HH:MM or HH:MM:SS'
+            sys.exit(1)
     if opts.logpath:
         logPath = opts.logpath
     else:
         logPath = '/Library/Server/Caching/Logs'
+    servers = [(None, logPath)]
+    if opts.fleet:
+        if opts.logpath or opts.follow:
+            print '--fleet can not be used with --logpath or --follow'
+            sys.exit(1)
+        servers = [tuple(x.split('=', 1)) for x in opts.fleet]
+        names = [x[0] for x in servers]
+        if not all(len(x) == 2 and x[0] and x[1] for x in servers):
+            print '--fleet must be in the format NAME=PATH'
+            sys.exit(1)
+        if len(set(names)) != len(names):
+            print '--fleet names must be unique'
+            sys.exit(1)
     if opts.deviceids:
         friendlyNames = False
     else:
@@ -821,58 +3367,208 @@ def main():
     else:
         slackusername = 'Cacher'
     slackchannel = opts.slackchannel
-
-    # Check if log files exist and if not, bail. Try to delete .DS_Store files
-    # just in case they exist from the GUI. Chances are we can delete this
-    # because we are either running as root or the same user that created it.
-    try:
-        os.remove(os.path.join(logPath, '.DS_Store'))
-    except OSError:
-        pass
-    if not os.listdir(logPath):
-        print 'Cacher did not detect log files in %s' % logPath
+    if not 0 < opts.sketcherror < 1:
+        print '--sketcherror must be between 0 and 1'
         sys.exit(1)
+    sketchError = opts.sketcherror if opts.approximate else None
+    sample = None
+    if opts.sample is not None:
+        if not 0 < opts.sample <= 1:
+            print '--sample must be between 0 and 1'
+            sys.exit(1)
+        if opts.follow:
+            print '--sample can not be used with --follow'
+            sys.exit(1)
+        # A sample of everything is the whole thing.
+        if opts.sample < 1:
+            sample = (opts.sample, opts.samplemethod)
+    if not 0 < opts.seriesinterval <= 1440:
+        print '--seriesinterval must be between 1 and 1440 minutes'
+        sys.exit(1)
+    seriesInterval = opts.seriesinterval if opts.timeseries else None
+    for name, value in (('--top', opts.top), ('--topfiles', opts.topfiles)):
+        if value is not None and not 1 <= value <= topCapacity:
+            print '%s must be between 1 and %s' % (name, topCapacity)
+            sys.exit(1)
 
-    # Make temporary directory
-    tmpDir = tempfile.mkdtemp()
-
-    # Clone the contents of serverlogs over into the 'cachinglogs' subdirectory
-    tmpLogs = os.path.join(tmpDir, 'cachinglogs')
-    shutil.copytree(logPath, tmpLogs)
-
-    # Expand any .bz files in the directory (Server 4.1+)
-    os.chdir(tmpLogs)
-    for bzLog in glob.glob(os.path.join(tmpLogs, '*.bz2')):
-        result = subprocess.check_call(["bunzip2", bzLog])
-
-    # Now combine all .log files in the destination into a temp file that's
-    # removed when python exits
-    rawLog = tempfile.TemporaryFile()
-    for anyLog in glob.glob(os.path.join(tmpLogs, '*.log')):
-        with open(anyLog, 'rb') as f:
-            shutil.copyfileobj(f, rawLog)
-
-    # Skip back to the beginning of our newly concatenated log
-    rawLog.seek(0)
-
-    # Purge temporary directory since it's now in memory.
-    shutil.rmtree(tmpDir)
-
-    # Run the function that does most of the work.
-    cacherdata = cacher(rawLog.readlines(), targetDate, friendlyNames)
-    # Output conditionals
-    if stdOut:
-        print("\n".join(cacherdata))
-    if slackAlert:
-        print ''
+    # Alerts are sent in the background while the next day is parsed, one
+    # thread per destination.
+    notifier = Notifier()
     if serverAlert:
         if os.getuid() != 0:
             print 'Did not send serverAlert - requires root'
         else:
-            send_serveralert(targetDate, "\n".join(cacherdata))
+            notifier.add_sink('server alert', lambda subject, text:
+                              send_serveralert(subject, text,
+                                               opts.alerttimeout))
     if slackalert is True:
-        post_to_slack(targetDate, "\n".join(cacherdata), slackchannel,
-                      slackusername, slackwebhook)
+        client = HTTPClient()
+        notifier.add_sink('slack', lambda subject, text:
+                          post_to_slack(subject, text, slackchannel,
+                                        slackusername, slackwebhook, client,
+                                        opts.iconcache))
+
+    # Unique counts over a range of days come straight from the stored
+    # sketches.
+    if opts.sketchreport:
+        if not opts.sketchdir:
+            print '--sketchreport requires --sketchdir'
+            sys.exit(1)
+        with profiler.stage('sketch report'):
+            cacherdata = sketch_report(opts.sketchdir, targetDates)
+        if cacherdata is None:
+            sys.exit(1)
+        dateRange = '%s to %s' % (min(targetDates), max(targetDates))
+        if stdOut:
+            print("\n".join(cacherdata))
+        notifier.notify(dateRange, "\n".join(cacherdata))
+        with profiler.stage('alerts'):
+            notifier.close(opts.alerttimeout)
+        finish_profile(profiler, opts.profile)
+        sys.exit(0)
+
+    # Weekly, monthly and range reports come straight from the rollup store.
+    if opts.report:
+        if not opts.rollupdb:
+            print '--report requires --rollupdb'
+            sys.exit(1)
+        if opts.report == 'range' and not opts.startdate:
+            print '--report range requires --startdate and --enddate'
+            sys.exit(1)
+        if opts.report != 'range' and opts.startdate:
+            print '--report %s uses --targetdate, not --startdate and ' \
+                '--enddate' % opts.report
+            sys.exit(1)
+        startDate, endDate, previousStart, previousEnd = get_reportrange(
+            opts.report, opts.startdate, opts.enddate,
+            opts.targetdate[-1] if opts.targetdate else None)
+        with profiler.stage('rollup report'):
+            cacherdata = rollup_report(opts.rollupdb, opts.report, startDate,
+                                       endDate, previousStart, previousEnd,
+                                       friendlyNames)
+        if cacherdata is None:
+            sys.exit(1)
+        dateRange = '%s to %s' % (startDate, endDate)
+        if stdOut:
+            print("\n".join(cacherdata))
+        notifier.notify(dateRange, "\n".join(cacherdata))
+        with profiler.stage('alerts'):
+            notifier.close(opts.alerttimeout)
+        finish_profile(profiler, opts.profile)
+        sys.exit(0)
+
+    # The Caching Server's own logs are only worth parsing if it logs the
+    # client identity. Logs copied elsewhere (--logpath) are parsed as they
+    # are, without Server.app.
+    if not (opts.logpath or opts.fleet):
+        check_server()
+        check_logidentity()
+
+    # Check if log files exist and if not, bail. Try to delete .DS_Store files
+    # just in case they exist from the GUI. Chances are we can delete this
+    # because we are either running as root or the same user that created it.
+    for name, serverPath in servers:
+        try:
+            os.remove(os.path.join(serverPath, '.DS_Store'))
+        except OSError:
+            pass
+        if not os.path.isdir(serverPath) or not os.listdir(serverPath):
+            print 'Cacher did not detect log files in %s' % serverPath
+            sys.exit(1)
+
+    # Run the function that does most of the work. The logs are read in place
+    # and streamed line by line, so nothing is copied or held in memory. Every
+    # requested date is collected in the same pass.
+    if opts.follow:
+        # Today's stats are kept up to date from the live log and every day
+        # is reported from memory when it ends.
+        follower = LogFollower(logPath, sketchError, opts.since, opts.until)
+        statsServer = None
+        if opts.httpport:
+            try:
+                statsServer = StatsServer(opts.httpport)
+            except socket.error as e:
+                print 'Cacher could not listen on port %s: %s' % (
+                    opts.httpport, e)
+                sys.exit(1)
+            statsServer.start()
+        with profiler.stage('parse'):
+            if not follower.warm_up(opts.cachefile, max(opts.jobs, 1)):
+                print 'Cacher did not detect a live log in %s' % logPath
+                sys.exit(1)
+        finishedDays = follower.follow(opts.interval, statsServer)
+        # The uptime changes from day to day.
+        uptime = None
+    else:
+        # The logs of every server of a fleet are parsed together and
+        # their days combined into fleet totals.
+        with profiler.stage('find logs'):
+            logFiles = [(name, get_logfiles(serverPath))
+                        for name, serverPath in servers]
+        with profiler.stage('parse'):
+            fleetDays = parse_fleet(logFiles, targetDates, opts.cachefile,
+                                    opts.since, opts.until,
+                                    max(opts.jobs, 1), sketchError, profiler,
+                                    opts.progress, sample=sample)
+        if opts.fleet:
+            finishedDays = [(targetDate, combine(
+                fleetDays[name][targetDate] for name, serverPath in servers))
+                for targetDate in sorted(set(targetDates))]
+        else:
+            finishedDays = [(targetDate, fleetDays[None][targetDate])
+                            for targetDate in sorted(set(targetDates))]
+        with profiler.stage('uptime'):
+            uptime = get_uptime()
+    reported = 0
+    for targetDate, day in finishedDays:
+        serverName = None
+        serverDays = None
+        if opts.fleet:
+            # The report of every server, then the fleet total. Only the
+            # fleet total is sent as an alert and stored.
+            serverName = 'all %s servers' % len(servers)
+            serverDays = [(name, fleetDays[name][targetDate])
+                          for name, serverPath in servers]
+            for name, serverDay in serverDays:
+                with profiler.stage('report'):
+                    cacherdata = cacher_report(
+                        serverDay, targetDate, friendlyNames, uptime,
+                        seriesInterval, opts.top, opts.topfiles, name)
+                if cacherdata is not None and stdOut:
+                    if reported:
+                        print ''
+                    print("\n".join(cacherdata))
+                    reported += 1
+        with profiler.stage('report'):
+            cacherdata = cacher_report(day, targetDate, friendlyNames, uptime,
+                                       seriesInterval, opts.top,
+                                       opts.topfiles, serverName, serverDays)
+        if cacherdata is None:
+            continue
+        reported += 1
+        # Partial (--since/--until) or sampled days would overwrite the
+        # sketches of the whole day.
+        if opts.sketchdir and not (opts.since or opts.until or sample):
+            with profiler.stage('sketches'):
+                write_sketches(opts.sketchdir, targetDate, day,
+                               opts.sketcherror)
+        if opts.rollupdb and not (opts.since or opts.until or sample):
+            with profiler.stage('rollups'):
+                store_rollup(opts.rollupdb, targetDate, day, opts.sketcherror)
+        # Output conditionals
+        if stdOut:
+            if reported > 1:
+                print ''
+            print("\n".join(cacherdata))
+            sys.stdout.flush()
+        if slackAlert:
+            print ''
+        notifier.notify(targetDate, "\n".join(cacherdata))
+    with profiler.stage('alerts'):
+        notifier.close(opts.alerttimeout)
+    finish_profile(profiler, opts.profile)
+    if not reported and not opts.follow:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,143 @@
+#!/usr/bin/python
+
+"""HTTPClient and Notifier against a local HTTP server."""
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+import StringIO
+import os
+import socket
+import sys
+import threading
+import time
+import unittest
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(testDir, '..'))
+import cacher  # noqa: E402
+
+
+class SinkServer(ThreadingMixIn, HTTPServer):
+    # Records every request as (client port, path, body). /fail/N answers
+    # the first N requests with HTTP 500.
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), SinkHandler)
+        self.requests = []
+        self.lock = threading.Lock()
+
+
+class SinkHandler(BaseHTTPRequestHandler):
+    # Keeps the connection open between requests.
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with self.server.lock:
+            self.server.requests.append((self.client_address[1], self.path,
+                                         body))
+            tries = len([x for x in self.server.requests
+                         if x[1] == self.path])
+        status = 200
+        if self.path.startswith('/fail/') and \
+                tries <= int(self.path.split('/')[2]):
+            status = 500
+        self.send_response(status)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write('ok')
+
+    def log_message(self, format, *args):
+        pass
+
+
+def get_closedport():
+    # A port nothing listens on.
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class AlertTest(unittest.TestCase):
+    def setUp(self):
+        self.server = SinkServer()
+        self.url = 'http://127.0.0.1:%s' % self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.client = cacher.HTTPClient(timeout=5, retries=2, backoff=0.01)
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        # Let the server threads waiting on the idle connections finish.
+        for connections in self.client.connections.values():
+            for connection in connections:
+                connection.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reuse(self):
+        for i in range(3):
+            self.assertEqual(self.client.request(
+                'POST', self.url + '/ok', 'report %s' % i), (200, 'ok'))
+        ports = set(x[0] for x in self.server.requests)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(len(ports), 1)
+
+    def test_retry(self):
+        self.assertEqual(self.client.request(
+            'POST', self.url + '/fail/1', 'report'), (200, 'ok'))
+        self.assertEqual([x[2] for x in self.server.requests],
+                         ['report', 'report'])
+
+    def test_retries_exhausted(self):
+        with self.assertRaises(IOError) as context:
+            self.client.request('POST', self.url + '/fail/5', 'report')
+        self.assertIn('HTTP 500', str(context.exception))
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_unreachable(self):
+        url = 'http://127.0.0.1:%s/ok' % get_closedport()
+        start = time.time()
+        with self.assertRaises(IOError) as context:
+            self.client.request('POST', url, 'report')
+        self.assertIn('failed 3 times', str(context.exception))
+        self.assertTrue(time.time() - start < 5)
+
+    def test_notifier(self):
+        # The unreachable sink gives up on its own, the other one gets every
+        # report in order.
+        unreachable = 'http://127.0.0.1:%s/ok' % get_closedport()
+        notifier = cacher.Notifier()
+        notifier.add_sink('server alert', lambda subject, text:
+                          self.client.request('POST', self.url + '/ok', text))
+        notifier.add_sink('Slack', lambda subject, text:
+                          self.client.request('POST', unreachable, text))
+        for i in range(3):
+            notifier.notify('2017-01-15', 'report %s' % i)
+        notifier.close(10)
+        self.assertEqual([x[2] for x in self.server.requests],
+                         ['report 0', 'report 1', 'report 2'])
+        self.assertEqual(sys.stdout.getvalue().count(
+            'Failed to send Slack for 2017-01-15'), 3)
+
+    def test_notifier_timeout(self):
+        # close() does not wait for a stuck sink longer than asked.
+        release = threading.Event()
+        notifier = cacher.Notifier()
+        notifier.add_sink('Slack', lambda subject, text: release.wait(10))
+        notifier.notify('2017-01-15', 'report')
+        start = time.time()
+        notifier.close(0.2)
+        release.set()
+        self.assertTrue(time.time() - start < 5)
+        self.assertIn('Gave up waiting for Slack', sys.stdout.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
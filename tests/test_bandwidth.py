@@ -0,0 +1,74 @@
+#!/usr/bin/python
+
+"""The bandwidth of a day is added up across Caching Server restarts."""
+
+import os
+import sys
+import unittest
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(testDir, '..'))
+import cacher  # noqa: E402
+
+targetDate = '2017-01-15'
+bandwidthLine = ('2017-01-15 %s:00.000 Since server start: %s MB returned to '
+                 'clients, %s MB stored from Internet, %s MB from peers; 0 '
+                 'bytes imported.\n')
+# (time, MB to clients, from Apple, from peers). The server restarts at
+# 10:15 and its counters start from zero again.
+samples = [('08:00', 1000, 100, 0), ('09:30', 1500, 150, 10),
+           ('10:15', 200, 20, 0), ('11:05', 500, 20, 5)]
+# Between the samples: 500/50/10 MB at 09:30, 200/20/0 MB since the restart
+# at 10:15 and 300/0/5 MB at 11:05.
+bandwidth = [1000, 70, 15]
+
+
+def megabytes(amounts):
+    return [x * cacher.byteUnits['MB'] for x in amounts]
+
+
+class BandwidthTest(unittest.TestCase):
+    def parse(self, samples):
+        return cacher.parse_days([bandwidthLine % x for x in samples],
+                                 [targetDate])[targetDate]
+
+    def test_restart(self):
+        day = self.parse(samples)
+        self.assertEqual(day.restarts, 1)
+        self.assertEqual(day.bandwidth, megabytes(bandwidth))
+        self.assertEqual(day.firstSample, ['08:00'] + megabytes([1000, 100,
+                                                                 0]))
+        self.assertEqual(day.lastSample, ['11:05'] + megabytes([500, 20, 5]))
+
+    def test_series(self):
+        series = cacher.get_series(self.parse(samples), 60)
+        self.assertEqual(len(series), 24)
+        self.assertEqual([(x[0], x[1]) for x in series if any(x[1])], [
+            ('09:00', megabytes([500, 50, 10])),
+            ('10:00', megabytes([200, 20, 0])),
+            ('11:00', megabytes([300, 0, 5]))])
+        series = cacher.get_series(self.parse(samples), 1440)
+        self.assertEqual(series, [('00:00', megabytes(bandwidth), 0, 0)])
+
+    def test_merge(self):
+        # Split at and around the restart, the chunks add up to the same.
+        for split in range(1, len(samples)):
+            day = self.parse(samples[:split])
+            day.merge(self.parse(samples[split:]))
+            self.assertEqual(day.restarts, 1)
+            self.assertEqual(day.bandwidth, megabytes(bandwidth))
+            self.assertEqual(day.bandwidthMinutes,
+                             self.parse(samples).bandwidthMinutes)
+
+    def test_combine(self):
+        # Another server's samples are not a restart of this one.
+        day = self.parse(samples[:2])
+        day.combine(self.parse(samples[2:]))
+        self.assertEqual(day.restarts, 0)
+        self.assertEqual(day.bandwidth, megabytes([500 + 300, 50, 10 + 5]))
+        self.assertEqual(day.firstSample[0], '08:00')
+        self.assertEqual(day.lastSample[0], '11:05')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+
+"""The aggregate cache keeps the archives of every run that shares it."""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(testDir, '..'))
+sys.path.insert(0, os.path.join(testDir, '..', 'benchmarks'))
+import cacher  # noqa: E402
+import loggen  # noqa: E402
+from test_parallel import get_stats  # noqa: E402
+
+targetDates = ['2017-01-15', '2017-01-16', '2017-01-17']
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.logPath = os.path.join(self.tmpDir, 'logs')
+        generator = loggen.LogGenerator(targetDates[0], len(targetDates),
+                                        2000, clients=500, assets=2000)
+        self.logFiles = loggen.write_logs(self.logPath, generator, 4)
+        self.archives = [x for x in self.logFiles if x.endswith('.bz2')]
+        self.cacheFile = os.path.join(self.tmpDir, 'cache.json')
+        self.parsed = []
+        self.parse_logtask = cacher.parse_logtask
+
+        def parse_logtask(task, *args):
+            self.parsed.append(task[0])
+            return self.parse_logtask(task, *args)
+        cacher.parse_logtask = parse_logtask
+
+    def tearDown(self):
+        cacher.parse_logtask = self.parse_logtask
+        shutil.rmtree(self.tmpDir)
+
+    def parse(self, logFiles=None):
+        del self.parsed[:]
+        return get_stats(cacher.parse_files(logFiles or self.logFiles,
+                                            targetDates, self.cacheFile))
+
+    def test_batch(self):
+        expected = get_stats(cacher.parse_files(self.logFiles, targetDates))
+        self.assertEqual(self.parse(), expected)
+        self.assertEqual(sorted(cacher.read_cache(self.cacheFile)),
+                         sorted(self.archives))
+        self.assertEqual(self.parse(), expected)
+        self.assertFalse(set(self.parsed) & set(self.archives))
+
+    def test_subset(self):
+        # A run over some of the archives keeps the entries of the others.
+        self.parse()
+        self.parse(self.archives[:1])
+        self.assertEqual(sorted(cacher.read_cache(self.cacheFile)),
+                         sorted(self.archives))
+
+    def test_follow_then_batch(self):
+        expected = self.parse()
+        # The Caching Server wrote to the last archive today.
+        now = time.time()
+        os.utime(self.archives[-1], (now, now))
+        del self.parsed[:]
+        follower = cacher.LogFollower(self.logPath)
+        self.assertTrue(follower.warm_up(self.cacheFile))
+        follower.file.close()
+        self.assertEqual(self.parsed, [self.archives[-1]])
+        cache = cacher.read_cache(self.cacheFile)
+        self.assertEqual(sorted(cache), sorted(self.archives))
+        self.assertEqual(cache[self.archives[-1]]['identity'],
+                         cacher.get_fileidentity(self.archives[-1]))
+        # Nothing is parsed again by the next batch run.
+        self.assertEqual(self.parse(), expected)
+        self.assertFalse(set(self.parsed) & set(self.archives))
+
+    def test_removed_archive(self):
+        self.parse()
+        os.remove(self.archives[0])
+        self.parse(self.logFiles[1:])
+        self.assertEqual(sorted(cacher.read_cache(self.cacheFile)),
+                         sorted(self.archives[1:]))
+
+
+if __name__ == '__main__':
+    unittest.main()
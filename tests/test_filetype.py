@@ -0,0 +1,44 @@
+#!/usr/bin/python
+
+"""get_filetype() recognizes the file types of requested URLs."""
+
+import os
+import sys
+import unittest
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(testDir, '..'))
+import cacher  # noqa: E402
+
+fileTypes = [
+    ('/a-09f98d6971/pre-thinned756.thinned.signed.dpkg.ipa', '.ipa'),
+    ('/031-8/com_apple_MobileAsset_CoreSuggestion/6c93.zip', '.zip'),
+    ('/content/downloads/10/43/OSXUpd10.12.3.pkg?source=x.apple.com',
+     '.pkg'),
+    ('/iOS10.2/031-9/iPhone_4.7_10.2_14C92_Restore.ipsw', '.ipsw'),
+    ('/itunes-assets/Publication1/v4/a4/book.epub', '.epub'),
+    ('/031-9/macOSUpd10.12.3.dmg', '.dmg'),
+    ('[icloud:hvRq3yMBV7JO9hUBRo2p]', 'personal icloud'),
+    ('/assets/com_apple_MobileAsset_SoftwareUpdate/'
+     'com_apple_MobileAsset_SoftwareUpdate.xml', 'asset catalog'),
+    ('/assets/com_apple_MobileAsset_Font3/'
+     'com_apple_MobileAsset_Font3.xml?cachebust=1', 'asset catalog'),
+    ('/content/catalogs/others/index-10.12-10.11-10.10-10.9-mountainlion-'
+     'lion-snowleopard-leopard.merged-1.sucatalog', 'asset catalog'),
+    # Other .xml files are not asset catalogs.
+    ('/us/podcasts/feed.xml', None),
+    ('/Info.plist.xml', None),
+    ('/feed.xml?from=/com_apple_MobileAsset_Font3/', None),
+    ('/031-8/6c93.bin', None),
+    ('/noextension', None),
+]
+
+
+class FileTypeTest(unittest.TestCase):
+    def test_filetypes(self):
+        for URL, fileType in fileTypes:
+            self.assertEqual(cacher.get_filetype(URL), fileType, URL)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/python
+
+"""IPv4Set holds the same addresses as a set, arrays and bitmaps alike."""
+
+import json
+import os
+import random
+import sys
+import unittest
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(testDir, '..'))
+import cacher  # noqa: E402
+
+
+def make_sets(rand, networks, count):
+    # The same random addresses in an IPv4Set and a set. Some networks get
+    # enough of them to be stored as bitmaps.
+    addresses = cacher.IPv4Set()
+    expected = set()
+    for i in range(count):
+        packed = rand.choice(networks) << 16 | rand.getrandbits(
+            rand.choice([8, 16]))
+        addresses.add(packed)
+        expected.add(packed)
+    return addresses, expected
+
+
+class IPv4SetTest(unittest.TestCase):
+    def setUp(self):
+        self.rand = random.Random(1)
+        self.networks = [self.rand.getrandbits(16) for i in range(3)]
+
+    def test_add(self):
+        for count in (0, 1, 100, 4000, 9000):
+            addresses, expected = make_sets(self.rand, self.networks, count)
+            self.assertEqual(len(addresses), len(expected))
+            self.assertEqual(list(addresses), sorted(expected))
+
+    def test_bitmap(self):
+        addresses, expected = make_sets(self.rand, self.networks[:1], 20000)
+        hosts = addresses.networks[self.networks[0]]
+        self.assertTrue(isinstance(hosts, bytearray))
+        self.assertEqual(len(hosts), cacher.ipv4BitmapSize)
+        self.assertEqual(list(addresses), sorted(expected))
+
+    def test_update(self):
+        for first, second in ((0, 500), (500, 9000), (9000, 500),
+                              (9000, 9000), (3000, 3000)):
+            addresses, expected = make_sets(self.rand, self.networks, first)
+            other, otherExpected = make_sets(self.rand, self.networks,
+                                             second)
+            addresses.update(other)
+            expected.update(otherExpected)
+            self.assertEqual(len(addresses), len(expected))
+            self.assertEqual(list(addresses), sorted(expected))
+            self.assertEqual(list(other), sorted(otherExpected))
+
+    def test_to_dict(self):
+        for count in (0, 100, 9000):
+            addresses, expected = make_sets(self.rand, self.networks, count)
+            loaded = cacher.IPv4Set.from_dict(json.loads(json.dumps(
+                addresses.to_dict())))
+            self.assertEqual(len(loaded), len(expected))
+            self.assertEqual(list(loaded), sorted(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
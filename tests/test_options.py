@@ -0,0 +1,98 @@
+#!/usr/bin/python
+
+"""The checks main() makes of --fleet, --top and --topfiles."""
+
+import StringIO
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(testDir, '..'))
+sys.path.insert(0, os.path.join(testDir, '..', 'benchmarks'))
+import cacher  # noqa: E402
+import loggen  # noqa: E402
+
+targetDate = '2017-01-15'
+
+
+def run_main(args):
+    # Run cacher.py with args. Returns its exit code and output.
+    argv, stdout = sys.argv, sys.stdout
+    sys.argv = ['cacher.py'] + args
+    sys.stdout = StringIO.StringIO()
+    try:
+        cacher.main()
+        code = 0
+    except SystemExit as e:
+        code = e.code
+    finally:
+        output = sys.stdout.getvalue()
+        sys.argv, sys.stdout = argv, stdout
+    return code, output
+
+
+class OptionsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Two servers, the path of one of them with a '=' in it.
+        cls.tmpDir = tempfile.mkdtemp()
+        cls.servers = [('lab', os.path.join(cls.tmpDir, 'lab')),
+                       ('office', os.path.join(cls.tmpDir, 'office=2'))]
+        for seed, (name, serverPath) in enumerate(cls.servers):
+            generator = loggen.LogGenerator(targetDate, 1, 500, seed=seed)
+            loggen.write_logs(serverPath, generator, 1, False)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpDir)
+
+    def fleet_args(self):
+        args = ['--targetdate', targetDate]
+        for name, serverPath in self.servers:
+            args += ['--fleet', '%s=%s' % (name, serverPath)]
+        return args
+
+    def assertExits(self, args, message):
+        code, output = run_main(args)
+        self.assertEqual(code, 1)
+        self.assertEqual(output, message + '\n')
+
+    def test_fleet(self):
+        code, output = run_main(self.fleet_args() + ['--top', '2'])
+        self.assertEqual(code, 0)
+        for title in ['%s on lab' % targetDate, '%s on office' % targetDate,
+                      '%s on all 2 servers' % targetDate]:
+            self.assertIn('Cacher has retrieved the following stats for %s:'
+                          % title, output)
+        self.assertEqual(output.count('Top 2 clients by GET requests:'), 3)
+
+    def test_fleet_format(self):
+        for fleet in ['lab', 'lab=', '=/Volumes/Logs/lab']:
+            self.assertExits(['--fleet', fleet],
+                             '--fleet must be in the format NAME=PATH')
+        self.assertExits(['--fleet', 'lab=/a', '--fleet', 'lab=/b'],
+                         '--fleet names must be unique')
+        self.assertExits(['--fleet', 'lab=/a', '--logpath', '/b'],
+                         '--fleet can not be used with --logpath or --follow')
+
+    def test_fleet_missing(self):
+        missing = os.path.join(self.tmpDir, 'missing')
+        self.assertExits(self.fleet_args() + ['--fleet', 'lost=' + missing],
+                         'Cacher did not detect log files in %s' % missing)
+
+    def test_top(self):
+        for name in ('--top', '--topfiles'):
+            for value in (0, -1, cacher.topCapacity + 1):
+                self.assertExits(
+                    [name, str(value)], '%s must be between 1 and %s' % (
+                        name, cacher.topCapacity))
+            code, output = run_main(self.fleet_args() +
+                                    [name, str(cacher.topCapacity)])
+            self.assertEqual(code, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/python
+
+"""Parallel parsing gives the same stats as parsing in a single process.
+
+The logs are generated with benchmarks/loggen.py, once as a single plain
+Debug.log and once with bz2 archives. minChunkSize is made tiny, so the
+plain logs are split into many ranges whose raw boundaries fall in the
+middle of lines.
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(testDir, '..'))
+sys.path.insert(0, os.path.join(testDir, '..', 'benchmarks'))
+import cacher  # noqa: E402
+import loggen  # noqa: E402
+
+targetDates = ['2017-01-15', '2017-01-16', '2017-01-17']
+windows = [(None, None), ('06:30', None), (None, '17:45'),
+           ('08:00', '12:00')]
+
+
+def make_logs(outDir, files, compress):
+    # Fewer clients than the top summaries hold, so they are exact too.
+    generator = loggen.LogGenerator(targetDates[0], len(targetDates), 4000,
+                                    clients=500, assets=2000, restarts=2)
+    return loggen.write_logs(outDir, generator, files, compress)
+
+
+def get_stats(days):
+    # The DayStats of every date as comparable data: the Counter and
+    # SpaceSaving items are stored in dict order by to_dict().
+    stats = {}
+    for datestr, day in days.items():
+        data = json.loads(json.dumps(day.to_dict()))
+        for name, value in data.items():
+            if isinstance(value, list) and value and \
+                    isinstance(value[0], list):
+                data[name] = sorted(value)
+            elif isinstance(value, dict) and 'counts' in value:
+                value['counts'] = sorted(value['counts'])
+                value['errors'] = sorted(value['errors'])
+        stats[datestr] = data
+    return stats
+
+
+def split_floats(value, floats):
+    # Take the floats (the bandwidth) out of value, into floats. They are
+    # added up in a different order when the logs are split, so they are
+    # only equal up to rounding.
+    if isinstance(value, float):
+        floats.append(value)
+        return float
+    if isinstance(value, list):
+        return [split_floats(x, floats) for x in value]
+    if isinstance(value, dict):
+        return dict((k, split_floats(v, floats))
+                    for k, v in sorted(value.items()))
+    return value
+
+
+class ParallelTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpDir = tempfile.mkdtemp()
+        cls.logs = {
+            'plain': make_logs(os.path.join(cls.tmpDir, 'plain'), 1, False),
+            'bz2': make_logs(os.path.join(cls.tmpDir, 'bz2'), 4, True),
+        }
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpDir)
+
+    def setUp(self):
+        self.minChunkSize = cacher.minChunkSize
+        cacher.minChunkSize = 997
+
+    def tearDown(self):
+        cacher.minChunkSize = self.minChunkSize
+
+    def assertStatsEqual(self, first, second, msg=None):
+        firstFloats = []
+        secondFloats = []
+        self.assertEqual(split_floats(first, firstFloats),
+                         split_floats(second, secondFloats), msg)
+        for x, y in zip(firstFloats, secondFloats):
+            self.assertTrue(abs(x - y) <= 1e-9 * max(abs(x), 1), msg)
+
+    def test_split_mid_line(self):
+        logFile = self.logs['plain'][0]
+        size = os.path.getsize(logFile)
+        ranges = cacher.split_logrange(logFile, 0, size, 7)
+        self.assertEqual(len(ranges), 7)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], size)
+        chunkSize = size // 7 + 1
+        with open(logFile, 'rb') as f:
+            for (start, end), nextRange in zip(ranges, ranges[1:]):
+                self.assertEqual(end, nextRange[0])
+                # The raw boundary is in the middle of a line, the range
+                # ends with the rest of it.
+                f.seek(start + chunkSize - 1)
+                self.assertNotEqual(f.read(1), '\n')
+                f.seek(end - 1)
+                self.assertEqual(f.read(1), '\n')
+
+    def test_jobs(self):
+        for name, logFiles in sorted(self.logs.items()):
+            for since, until in windows:
+                serial = get_stats(cacher.parse_files(
+                    logFiles, targetDates, since=since, until=until))
+                self.assertTrue(any(x['requestCount']
+                                    for x in serial.values()))
+                for jobs in (2, 3, 7):
+                    parallel = get_stats(cacher.parse_files(
+                        logFiles, targetDates, since=since, until=until,
+                        jobs=jobs))
+                    self.assertStatsEqual(serial, parallel,
+                                          '%s logs, --jobs %s, %s-%s' % (
+                                              name, jobs, since, until))
+
+    def test_decompress_threads(self):
+        logFiles = self.logs['bz2']
+        serial = get_stats(cacher.parse_files(logFiles, targetDates,
+                                              threads=0))
+        for threads in (1, 4):
+            self.assertStatsEqual(serial, get_stats(cacher.parse_files(
+                logFiles, targetDates, threads=threads)))
+
+
+if __name__ == '__main__':
+    unittest.main()
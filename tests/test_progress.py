@@ -0,0 +1,68 @@
+#!/usr/bin/python
+
+"""Progress estimates how much of the logs is parsed, archives included."""
+
+import StringIO
+import os
+import sys
+import unittest
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(testDir, '..'))
+import cacher  # noqa: E402
+
+
+class ProgressTest(unittest.TestCase):
+    def setUp(self):
+        self.stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+
+    def last_report(self):
+        return sys.stderr.getvalue().splitlines()[-1]
+
+    def test_plain(self):
+        tasks = [(1000, False), (3000, False)]
+        progress = cacher.Progress(tasks, interval=0)
+        progress.begin(tasks[0])
+        progress.advance(500, 10)
+        self.assertIn('Parsed 10 lines', self.last_report())
+        self.assertIn(', 12%, ETA ', self.last_report())
+        progress.complete(tasks[0], 20)
+        progress.begin(tasks[1])
+        progress.advance(1000, 30)
+        self.assertIn('Parsed 50 lines', self.last_report())
+        self.assertIn(', 50%, ETA ', self.last_report())
+        progress.complete(tasks[1], 60)
+        progress.report(True)
+        self.assertIn('Parsed 80 lines', self.last_report())
+        self.assertIn(', 100% in 0:00:00', self.last_report())
+
+    def test_archives(self):
+        # The archives are estimated to decompress tenfold until one has
+        # been parsed, then as much as that one did.
+        tasks = [(100, True), (100, True), (2000, False)]
+        progress = cacher.Progress(tasks, interval=0)
+        progress.begin(tasks[0])
+        progress.advance(1000, 10)
+        self.assertIn(', 25%, ', self.last_report())
+        progress.advance(1000, 10)
+        progress.complete(tasks[0], 20)
+        self.assertEqual(progress.ratio, 20.0)
+        self.assertIn(', 33%, ', self.last_report())
+
+    def test_interval(self):
+        tasks = [(1000, False)]
+        progress = cacher.Progress(tasks, interval=60)
+        progress.begin(tasks[0])
+        progress.advance(500, 10)
+        progress.complete(tasks[0], 20)
+        self.assertEqual(sys.stderr.getvalue(), '')
+        progress.report(True)
+        self.assertEqual(sys.stderr.getvalue().count('\n'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+
+"""Reports on GET requests whose client identity leaves something out."""
+
+import json
+import os
+import sys
+import unittest
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(testDir, '..'))
+import cacher  # noqa: E402
+
+targetDate = '2017-01-15'
+bandwidthLine = ('2017-01-15 08:40:00.000 Since server start: 1.09 GB '
+                 'returned to clients, 12.51 MB stored from Internet, 0 bytes '
+                 'from peers; 0 bytes imported.\n')
+requestLine = ('2017-01-15 08:41:%02d.412 #a1b2c3d4 Received GET request '
+               'from 10.0.1.%s:50012, user agent: com.apple.appstored/1.0 '
+               '%s build/14C92 (6; dt:133), for /a-09f98d6971/app%s.ipa\n')
+
+
+def make_lines(identities):
+    lines = [bandwidthLine]
+    for index, identity in enumerate(identities):
+        lines.append(requestLine % (index, index + 1, identity, index))
+    return lines
+
+
+class ModelTest(unittest.TestCase):
+    def setUp(self):
+        cacher.identityCache.clear()
+        cacher.identityCache.older.clear()
+
+    def check_report(self, identities, models):
+        day = cacher.parse_days(make_lines(identities), [targetDate])[
+            targetDate]
+        self.assertEqual(day.requestCount, len(identities))
+        self.assertEqual(dict(day.modelCounts), models)
+        self.assertEqual(sum(day.osCounts.values()), len(identities))
+        # The report renders with friendly names and model identifiers,
+        # from the parsed stats and from the aggregate cache.
+        cached = cacher.DayStats.from_dict(json.loads(json.dumps(
+            day.to_dict())))
+        for stats in (day, cached):
+            for friendlyNames in (True, False):
+                report = cacher.cacher_report(stats, targetDate,
+                                              friendlyNames, uptime='1 day')
+                self.assertIn(' %s iOS downloads:' % len(identities),
+                              report)
+        return report
+
+    def test_no_model(self):
+        report = self.check_report(
+            ['iOS/10.2 model/iPhone7,2', 'iOS/10.2', 'iOS/10.2.1'],
+            {'iPhone7,2': 1})
+        self.assertIn(' A total of 1 iPhone downloads', report)
+
+    def test_bad_model(self):
+        # ' model/' without an identifier, before and after the OS.
+        self.check_report(
+            ['iOS/10.2 model/', 'model/ iOS/10.2', 'model/x iOS/10.2',
+             'iOS/10.2 model/iPad5,3'],
+            {'iPad5,3': 1})
+        for identity in ('iOS/10.2 model/', 'model/ iOS/10.2'):
+            self.assertEqual(cacher.resolve_identity(identity),
+                             ('iOS', '10.2', None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+#!/usr/bin/python
+
+"""Week, month and range reports from the rollup store, without the logs."""
+
+import StringIO
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(testDir, '..'))
+sys.path.insert(0, os.path.join(testDir, '..', 'benchmarks'))
+import cacher  # noqa: E402
+from test_parallel import make_logs, targetDates  # noqa: E402
+
+
+class FailingConnection(object):
+    # Wraps a connection to the rollup store: inserts fail like a full disk
+    # would, and close() is recorded.
+    def __init__(self, db):
+        self.db = db
+        self.closed = False
+
+    def execute(self, sql, *args):
+        if sql.startswith('INSERT'):
+            raise sqlite3.OperationalError('database or disk is full')
+        return self.db.execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.execute(sql, *args)
+
+    def __enter__(self):
+        return self.db.__enter__()
+
+    def __exit__(self, *args):
+        return self.db.__exit__(*args)
+
+    def close(self):
+        self.closed = True
+        self.db.close()
+
+
+class RollupTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpDir = tempfile.mkdtemp()
+        logFiles = make_logs(os.path.join(cls.tmpDir, 'logs'), 2, True)
+        cls.days = cacher.parse_files(logFiles, targetDates)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpDir)
+
+    def setUp(self):
+        self.rollupFile = os.path.join(self.tmpDir, 'rollups.db')
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        if os.path.exists(self.rollupFile):
+            os.remove(self.rollupFile)
+
+    def store(self, targetDates):
+        for targetDate in targetDates:
+            cacher.store_rollup(self.rollupFile, targetDate,
+                                self.days[targetDate], 0.01)
+
+    def report(self, startDate, endDate, previousStart='2017-01-01',
+               previousEnd='2017-01-14'):
+        report = cacher.rollup_report(self.rollupFile, 'range', startDate,
+                                      endDate, previousStart, previousEnd,
+                                      True)
+        return report and '\n'.join(report)
+
+    def test_reportrange(self):
+        self.assertEqual(
+            cacher.get_reportrange('week', None, None, '2017-01-18'),
+            ['2017-01-16', '2017-01-22', '2017-01-09', '2017-01-15'])
+        self.assertEqual(
+            cacher.get_reportrange('month', None, None, '2017-03-15'),
+            ['2017-03-01', '2017-03-31', '2017-02-01', '2017-02-28'])
+        self.assertEqual(
+            cacher.get_reportrange('month', None, None, '2017-01-31'),
+            ['2017-01-01', '2017-01-31', '2016-12-01', '2016-12-31'])
+        self.assertEqual(
+            cacher.get_reportrange('range', '2017-01-15', '2017-01-17'),
+            ['2017-01-15', '2017-01-17', '2017-01-12', '2017-01-14'])
+
+    def test_report(self):
+        # Storing a day again replaces it.
+        self.store(targetDates)
+        self.store(targetDates[1:])
+        report = self.report(targetDates[0], targetDates[-1])
+        requests = sum(x.requestCount for x in self.days.values())
+        models = sum(sum(x.modelCounts.values()) for x in self.days.values())
+        self.assertIn('%d IP Addresses hit the Caching Server' % requests,
+                      report)
+        self.assertIn('A total of %d iOS downloads were requested from the '
+                      'Caching Server consisting of:' % models, report)
+        self.assertIn('Busiest day: ', report)
+        self.assertNotIn('WARNING', report)
+
+    def test_previous(self):
+        self.store(targetDates)
+        report = self.report(targetDates[1], targetDates[2], targetDates[0],
+                             targetDates[0])
+        self.assertIn('%d IP Addresses hit the Caching Server (previous 2 '
+                      'days: %d, ' % (self.days[targetDates[1]].requestCount +
+                                      self.days[targetDates[2]].requestCount,
+                                      self.days[targetDates[0]].requestCount),
+                      report)
+
+    def test_missing(self):
+        self.store(targetDates[:1])
+        report = self.report(targetDates[0], targetDates[1])
+        self.assertIn('WARNING: No rollups were found for 1 of 2 days: %s' %
+                      targetDates[1], report)
+        self.assertEqual(self.report('2016-01-01', '2016-01-31'), None)
+        self.assertIn('Cacher did not find any rollups', sys.stdout.getvalue())
+
+    def test_store_failure(self):
+        # A failed store is rolled back, so the day stored before is kept,
+        # and the connection is closed.
+        self.store(targetDates[:1])
+        expected = self.report(targetDates[0], targetDates[0])
+        connections = []
+        open_rollups = cacher.open_rollups
+
+        def failing_rollups(rollupFile):
+            connections.append(FailingConnection(open_rollups(rollupFile)))
+            return connections[-1]
+        cacher.open_rollups = failing_rollups
+        try:
+            self.store(targetDates[:1])
+        finally:
+            cacher.open_rollups = open_rollups
+        self.assertTrue(connections[0].closed)
+        self.assertIn('Failed to store rollup for %s in %s: database or disk '
+                      'is full' % (targetDates[0], self.rollupFile),
+                      sys.stdout.getvalue())
+        self.assertEqual(self.report(targetDates[0], targetDates[0]),
+                         expected)
+
+    def test_version(self):
+        db = sqlite3.connect(self.rollupFile)
+        db.execute('PRAGMA user_version = %d' % (cacher.rollupVersion + 1))
+        db.close()
+        self.store(targetDates[:1])
+        self.assertIn('Failed to store rollup', sys.stdout.getvalue())
+        self.assertEqual(self.report(targetDates[0], targetDates[0]), None)
+        self.assertIn('Cacher could not open the rollup store',
+                      sys.stdout.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/python
+
+"""Sampled runs count the same GET requests with any number of jobs."""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(testDir, '..'))
+sys.path.insert(0, os.path.join(testDir, '..', 'benchmarks'))
+import cacher  # noqa: E402
+from test_parallel import (get_stats, make_logs, split_floats,  # noqa: E402
+                           targetDates)
+
+
+class SampleTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpDir = tempfile.mkdtemp()
+        # A plain log is split into ranges for --jobs, the archives are not.
+        cls.logFiles = make_logs(os.path.join(cls.tmpDir, 'logs'), 3, True)
+        cls.logFiles += make_logs(os.path.join(cls.tmpDir, 'plain'), 1,
+                                  False)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpDir)
+
+    def setUp(self):
+        self.minChunkSize = cacher.minChunkSize
+        cacher.minChunkSize = 997
+
+    def tearDown(self):
+        cacher.minChunkSize = self.minChunkSize
+
+    def parse(self, sample, jobs):
+        # The sampled stats, without the bandwidth (not sampled, and only
+        # equal up to rounding), and the number of requests left out.
+        profile = cacher.Profiler()
+        days = cacher.parse_files(self.logFiles, targetDates, jobs=jobs,
+                                  profile=profile, sample=sample)
+        return (split_floats(get_stats(days), []),
+                profile.rules['unsampled'])
+
+    def test_jobs(self):
+        for method in ('hash', 'stride'):
+            sample = (0.1, method)
+            serial, unsampled = self.parse(sample, 1)
+            requests = sum(x['requestCount'] for x in serial.values())
+            self.assertTrue(requests)
+            self.assertTrue(unsampled > requests)
+            for jobs in (2, 3):
+                self.assertEqual(self.parse(sample, jobs),
+                                 (serial, unsampled),
+                                 '%s sample, --jobs %s' % (method, jobs))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+
+"""StatsServer serves the published stats for Prometheus and as JSON."""
+
+import json
+import os
+import sys
+import unittest
+import urllib2
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(testDir, '..'))
+import cacher  # noqa: E402
+from test_report import make_lines, targetDate  # noqa: E402
+
+
+class StatsServerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = cacher.StatsServer(0)
+        self.url = 'http://127.0.0.1:%s' % (
+            self.server.httpd.server_address[1])
+        self.server.start()
+        lines = make_lines(['iOS/10.2 model/iPhone7,2', 'iOS/10.2',
+                            'Mac OS X/10.12.2'])
+        self.days = cacher.parse_days(lines, [targetDate])
+        self.toClients = cacher.to_bytes('1.09', 'GB')
+
+    def tearDown(self):
+        self.server.httpd.shutdown()
+        self.server.httpd.server_close()
+
+    def get(self, path):
+        response = urllib2.urlopen(self.url + path, timeout=5)
+        try:
+            return response.info()['Content-Type'], response.read()
+        finally:
+            response.close()
+
+    def test_metrics(self):
+        self.server.publish(self.days, 4)
+        contentType, body = self.get('/metrics')
+        self.assertEqual(contentType, 'text/plain; version=0.0.4')
+        metrics = body.splitlines()
+        for line in [
+                '# TYPE cacher_requests gauge',
+                'cacher_requests{date="%s"} 3' % targetDate,
+                'cacher_unique_clients{date="%s"} 3' % targetDate,
+                'cacher_os_requests{date="%s",family="iOS",version="10.2"} 2'
+                % targetDate,
+                'cacher_model_requests{date="%s",model="iPhone7,2"} 1'
+                % targetDate,
+                'cacher_server_bytes{direction="returnedToClients"} %r'
+                % self.toClients,
+                '# TYPE cacher_lines_parsed_total counter',
+                'cacher_lines_parsed_total 4']:
+            self.assertIn(line, metrics)
+
+    def test_json(self):
+        self.server.publish(self.days, 4)
+        contentType, body = self.get('/stats.json?pretty=1')
+        self.assertEqual(contentType, 'application/json')
+        stats = json.loads(body)
+        self.assertEqual(stats['linesParsed'], 4)
+        self.assertEqual(stats['server']['returnedToClients'],
+                         self.toClients)
+        day = stats['days'][targetDate]
+        self.assertEqual(day['requests'], 3)
+        self.assertEqual(day['models'], {'iPhone7,2': 1})
+        self.assertEqual(len(day['hourly']), 24)
+        self.assertEqual(day['hourly'][8]['requests'], 3)
+
+    def test_publish(self):
+        # Until the first publish(), there are no days to serve.
+        self.assertEqual(json.loads(self.get('/stats.json')[1])['days'], {})
+        self.server.publish(self.days, 4)
+        self.assertEqual(list(json.loads(self.get('/stats.json')[1])[
+            'days']), [targetDate])
+
+    def test_not_found(self):
+        with self.assertRaises(urllib2.HTTPError) as context:
+            self.get('/')
+        self.assertEqual(context.exception.code, 404)
+
+    def test_escape(self):
+        metrics = []
+        cacher.add_metric(metrics, 'model_requests', 'gauge', 'Help.',
+                          [([('model', 'a"b\\c\nd')], 1)])
+        self.assertEqual(metrics[2],
+                         'cacher_model_requests{model="a\\"b\\\\c\\nd"} 1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/python
+
+"""SpaceSaving stays within its error bounds, and --topfiles reports."""
+
+from collections import Counter
+import json
+import os
+import random
+import sys
+import unittest
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(testDir, '..'))
+import cacher  # noqa: E402
+from test_report import bandwidthLine, requestLine, targetDate  # noqa: E402
+
+
+def make_stream(rand, items, count):
+    # A few busy items and a long tail, like the clients of a day.
+    return [int(rand.paretovariate(1.2)) % items for i in range(count)]
+
+
+class SpaceSavingTest(unittest.TestCase):
+    def setUp(self):
+        self.rand = random.Random(1)
+
+    def count(self, stream, capacity):
+        summary = cacher.SpaceSaving(capacity)
+        for item in stream:
+            summary[item] += 1
+        return summary
+
+    def assertBounds(self, summary, expected):
+        # Counts are never too low and at most their error too high, and
+        # every item dropped was counted at most floor times.
+        self.assertTrue(summary.floor)
+        self.assertTrue(len(summary) <= 2 * summary.capacity)
+        for item, count in expected.items():
+            if item in summary:
+                error = summary.errors.get(item, 0)
+                self.assertTrue(count <= summary[item] <= count + error)
+                self.assertTrue(error <= summary.floor)
+            else:
+                self.assertTrue(count <= summary.floor)
+        for item, count, error in summary.top(5):
+            self.assertTrue(count - error <= expected[item] <= count)
+
+    def test_exact(self):
+        stream = make_stream(self.rand, 40, 5000)
+        summary = self.count(stream, 20)
+        self.assertEqual(summary.floor, 0)
+        self.assertEqual(summary.errors, {})
+        self.assertEqual(dict(summary), dict(Counter(stream)))
+
+    def test_bounds(self):
+        stream = make_stream(self.rand, 2000, 20000)
+        expected = Counter(stream)
+        summary = self.count(stream, 20)
+        self.assertBounds(summary, expected)
+        # The busiest items stand out far enough to be found.
+        self.assertEqual([x[0] for x in summary.top(3)],
+                         [x[0] for x in expected.most_common(3)])
+
+    def test_merge(self):
+        stream = make_stream(self.rand, 2000, 20000)
+        summary = self.count(stream[:5000], 20)
+        summary.merge(self.count(stream[5000:], 20))
+        self.assertBounds(summary, Counter(stream))
+        # A summary that never had to drop anything merges exactly.
+        exact = self.count(stream[:30], 20)
+        exact.merge(self.count(stream[30:60], 20))
+        self.assertEqual(dict(exact), dict(Counter(stream[:60])))
+
+    def test_to_dict(self):
+        summary = self.count(make_stream(self.rand, 2000, 5000), 20)
+        loaded = cacher.SpaceSaving.from_dict(json.loads(json.dumps(
+            summary.to_dict())))
+        self.assertEqual(dict(loaded), dict(summary))
+        self.assertEqual(loaded.errors, summary.errors)
+        self.assertEqual(loaded.floor, summary.floor)
+
+
+class TopFilesTest(unittest.TestCase):
+    # app0.ipa is requested 12 times, app1.ipa 5 times and app2-4.ipa once.
+    requests = [0] * 12 + [1] * 5 + [2, 3, 4]
+
+    def parse(self, sketchError=None):
+        lines = [bandwidthLine]
+        for index, app in enumerate(self.requests):
+            lines.append(requestLine % (index, index + 1, 'iOS/10.2', app))
+        return cacher.parse_days(lines, [targetDate],
+                                 sketchError=sketchError)[targetDate]
+
+    def test_top_files(self):
+        for sketchError in (None, 0.01):
+            self.assertEqual(self.parse(sketchError).top_files(2), [
+                ('/a-09f98d6971/app0.ipa', 12, 0),
+                ('/a-09f98d6971/app1.ipa', 5, 0)])
+
+    def test_files_report(self):
+        report = cacher.files_report(self.parse(), 2)
+        self.assertEqual(report[:4], [
+            'Top 2 files by GET requests:',
+            ' 12 requests for /a-09f98d6971/app0.ipa',
+            ' 5 requests for /a-09f98d6971/app1.ipa', ''])
+        self.assertIn('15 of 20 GET requests were for a file requested '
+                      'before (75.0%).', report)
+        histogram = report[report.index(' .ipa files:') + 1:]
+        self.assertEqual(histogram[:3], ['  3 requested once',
+                                         '  1 requested 2-10 times',
+                                         '  1 requested 11-100 times'])
+
+    def test_files_report_approximate(self):
+        report = cacher.files_report(self.parse(0.01), 1)
+        self.assertEqual(report[1], ' 12 requests for /a-09f98d6971/app0.ipa')
+        self.assertIn('The number of requests per file is only counted '
+                      'without --approximate.', report)
+
+
+if __name__ == '__main__':
+    unittest.main()